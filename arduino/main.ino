@@ -4,33 +4,76 @@
  *
  * Description: A simple firmware for an ArduinoUNO controller to manage a 5x6 LED-matrix
  *      with multiplexing. The used shift register if the 74HC595 (todo: link to build plan).
- *      The firmware saves the animation within the EEPROM and gives the user the ability to
+ *      The firmware saves the animations within the EEPROM and gives the user the ability to
  *      change animations with help of a simple protocol. An implementation of a client is
  *      in the "client" directory of this project.
+ *
+ * EEPROM layout: the first DATA_ADDR bytes are the clip directory ("NS", id of the active slot and
+ *      the first frame and frame count of every slot). The frames of all slots follow packed without
+ *      gaps, so the free frames are always at the end.
+ *
+ * Protocol: the device sends "nsrd" when it has booted (e.g. after the reset by opening the port), so clients
+ *      don't need to wait a fixed time.
+ *
+ * Live mode: after a "live"-request every packet of 4 bytes is a frame (the 30 bit setup, big endian), which is
+ *      shown immediately without touching the EEPROM. Setups never use the top 2 bits, so a "stop"-request can be
+ *      told apart from frames and ends the live mode.
+ *
+ * Flash clip: built with FLASH_CLIP defined, the firmware plays the clip of flash_clip.h (generated by
+ *      client/FlashImage.py) instead of the EEPROM slots. Its records are the same as in the EEPROM, but the flash
+ *      holds about 25 times more of them. The serial protocol still manages the EEPROM slots.
  */
 
 #include <Arduino.h>
 #include <EEPROM.h>
 
 #define FRAME_SIZE 5 // Frame size in byte
-#define MAX_FRAME_COUNT 200 // Maximum amount of frames, that can be stored
+#define MAX_FRAME_COUNT 200 // Maximum amount of frames, that can be stored (all slots together)
+#define SLOT_COUNT 4 // Amount of clips, that can be stored
+#define DIR_ACTIVE_ADDR 2 // Address of the id of the active slot (after the magic "NS")
+#define DIR_SLOTS_ADDR 3 // Address of the slot table (first frame and frame count per slot)
+#define DATA_ADDR 16 // Address of the first frame
+#define DEFAULT_CLIP_LENGTH 13 // Amount of frames of the default clip
 #define STEP_DURATION 100 // Time of an animation step
 #define LINE_AMOUNT 5
 #define LINE_OFFSET 1 // It was easier not to connect Q0, so the first line is connected to Q1
+#define LIVE_FRAME_SIZE 4 // Size of a frame in live mode in byte
+
+// Play the clip compiled into the flash ("make FLASH_CLIP=1" or uncomment the next line)
+// #define FLASH_CLIP
+#ifdef FLASH_CLIP
+#include "flash_clip.h"
+#endif
 
 // === Animation management ===
 void restartAnimation();
 void loadFrame(int i);
+void loadFlashFrame(unsigned short i);
+void showRecord(const byte* record);
 void saveFrame(int frameId, char* frame);
-void setEndFlag(int frameId);
-bool isEndFlag(int frameId);
-void writeDefaultClip();
+void writeDefaultClip(byte slot);
+void showSetup(unsigned long setup);
+
+// === Clip directory ===
+void formatDirectory();
+void loadActiveSlot();
+byte slotStart(byte slot);
+byte slotLength(byte slot);
+void setSlot(byte slot, byte start, byte length);
+byte usedFrames();
+void freeSlot(byte slot);
+
+// Active clip
+byte activeSlot = 0; // Id of the slot, which is played
+byte activeStart = 0; // Id of the first frame of the active clip
+byte activeLength = 0; // Amount of frames of the active clip
 
 // Current frame state
 unsigned short curFrameDuration = 0; // Left duration of the current frame
 byte curFrame[LINE_AMOUNT]; // Current frame (one byte is one line)
 byte curLine = 0; // Id of the line, that should be currently on
 unsigned short nextFrameId = 0; // Id of the next frame
+bool liveMode = false; // Indicates whether the frames are streamed by the host
 
 // Timestamp of the last step
 unsigned long lastStepTime = 0;
@@ -44,8 +87,15 @@ int dataPin = 11; // Pin connected to DS of 74HC595
 // === Transmission ===
 void processRequest();
 void processPing();
-void processClipTransmission();
+void processClipTransmission(byte slot, const char* greeting);
+void processUpload();
+void processList();
+void processSwitch();
 void processReset();
+void processDump(byte slot);
+void processLive();
+void processLiveFrame();
+unsigned short crc16Update(unsigned short crc, byte data);
 // Pin to indicate whether transmission is in progress
 int infoPin = 13;
 // ========
@@ -59,22 +109,41 @@ void setup() {
     // Data transmission setup
     pinMode(infoPin, OUTPUT);
     Serial.begin(9600);
+
+    // Clip setup
+    formatDirectory();
+    loadActiveSlot();
+
+    Serial.write("nsrd"); // Tell the client, that the device is ready
 }
 
 void loop() {
 
-    // Load next frame, when it's over
-    if (curFrameDuration < 1) {
+    // Load next frame, when it's over (in live mode the host sets the frame)
+    if (!liveMode && curFrameDuration < 1) {
+#ifdef FLASH_CLIP
         // Restart animation, if the end is reached
-        if (isEndFlag(nextFrameId)) {
+        if (nextFrameId >= FLASH_CLIP_LENGTH) {
+            restartAnimation();
+        }
+        if (FLASH_CLIP_LENGTH > 0) {
+            loadFlashFrame(nextFrameId);
+            nextFrameId++;
+        }
+#else
+        // Restart animation, if the end is reached
+        if (nextFrameId >= activeLength) {
             // Write default clip into EEPROM, if there is no clip stored
-            if (nextFrameId == 0) {
-                writeDefaultClip();
+            if (activeLength == 0) {
+                writeDefaultClip(activeSlot);
             }
             restartAnimation();
         }
-        loadFrame(nextFrameId);
-        nextFrameId++;
+        if (activeLength > 0) {
+            loadFrame(activeStart + nextFrameId);
+            nextFrameId++;
+        }
+#endif
     }
 
     // Render current line
@@ -105,17 +174,41 @@ void serialEvent() {
  * \param i the id of the frame
  */
 void loadFrame(int i) {
+    byte record[FRAME_SIZE];
+    int startAddr = DATA_ADDR + i * FRAME_SIZE;
+    for (byte j = 0; j < FRAME_SIZE; j++) {
+        record[j] = EEPROM.read(startAddr + j);
+    }
+    showRecord(record);
+}
+
+#ifdef FLASH_CLIP
+/**
+ * Loads a frame of the clip in the flash like loadFrame
+ *
+ * \param i the id of the frame
+ */
+void loadFlashFrame(unsigned short i) {
+    byte record[FRAME_SIZE];
+    memcpy_P(record, flashClip + (unsigned int) i * FRAME_SIZE, FRAME_SIZE);
+    showRecord(record);
+}
+#endif
 
-    int startAddr = i * FRAME_SIZE;
-    byte durationBuffer = EEPROM.read(startAddr);
-    curFrameDuration = (durationBuffer << 2) + (EEPROM.read(startAddr + 1) >> 6);
+/**
+ * Puts a record into the curFrame variable and its duration into the curFrameDuration variable
+ *
+ * \param record the record (a frame as stored in the EEPROM)
+ */
+void showRecord(const byte* record) {
+    curFrameDuration = (record[0] << 2) + (record[1] >> 6);
 
     // Load next frame, by masking the necessary bits (bit flip is needed, because the shift register for the lines is a sink and needs to put to LOW)
-    curFrame[0] = EEPROM.read(startAddr + 1) & 63; // 63 = 00111111
-    curFrame[1] = EEPROM.read(startAddr + 2) >> 2;
-    curFrame[2] = ((EEPROM.read(startAddr + 2) & 3) << 4) + (EEPROM.read(startAddr + 3) >> 4);
-    curFrame[3] = ((EEPROM.read(startAddr + 3) & 15) << 2) + (EEPROM.read(startAddr + 4) >> 6);
-    curFrame[4] = EEPROM.read(startAddr + 4) & 63;
+    curFrame[0] = record[1] & 63; // 63 = 00111111
+    curFrame[1] = record[2] >> 2;
+    curFrame[2] = ((record[2] & 3) << 4) + (record[3] >> 4);
+    curFrame[3] = ((record[3] & 15) << 2) + (record[4] >> 6);
+    curFrame[4] = record[4] & 63;
 
     // Put the bits to right position according to the line offset and flip them, because the cols needs to be LOW to be on
     for (unsigned short j = 0; j < LINE_AMOUNT; j++) {
@@ -124,25 +217,27 @@ void loadFrame(int i) {
 }
 
 /**
- * Saves a frame at desired position
+ * Shows a setup immediately (used by the live mode)
  *
- * \param frameId index (position) of the frame
- * \param frame the frame that should be written in
+ * \param setup the 30 bit setup, the first star is the most significant bit
  */
-void saveFrame(int frameId, char* frame) {
-    for (byte i = 0; i < FRAME_SIZE; i++) {
-        EEPROM.write(frameId * FRAME_SIZE + i, frame[i]);
+void showSetup(unsigned long setup) {
+    for (byte j = 0; j < LINE_AMOUNT; j++) {
+        byte line = (setup >> (6 * (LINE_AMOUNT - 1 - j))) & 63;
+        curFrame[j] = ~(line << LINE_OFFSET);
     }
 }
 
 /**
- * Sets end of clip at desired position
+ * Saves a frame at desired position
  *
- * \param frameId index (position) of end frame
+ * \param frameId index (position) of the frame
+ * \param frame the frame that should be written in
  */
-void setEndFlag(int frameId) {
-    EEPROM.write(frameId * FRAME_SIZE, 0);
-    EEPROM.write(frameId * FRAME_SIZE + 1, 0);
+void saveFrame(int frameId, char* frame) {
+    for (byte i = 0; i < FRAME_SIZE; i++) {
+        EEPROM.write(DATA_ADDR + frameId * FRAME_SIZE + i, frame[i]);
+    }
 }
 
 /**
@@ -155,20 +250,17 @@ void restartAnimation() {
 }
 
 /**
- * Checks whether the end of clip is reached
+ * Writes a default clip into EEPROM
  *
- * \param frameId index of the frame that should be checked
- * \return true if it's the end flag
+ * \param slot the slot, which gets the default clip
  */
-bool isEndFlag(int frameId) {
-    int startAddr = frameId * FRAME_SIZE;
-    return ((EEPROM.read(startAddr) << 8) + EEPROM.read(startAddr + 1)) == 0;
-}
+void writeDefaultClip(byte slot) {
+    freeSlot(slot);
+    byte start = usedFrames();
+    if (MAX_FRAME_COUNT - start < DEFAULT_CLIP_LENGTH) {
+        return; // No space left
+    }
 
-/**
- * Writes a default clip into EEPROM
- */
-void writeDefaultClip() {
     digitalWrite(infoPin, HIGH); // Indicating that there is some processing
 
     char frame[5];
@@ -176,29 +268,29 @@ void writeDefaultClip() {
 
     // Blink line by line
     frame[1] = 255;
-    saveFrame(0, frame);
+    saveFrame(start + 0, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = 3 << 6;
     frame[2] = 63 << 2;
-    saveFrame(1, frame);
+    saveFrame(start + 1, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = 3 << 6;
     frame[2] = 3;
     frame[3] = 15 << 4;
-    saveFrame(2, frame);
+    saveFrame(start + 2, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = 3 << 6;
     frame[3] = 15;
     frame[4] = 3 << 6;
-    saveFrame(3, frame);
+    saveFrame(start + 3, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = 3 << 6;
     frame[4] = 63;
-    saveFrame(4, frame);
+    saveFrame(start + 4, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     // Blink col by col
@@ -206,66 +298,174 @@ void writeDefaultClip() {
     frame[2] = 1 << 2;
     frame[3] = 1 << 4;
     frame[4] = (1 << 6) + 1;
-    saveFrame(5, frame);
+    saveFrame(start + 5, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = (3 << 6) + (1 << 1);
     frame[2] = 1 << 3;
     frame[3] = 1 << 5;
     frame[4] = (1 << 7) + (1 << 1);
-    saveFrame(6, frame);
+    saveFrame(start + 6, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = (3 << 6) + (1 << 2);
     frame[2] = 1 << 4;
     frame[3] = (1 << 6) + 1;
     frame[4] = 1 << 2;
-    saveFrame(7, frame);
+    saveFrame(start + 7, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = (3 << 6) + (1 << 3);
     frame[2] = 1 << 5;
     frame[3] = (1 << 7) + (1 << 1);
     frame[4] = 1 << 3;
-    saveFrame(8, frame);
+    saveFrame(start + 8, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = (3 << 6) + (1 << 4);
     frame[2] = (1 << 6) + 1;
     frame[3] = 1 << 2;
     frame[4] = 1 << 4;
-    saveFrame(9, frame);
+    saveFrame(start + 9, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     frame[1] = (3 << 6) + (1 << 5);
     frame[2] = (1 << 7) + (1 << 1);
     frame[3] = 1 << 3;
     frame[4] = 1 << 5;
-    saveFrame(10, frame);
+    saveFrame(start + 10, frame);
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 0; // Reset frame buffer
 
     // All off
     frame[1] = 3 << 6;
-    saveFrame(11, frame);
+    saveFrame(start + 11, frame);
 
     // All on for about 3 seconds
     frame[0] = 3;
     for (int j = 1; j < FRAME_SIZE; j++) frame[j] = 255;
-    saveFrame(12, frame);
+    saveFrame(start + 12, frame);
 
-    setEndFlag(13);
+    setSlot(slot, start, DEFAULT_CLIP_LENGTH);
+    loadActiveSlot();
 
     digitalWrite(infoPin, LOW);
 }
 
 // ========
 
+// === Clip directory functions ===
+
+/**
+ * Writes an empty clip directory, if the EEPROM doesn't contain one
+ */
+void formatDirectory() {
+    if (EEPROM.read(0) == 'N' && EEPROM.read(1) == 'S') {
+        return;
+    }
+
+    EEPROM.write(0, 'N');
+    EEPROM.write(1, 'S');
+    EEPROM.write(DIR_ACTIVE_ADDR, 0);
+    for (byte i = 0; i < SLOT_COUNT; i++) {
+        setSlot(i, 0, 0);
+    }
+}
+
+/**
+ * Loads the position of the active clip from the directory
+ */
+void loadActiveSlot() {
+    activeSlot = EEPROM.read(DIR_ACTIVE_ADDR);
+    if (activeSlot >= SLOT_COUNT) {
+        activeSlot = 0;
+    }
+    activeStart = slotStart(activeSlot);
+    activeLength = slotLength(activeSlot);
+}
+
+/**
+ * Returns the id of the first frame of a slot
+ *
+ * \param slot id of the slot
+ * \return id of the first frame
+ */
+byte slotStart(byte slot) {
+    return EEPROM.read(DIR_SLOTS_ADDR + slot * 2);
+}
+
+/**
+ * Returns the amount of frames of a slot
+ *
+ * \param slot id of the slot
+ * \return amount of frames (0 for empty slots)
+ */
+byte slotLength(byte slot) {
+    return EEPROM.read(DIR_SLOTS_ADDR + slot * 2 + 1);
+}
+
+/**
+ * Sets the position of the clip of a slot
+ *
+ * \param slot id of the slot
+ * \param start id of the first frame
+ * \param length amount of frames
+ */
+void setSlot(byte slot, byte start, byte length) {
+    EEPROM.update(DIR_SLOTS_ADDR + slot * 2, start);
+    EEPROM.update(DIR_SLOTS_ADDR + slot * 2 + 1, length);
+}
+
+/**
+ * Returns the amount of used frames of all slots
+ *
+ * \return amount of used frames
+ */
+byte usedFrames() {
+    byte used = 0;
+    for (byte i = 0; i < SLOT_COUNT; i++) {
+        used += slotLength(i);
+    }
+    return used;
+}
+
+/**
+ * Removes the clip of a slot and moves the frames behind it, so the free frames stay at the end
+ *
+ * \param slot id of the slot
+ */
+void freeSlot(byte slot) {
+    byte start = slotStart(slot);
+    byte length = slotLength(slot);
+    if (length == 0) {
+        return;
+    }
+
+    int endAddr = DATA_ADDR + usedFrames() * FRAME_SIZE;
+    for (int addr = DATA_ADDR + (start + length) * FRAME_SIZE; addr < endAddr; addr++) {
+        EEPROM.update(addr - length * FRAME_SIZE, EEPROM.read(addr));
+    }
+
+    for (byte i = 0; i < SLOT_COUNT; i++) {
+        if (slotLength(i) > 0 && slotStart(i) > start) {
+            setSlot(i, slotStart(i) - length, slotLength(i));
+        }
+    }
+    setSlot(slot, 0, 0);
+}
+
+// ========
+
 // === Transmission functions ===
 
 /**
  * Processes a request on the serial bus
  */
 void processRequest() {
+    if (liveMode) {
+        processLiveFrame();
+        return;
+    }
+
     digitalWrite(infoPin, HIGH);
 
     // Get initial message
@@ -275,25 +475,50 @@ void processRequest() {
 
     // Determine request type
     if (strcmp(msg, "helo") == 0) {
-        processClipTransmission();
+        processClipTransmission(activeSlot, "helo");
+    } else if (strcmp(msg, "upld") == 0) {
+        processUpload();
+    } else if (strcmp(msg, "list") == 0) {
+        processList();
+    } else if (strcmp(msg, "slot") == 0) {
+        processSwitch();
     } else if (strcmp(msg, "ping") == 0) {
         processPing();
     } else if (strcmp(msg, "rest") == 0) {
         processReset();
+    } else if (strcmp(msg, "live") == 0) {
+        processLive();
+    } else if (strcmp(msg, "dump") == 0) {
+        processDump(activeSlot);
+    } else if (strcmp(msg, "dmps") == 0) {
+        byte slot = SLOT_COUNT;
+        Serial.readBytes((char*) &slot, 1);
+        if (slot < SLOT_COUNT) {
+            processDump(slot);
+        } else {
+            Serial.write("fail");
+        }
     }
     digitalWrite(infoPin, LOW);
 }
 
 /**
  * Processes the transmission of a clip/animation
+ *
+ * \param slot the slot, which gets the clip
+ * \param greeting response to the request
  */
-void processClipTransmission() {
-    Serial.write("helo"); // Respond, so client start sending frames
+void processClipTransmission(byte slot, const char* greeting) {
+    // Make space for the new clip
+    freeSlot(slot);
+    byte start = usedFrames();
+
+    Serial.write(greeting); // Respond, so client start sending frames
 
     // Receive frames
     char frame[] = {0, 0, 0, 0, 0};
     short frameId = 0;
-    while (frameId < MAX_FRAME_COUNT) { // Prevent EEPROM overflow
+    while (frameId < MAX_FRAME_COUNT - start) { // Prevent EEPROM overflow
 
         // Read first two byte for termination
         Serial.readBytes(frame, 2);
@@ -306,19 +531,66 @@ void processClipTransmission() {
         Serial.readBytes(frame+2, 3);
 
         // Write complete frame into EEPROM
-        saveFrame(frameId, frame);
+        saveFrame(start + frameId, frame);
         Serial.write("ok  ");
         frameId++;
     }
 
-    // Set end flag for animation
-    setEndFlag(frameId);
+    // Register the clip in the directory
+    setSlot(slot, start, frameId);
+    loadActiveSlot();
 
     Serial.write("done"); // Say client that all is done
 
     restartAnimation();
 }
 
+/**
+ * Processes an "upld"-request, which transmits a clip into the slot given by the next byte
+ */
+void processUpload() {
+    byte slot = SLOT_COUNT;
+    Serial.readBytes((char*) &slot, 1);
+    if (slot >= SLOT_COUNT) {
+        Serial.write("fail");
+        return;
+    }
+
+    processClipTransmission(slot, "upld");
+}
+
+/**
+ * Processes a "list"-request, which responds with the slot count, the id of the active slot,
+ * the frame count of every slot and the amount of free frames (one byte each)
+ */
+void processList() {
+    Serial.write("list");
+    Serial.write((byte) SLOT_COUNT);
+    Serial.write(activeSlot);
+    for (byte i = 0; i < SLOT_COUNT; i++) {
+        Serial.write(slotLength(i));
+    }
+    Serial.write((byte) (MAX_FRAME_COUNT - usedFrames()));
+}
+
+/**
+ * Processes a "slot"-request, which activates the slot given by the next byte.
+ * Responds "ok  " or "fail" for unknown and empty slots.
+ */
+void processSwitch() {
+    byte slot = SLOT_COUNT;
+    Serial.readBytes((char*) &slot, 1);
+    if (slot >= SLOT_COUNT || slotLength(slot) == 0) {
+        Serial.write("fail");
+        return;
+    }
+
+    EEPROM.update(DIR_ACTIVE_ADDR, slot);
+    loadActiveSlot();
+    restartAnimation();
+    Serial.write("ok  ");
+}
+
 /**
  * Processes a "ping"-request, which could be used by a client to identify the right port
  */
@@ -327,8 +599,87 @@ void processPing() {
 }
 
 void processReset() {
-    writeDefaultClip();
+    writeDefaultClip(activeSlot);
     restartAnimation();
     Serial.write("done");
 }
+
+/**
+ * Processes a "dump"-request, which streams the active clip back to the client, or a "dmps"-request, which
+ * streams the clip of the slot given by the next byte.
+ * The response is "dump", the amount of frames (2 byte, big endian), the frames as stored in the EEPROM and a
+ * CRC-16/XMODEM (2 byte, big endian) over the amount and the frames.
+ *
+ * \param slot id of the slot
+ */
+void processDump(byte slot) {
+    Serial.write("dump");
+
+    unsigned short frameCount = slotLength(slot);
+
+    unsigned short crc = 0;
+    byte countBuffer[] = {(byte) (frameCount >> 8), (byte) (frameCount & 255)};
+    crc = crc16Update(crc, countBuffer[0]);
+    crc = crc16Update(crc, countBuffer[1]);
+    Serial.write(countBuffer, 2);
+
+    int startAddr = DATA_ADDR + slotStart(slot) * FRAME_SIZE;
+    for (int addr = startAddr; addr < startAddr + frameCount * FRAME_SIZE; addr++) {
+        byte data = EEPROM.read(addr);
+        crc = crc16Update(crc, data);
+        Serial.write(data);
+    }
+
+    byte crcBuffer[] = {(byte) (crc >> 8), (byte) (crc & 255)};
+    Serial.write(crcBuffer, 2);
+}
+
+/**
+ * Processes a "live"-request, which starts the live mode
+ */
+void processLive() {
+    liveMode = true;
+    showSetup(0);
+    Serial.write("live");
+}
+
+/**
+ * Processes a packet in live mode: shows the frame or ends the live mode on a "stop"-request
+ */
+void processLiveFrame() {
+    byte packet[LIVE_FRAME_SIZE];
+    if (Serial.readBytes((char*) packet, LIVE_FRAME_SIZE) < LIVE_FRAME_SIZE) {
+        return;
+    }
+
+    if ((packet[0] >> 6) == 0) {
+        unsigned long setup = 0;
+        for (byte i = 0; i < LIVE_FRAME_SIZE; i++) {
+            setup = (setup << 8) + packet[i];
+        }
+        showSetup(setup);
+    } else if (memcmp(packet, "stop", LIVE_FRAME_SIZE) == 0) {
+        liveMode = false;
+        restartAnimation();
+    }
+}
+
+/**
+ * Feeds a byte into a CRC-16/XMODEM (polynomial 0x1021, initial value 0)
+ *
+ * \param crc the current checksum
+ * \param data the next byte
+ * \return the updated checksum
+ */
+unsigned short crc16Update(unsigned short crc, byte data) {
+    crc ^= (unsigned short) data << 8;
+    for (byte i = 0; i < 8; i++) {
+        if (crc & 0x8000) {
+            crc = (crc << 1) ^ 0x1021;
+        } else {
+            crc <<= 1;
+        }
+    }
+    return crc;
+}
 // ========
@@ -0,0 +1,378 @@
+"""
+Structural diff and three-way merge of clips
+"""
+
+import argparse
+import sys
+from model import Clip
+
+
+class ClipDiff:
+    """
+    Compares clips frame by frame. Frames are compared by their content
+    (setup and duration) as hashable keys, and the differences are found with
+    the O((N + M) D) algorithm of Myers, so long clips with few changes are
+    cheap to compare.
+    """
+
+    class GeometryMismatchException(Exception):
+        """
+        Exception for clips of different matrix sizes
+        """
+
+        def __init__(self):
+            """
+            constructor
+            """
+            super().__init__(self, 'The clips have different geometries.')
+
+    @staticmethod
+    def keys(clip):
+        """
+        Returns the content keys of the frames of a clip.
+
+        @param clip the clip
+        @return list of tuples of setup and duration
+        """
+        return [(frame.export(), frame.duration) for frame in clip.frames]
+
+    @staticmethod
+    def hunks(old, new):
+        """
+        Finds the differing parts of two sequences.
+
+        @param old list of hashable items
+        @param new list of hashable items
+        @return list of tuples (oldStart, oldEnd, newStart, newEnd), which
+            replace old[oldStart:oldEnd] by new[newStart:newEnd]; all other
+            items are equal
+        """
+
+        # Equal items at the start and the end need no search
+        prefix = 0
+        while prefix < min(len(old), len(new)) and \
+                old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < min(len(old), len(new)) - prefix and \
+                old[-1 - suffix] == new[-1 - suffix]:
+            suffix += 1
+        a = old[prefix:len(old) - suffix]
+        b = new[prefix:len(new) - suffix]
+        n = len(a)
+        m = len(b)
+        if n == 0 and m == 0:
+            return []
+        if n == 0 or m == 0:
+            return [(prefix, prefix + n, prefix, prefix + m)]
+
+        # Greedy search of the shortest edit script (Myers); trace keeps the
+        # furthest reaching x per diagonal k = x - y for every distance d
+        v = {1: 0}
+        trace = []
+        found = False
+        for d in range(n + m + 1):
+            trace.append(dict(v))
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                    x = v[k + 1]  # Insertion
+                else:
+                    x = v[k - 1] + 1  # Deletion
+                y = x - k
+                while x < n and y < m and a[x] == b[y]:
+                    x += 1
+                    y += 1
+                v[k] = x
+                if x >= n and y >= m:
+                    found = True
+                    break
+            if found:
+                break
+
+        # Walk back and collect the matching items
+        matches = []
+        x, y = n, m
+        for d in range(len(trace) - 1, -1, -1):
+            v = trace[d]
+            k = x - y
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                prevK = k + 1
+            else:
+                prevK = k - 1
+            prevX = v[prevK]
+            prevY = prevX - prevK
+            while x > prevX and y > prevY:
+                x -= 1
+                y -= 1
+                matches.append((x, y))
+            x, y = prevX, prevY
+        matches.reverse()
+
+        # The gaps between the matches are the hunks
+        result = []
+        x = y = 0
+        for matchX, matchY in matches + [(n, m)]:
+            if matchX != x or matchY != y:
+                result.append((prefix + x, prefix + matchX,
+                               prefix + y, prefix + matchY))
+            x, y = matchX + 1, matchY + 1
+
+        return result
+
+    @staticmethod
+    def changedStars(oldSetup, newSetup, starCount):
+        """
+        Returns the stars, which differ between two setups.
+
+        @param oldSetup the setup as integer
+        @param newSetup the setup as integer
+        @param starCount amount of stars within a frame
+        @return ascending list of star ids
+        """
+        diff = oldSetup ^ newSetup
+        return [starId for starId in range(starCount)
+                if (diff >> (starCount - starId - 1)) & 1]
+
+    @classmethod
+    def checkGeometry(cls, *clips):
+        """
+        Checks that all clips have the same geometry.
+
+        @param clips the clips
+        @raise GeometryMismatchException the geometries differ
+        """
+        if len({(clip.width, clip.height) for clip in clips}) > 1:
+            raise cls.GeometryMismatchException()
+
+    @classmethod
+    def edits(cls, old, new):
+        """
+        Returns the edits, which turn one clip into another.
+
+        @param old the original clip
+        @param new the changed clip
+        @return list of edits, which can be replayed one after another on the
+            original clip with Clip.applyEdit
+        """
+        cls.checkGeometry(old, new)
+        newKeys = cls.keys(new)
+
+        edits = []
+        offset = 0  # Shift of the positions by the previous edits
+        for oldStart, oldEnd, newStart, newEnd in cls.hunks(cls.keys(old),
+                                                            newKeys):
+            pos = oldStart + offset
+            common = min(oldEnd - oldStart, newEnd - newStart)
+            for i in range(common):
+                edits.append(('set', pos + i) + newKeys[newStart + i])
+            for i in range(oldEnd - oldStart - common):
+                edits.append(('remove', pos + common))
+            for i in range(newEnd - newStart - common):
+                edits.append(('insert', pos + common + i) +
+                             newKeys[newStart + common + i])
+            offset += (newEnd - newStart) - (oldEnd - oldStart)
+
+        return edits
+
+    @classmethod
+    def report(cls, old, new):
+        """
+        Describes the differences of two clips.
+
+        @param old the original clip
+        @param new the changed clip
+        @return list of lines
+        """
+        cls.checkGeometry(old, new)
+        oldKeys = cls.keys(old)
+        newKeys = cls.keys(new)
+
+        lines = []
+        for oldStart, oldEnd, newStart, newEnd in cls.hunks(oldKeys,
+                                                            newKeys):
+            lines.append('@@ -{0:d},{1:d} +{2:d},{3:d} @@'.format(
+                oldStart, oldEnd - oldStart, newStart, newEnd - newStart))
+            common = min(oldEnd - oldStart, newEnd - newStart)
+            for i in range(common):
+                oldSetup, oldDuration = oldKeys[oldStart + i]
+                newSetup, newDuration = newKeys[newStart + i]
+                change = []
+                stars = cls.changedStars(oldSetup, newSetup, old.starCount)
+                if len(stars) != 0:
+                    change.append('stars ' + ','.join(map(str, stars)))
+                if oldDuration != newDuration:
+                    change.append('duration {0:d} -> {1:d}'.format(
+                        oldDuration, newDuration))
+                lines.append('~ frame {0:d} -> {1:d}: {2}'.format(
+                    oldStart + i, newStart + i, '; '.join(change)))
+            for i in range(oldStart + common, oldEnd):
+                lines.append('- frame {0:d}'.format(i))
+            for i in range(newStart + common, newEnd):
+                lines.append('+ frame {0:d}'.format(i))
+
+        return lines
+
+    @classmethod
+    def merge(cls, base, ours, theirs):
+        """
+        Merges the changes of two clips, which were both derived from a
+        common base. Changes of different frames are combined; frames
+        modified on both sides are merged star by star, as long as the
+        durations don't contradict each other. Other overlapping changes are
+        conflicts, which keep our version.
+
+        @param base the common original clip
+        @param ours our changed clip
+        @param theirs their changed clip
+        @return tuple of the merged clip and a list of (start, end) of the
+            conflicting frames within the merged clip
+        """
+        cls.checkGeometry(base, ours, theirs)
+        baseKeys = cls.keys(base)
+        sides = [(cls.keys(ours), cls.hunks(baseKeys, cls.keys(ours))),
+                 (cls.keys(theirs), cls.hunks(baseKeys, cls.keys(theirs)))]
+
+        # Sort the hunks of both sides by their position in the base
+        pending = sorted((hunk[0], hunk[1], side, hunk)
+                         for side in range(2) for hunk in sides[side][1])
+
+        merged = []
+        conflicts = []
+        pos = 0
+        i = 0
+        while i < len(pending):
+            # Collect all hunks, which overlap each other (insertions at
+            # the same position overlap, too)
+            start, end = pending[i][0], pending[i][1]
+            cluster = [[], []]
+            while i < len(pending) and (pending[i][0] < end or
+                                        pending[i][0] == start == end):
+                cluster[pending[i][2]].append(pending[i][3])
+                end = max(end, pending[i][1])
+                i += 1
+
+            merged.extend(baseKeys[pos:start])
+            versions = [cls.applyHunks(baseKeys, sides[side][0],
+                                       cluster[side], start, end)
+                        for side in range(2)]
+
+            if len(cluster[1]) == 0 or versions[0] == versions[1]:
+                merged.extend(versions[0])
+            elif len(cluster[0]) == 0:
+                merged.extend(versions[1])
+            else:
+                frames = cls.mergeFrames(baseKeys[start:end], *versions)
+                if frames is None:
+                    conflicts.append((len(merged),
+                                      len(merged) + len(versions[0])))
+                    frames = versions[0]
+                merged.extend(frames)
+            pos = end
+        merged.extend(baseKeys[pos:])
+
+        clip = Clip(width=base.width, height=base.height)
+        for setup, duration in merged:
+            clip.frames.append(clip.useFrame(setup, duration))
+        if clip.size != 0:
+            clip.curFrame = 0
+        return clip, conflicts
+
+    @staticmethod
+    def applyHunks(baseKeys, sideKeys, hunks, start, end):
+        """
+        Returns the version of a part of the base with the hunks of a side.
+
+        @param baseKeys keys of the base clip
+        @param sideKeys keys of the changed clip
+        @param hunks hunks of the side within the part
+        @param start first frame of the part within the base
+        @param end end of the part within the base
+        @return list of keys
+        """
+        version = []
+        pos = start
+        for oldStart, oldEnd, newStart, newEnd in hunks:
+            version.extend(baseKeys[pos:oldStart])
+            version.extend(sideKeys[newStart:newEnd])
+            pos = oldEnd
+        version.extend(baseKeys[pos:end])
+        return version
+
+    @staticmethod
+    def mergeFrames(baseKeys, oursKeys, theirsKeys):
+        """
+        Merges frames, which were modified on both sides, star by star. A
+        star changed on both sides has the same state on both sides, so only
+        different durations can conflict.
+
+        @param baseKeys keys of the base frames
+        @param oursKeys keys of our frames
+        @param theirsKeys keys of their frames
+        @return list of merged keys or None on a conflict
+        """
+        if not len(baseKeys) == len(oursKeys) == len(theirsKeys):
+            return None
+
+        merged = []
+        for (baseSetup, baseDuration), (ourSetup, ourDuration), \
+                (theirSetup, theirDuration) in zip(baseKeys, oursKeys,
+                                                   theirsKeys):
+            if ourDuration == baseDuration:
+                duration = theirDuration
+            elif theirDuration in (baseDuration, ourDuration):
+                duration = ourDuration
+            else:
+                return None
+            # Every star is taken from the side, which changed it
+            ourChanges = ourSetup ^ baseSetup
+            merged.append(((ourSetup & ourChanges) |
+                           (theirSetup & ~ourChanges), duration))
+
+        return merged
+
+
+def main(argv):
+    """
+    Command line interface, e.g. as git diff and merge driver:
+        ClipDiff.py diff OLD NEW
+        ClipDiff.py merge BASE OURS THEIRS [-o OUTPUT]
+    The merge overwrites OURS, if no output is given (like git expects).
+    The exit code of merge is 1 on conflicts. diff always exits with 0,
+    because git treats other exit codes of diff commands as failures.
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='ClipDiff.py')
+    commands = parser.add_subparsers(dest='command')
+    diffParser = commands.add_parser('diff', help='show the changed frames')
+    diffParser.add_argument('old')
+    diffParser.add_argument('new')
+    mergeParser = commands.add_parser('merge', help='three-way merge')
+    mergeParser.add_argument('base')
+    mergeParser.add_argument('ours')
+    mergeParser.add_argument('theirs')
+    mergeParser.add_argument('-o', '--output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'diff':
+        lines = ClipDiff.report(Clip(args.old), Clip(args.new))
+        for line in lines:
+            print(line)
+        return 0
+
+    if args.command == 'merge':
+        clip, conflicts = ClipDiff.merge(Clip(args.base), Clip(args.ours),
+                                         Clip(args.theirs))
+        clip.save(args.output or args.ours)
+        for start, end in conflicts:
+            print('conflict: frames {0:d}-{1:d} (kept ours)'.format(
+                start, end - 1), file=sys.stderr)
+        return 1 if len(conflicts) != 0 else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,10 +1,13 @@
 """
 Communication class
 """
-import sys
-import glob
+import os
 import serial
+from serial.tools import list_ports
 import time
+from binascii import crc_hqx
+from contextlib import contextmanager
+from model import Clip
 
 
 class Communicator:
@@ -39,7 +42,193 @@ class Communicator:
             """
             super().__init__(self, 'Compressed clip is too long!')
 
+    class ChecksumMismatchException(Exception):
+        """
+        Exception for corrupted downloads
+        """
+
+        def __init__(self, expectedCrc, crc):
+            """
+            constructor
+
+            @param expectedCrc checksum sent by the device
+            @param crc checksum of the received data
+            """
+            super().__init__(self,
+                             'Expected CRC: {0:#06x} | CRC you got: {1:#06x}'
+                             .format(expectedCrc, crc))
+
+    FRAME_SIZE = 5  # Size of a compressed frame in byte
+    LIVE_FRAME_SIZE = 4  # Size of a frame in live mode in byte
+    BAUD_RATE = 9600  # Baud rate of the device
+    DOWNLOAD_TIMEOUT = 5  # Timeout of a download in seconds
+    READY_BANNER = b'nsrd'  # Sent by the device, when it has booted
+    # Maximum time to wait for the banner; old firmwares don't send it and
+    # need this time to boot after the reset by opening the port
+    READY_TIMEOUT = 2
+    PING_REQUEST = b'ping'  # Identifies a running device
+    PING_RESPONSE = b'nsd1'
+    # Maximum time to wait for the response to the ping of a running device
+    PROBE_TIMEOUT = 0.2
+
+    # USB ids (vendor, product) of the serial adapters of the supported boards;
+    # None matches every product of the vendor
+    USB_IDS = ((0x2341, None),  # Arduino
+               (0x2A03, None),  # Arduino (arduino.org)
+               (0x1A86, 0x7523),  # CH340
+               (0x0403, 0x6001),  # FTDI FT232R
+               (0x10C4, 0xEA60))  # CP210x
+    # Further adapters as comma separated VID:PID or VID (hex), e.g.
+    # "1a86:55d4,16c0"
+    extraUsbIds = os.environ.get('NIGHTSKY_USB_IDS', '')
+
     serialPort = None
+    # TransmissionTelemetry, which records the current transmission
+    telemetry = None
+    # Callable, which opens the serial ports (e.g. a SerialTrace recorder);
+    # serial.Serial, if none is set
+    portFactory = None
+
+    @classmethod
+    @contextmanager
+    def measure(cls, phase):
+        """
+        Measures a phase of the transmission, if telemetry is enabled.
+
+        @param phase name of the phase
+        """
+        if cls.telemetry is None:
+            yield
+        else:
+            with cls.telemetry.phase(phase):
+                yield
+
+    @classmethod
+    def recordError(cls, errorType):
+        """
+        Records an error, if telemetry is enabled.
+
+        @param errorType name of the error
+        """
+        if cls.telemetry is not None:
+            cls.telemetry.recordError(errorType)
+
+    @classmethod
+    def recordTraffic(cls, sent, received):
+        """
+        Records transferred bytes, if telemetry is enabled.
+
+        @param sent amount of sent bytes
+        @param received amount of received bytes
+        """
+        if cls.telemetry is not None:
+            cls.telemetry.addTraffic(sent, received)
+
+    @classmethod
+    def openPort(cls, port, *args, **kwargs):
+        """
+        Opens a serial port with the port factory.
+
+        @param port name of the port
+        @param args further arguments of serial.Serial
+        @param kwargs further keyword arguments of serial.Serial
+        @return the opened port
+        """
+        if cls.portFactory is None:
+            return cls.openSerial(port, *args, **kwargs)
+        return cls.portFactory(port, *args, **kwargs)
+
+    @staticmethod
+    def openSerial(port, *args, **kwargs):
+        """
+        Opens a serial port without asserting DTR, where the driver allows
+        it, because DTR resets the Arduino.
+
+        @param port name of the port
+        @param args further arguments of serial.Serial
+        @param kwargs further keyword arguments of serial.Serial
+        @return the opened port
+        """
+        serialPort = serial.Serial(None, *args, **kwargs)
+        serialPort.port = port
+        serialPort.dtr = False
+        serialPort.open()
+        return serialPort
+
+    @classmethod
+    def connect(cls, port, *args, **kwargs):
+        """
+        Opens a port and waits until the device is ready.
+
+        @param port name of the port
+        @param args further arguments of serial.Serial
+        @param kwargs further keyword arguments of serial.Serial
+        @return the opened port
+        """
+        serialPort = cls.openPort(port, *args, **kwargs)
+        try:
+            cls.waitUntilReady(serialPort)
+        except (OSError, serial.SerialException):
+            serialPort.close()
+            raise
+        return serialPort
+
+    @classmethod
+    def waitUntilReady(cls, serialPort):
+        """
+        Waits until the device is ready. It's pinged first: a device, which
+        wasn't reset by opening the port, responds at once. A device, which
+        was reset, sends the banner after booting; devices with an old
+        firmware are given READY_TIMEOUT to boot. The banner and a late
+        response to the ping are consumed, so they aren't taken for the
+        response of the next request.
+
+        @param serialPort the opened port
+        @return True if the device responded to the ping or sent the banner
+        """
+        timeout = serialPort.timeout
+        try:
+            serialPort.write(cls.PING_REQUEST)
+            received = cls.readUntil(serialPort, b'',
+                                     (cls.PING_RESPONSE, cls.READY_BANNER),
+                                     cls.PROBE_TIMEOUT)
+            if cls.PING_RESPONSE not in received:
+                # The device boots; the ping may have reached the bootloader
+                # or the booted firmware
+                received = cls.readUntil(serialPort, received,
+                                         (cls.READY_BANNER,),
+                                         cls.READY_TIMEOUT)
+                if cls.READY_BANNER in received:
+                    received = cls.readUntil(serialPort, received,
+                                             (cls.PING_RESPONSE,),
+                                             cls.PROBE_TIMEOUT)
+        finally:
+            serialPort.timeout = timeout
+        cls.recordTraffic(len(cls.PING_REQUEST), len(received))
+        return cls.PING_RESPONSE in received or cls.READY_BANNER in received
+
+    @staticmethod
+    def readUntil(serialPort, received, markers, timeout):
+        """
+        Reads byte by byte until one of the markers was received.
+
+        @param serialPort the opened port
+        @param received the bytes, which were already received
+        @param markers tuple of byte strings, which end the reading
+        @param timeout maximum time to wait in seconds
+        @return the received bytes including the given ones
+        """
+        deadline = time.perf_counter() + timeout
+        while not any(marker in received for marker in markers):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            serialPort.timeout = remaining
+            data = serialPort.read(1)
+            if not data:
+                break
+            received += data
+        return received
 
     @classmethod
     def getPorts(cls):
@@ -47,60 +236,91 @@ class Communicator:
         returns a list of available serial ports
 
         @return a list with available ports
-        @see https://stackoverflow.com/questions/12090503/listing-available-
-            com-ports-with-python
         """
-        if sys.platform.startswith('win'):
-            ports = ['COM' + str(i + 1) for i in range(256)]
+        return [port for port in cls.candidatePorts() if cls.ping(port)]
 
-        elif sys.platform.startswith('linux') or sys.platform.startswith(
-                'cygwin'):
-            # this is to exclude your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
+    @classmethod
+    def candidatePorts(cls):
+        """
+        Returns the serial ports of the USB adapters of supported boards (see
+        USB_IDS and extraUsbIds). Other ports (e.g. built-in serial ports,
+        terminals, modems or other boards) aren't opened at all, because
+        opening a port can reset the device on it.
 
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
+        @return a list with the names of the ports
+        """
+        usbIds = cls.USB_IDS + cls.parseUsbIds(cls.extraUsbIds)
+        return sorted(info.device for info in list_ports.comports()
+                      if any(info.vid == vid and pid in (None, info.pid)
+                             for vid, pid in usbIds))
 
-        else:
-            raise EnvironmentError('Unsupported platform')
+    @staticmethod
+    def parseUsbIds(text):
+        """
+        Parses a list of USB ids (see extraUsbIds); invalid ids are ignored.
 
-        possiblePorts = []
-        for port in ports:
-            try:
-                s = serial.Serial(port)
-                s.close()
-                possiblePorts.append(port)
-            except (OSError, serial.SerialException):
-                pass
-
-        result = []
-        for port in possiblePorts:
+        @param text comma separated VID:PID or VID in hex
+        @return tuple of tuples (vendor, product or None)
+        """
+        usbIds = []
+        for usbId in text.split(','):
+            vid, _, pid = usbId.strip().partition(':')
             try:
-                s = serial.Serial(port, 9600, timeout=2, writeTimeout=2)
-                time.sleep(2)  # Sleep for windows
-                s.write(b'ping')
-                pong = s.read(4)
-                if pong == b'nsd1':
-                    result.append(port)
-            except serial.SerialTimeoutException:
-                pass
-        return result
+                usbIds.append((int(vid, 16), int(pid, 16) if pid else None))
+            except ValueError:
+                continue
+        return tuple(usbIds)
+
+    @classmethod
+    def ping(cls, port):
+        """
+        Checks whether a Nightsky device is connected to a port.
+
+        @param port name of the port
+        @return True if the device responded to the ping
+        """
+        try:
+            s = cls.connect(port, cls.BAUD_RATE, timeout=2, writeTimeout=2)
+        except (OSError, serial.SerialException):
+            return False
+
+        try:
+            s.write(cls.PING_REQUEST)
+            return s.read(4) == cls.PING_RESPONSE
+        except (OSError, serial.SerialException):
+            return False
+        finally:
+            s.close()
 
     @classmethod
-    def start(cls, port):
+    def start(cls, port, slot=None):
         """
         Starts a transmission.
 
         @param port port of the Nightsky device
+        @param slot id of the slot, which gets the clip; if none is given, the
+            active slot is overwritten
         @raise CommunicationFaultException when the helo response is wrong
         """
-        cls.serialPort = serial.Serial(port)
-        time.sleep(2)  # Sleep for windows
-        cls.serialPort.write(b'helo')
-        heloResp = cls.serialPort.read(4)
-        if heloResp != b'helo':
+        if slot is None:
+            request = b'helo'
+            expectedResp = b'helo'
+        else:
+            request = b'upld' + bytes([slot])
+            expectedResp = b'upld'
+
+        with cls.measure('portOpen'):
+            cls.serialPort = cls.openPort(port)
+        with cls.measure('ready'):
+            cls.waitUntilReady(cls.serialPort)
+        with cls.measure('handshake'):
+            cls.serialPort.write(request)
+            heloResp = cls.serialPort.read(4)
+        cls.recordTraffic(len(request), len(heloResp))
+        if heloResp != expectedResp:
+            cls.recordError('handshake')
             cls.serialPort.close()
-            raise cls.CommunicationFaultException(b'helo', heloResp)
+            raise cls.CommunicationFaultException(expectedResp, heloResp)
 
     @classmethod
     def transmitFrame(cls, frame):
@@ -109,12 +329,21 @@ class Communicator:
 
         @param frame compressed frame as bytes
         """
+        startTime = time.perf_counter()
         cls.serialPort.write(frame)
+        writtenTime = time.perf_counter()
         resp = cls.serialPort.read(4)
 
+        if cls.telemetry is not None:
+            cls.telemetry.recordFrame(writtenTime - startTime,
+                                      time.perf_counter() - writtenTime,
+                                      len(frame), len(resp))
+
         if resp == b'done':
+            cls.recordError('clipTooLong')
             raise cls.CompressedClipTooLong()
         if resp != b'ok  ':
+            cls.recordError('frameAck')
             raise cls.CommunicationFaultException(b'ok  ', resp)
 
     @classmethod
@@ -122,8 +351,182 @@ class Communicator:
         """
         Ends the transmission.
         """
-        cls.serialPort.write(b'\x00\x00')
-        doneResp = cls.serialPort.read(4)  # Wait for "done" from device
-        cls.serialPort.close()
+        with cls.measure('endHandshake'):
+            cls.serialPort.write(b'\x00\x00')
+            doneResp = cls.serialPort.read(4)  # Wait for "done" from device
+            cls.serialPort.close()
+        cls.recordTraffic(2, len(doneResp))
         if doneResp != b'done':
+            cls.recordError('endHandshake')
             raise cls.CommunicationFaultException(b'done', doneResp)
+
+    @classmethod
+    @contextmanager
+    def session(cls, port):
+        """
+        Opens a port for a single request and closes it afterwards.
+
+        @param port port of the Nightsky device
+        @return the opened serial port
+        """
+        serialPort = cls.connect(port, timeout=cls.DOWNLOAD_TIMEOUT)
+        try:
+            yield serialPort
+        finally:
+            serialPort.close()
+
+    @classmethod
+    def download(cls, port, slot=None):
+        """
+        Downloads the compressed frames stored on the device in one bulk
+        transfer.
+
+        @param port port of the Nightsky device
+        @param slot id of the slot; the active slot if none is given
+        @return list of compressed frames as bytes of the length 5
+        @raise CommunicationFaultException when the response is incomplete
+        @raise ChecksumMismatchException when the data is corrupted
+        """
+        request = b'dump' if slot is None else b'dmps' + bytes([slot])
+        with cls.session(port) as serialPort:
+            serialPort.write(request)
+            dumpResp = serialPort.read(4)
+            if dumpResp != b'dump':
+                raise cls.CommunicationFaultException(b'dump', dumpResp)
+
+            header = serialPort.read(2)
+            if len(header) != 2:
+                raise cls.CommunicationFaultException('frame count', header)
+            frameCount = int.from_bytes(header, 'big')
+
+            data = serialPort.read(frameCount * cls.FRAME_SIZE)
+            if len(data) != frameCount * cls.FRAME_SIZE:
+                raise cls.CommunicationFaultException(
+                    '{0:d} frames'.format(frameCount), data)
+
+            crcResp = serialPort.read(2)
+            if len(crcResp) != 2:
+                raise cls.CommunicationFaultException('checksum', crcResp)
+
+        # CRC-16/XMODEM over frame count and frames
+        crc = crc_hqx(header + data, 0)
+        if crc != int.from_bytes(crcResp, 'big'):
+            cls.recordError('checksum')
+            raise cls.ChecksumMismatchException(
+                int.from_bytes(crcResp, 'big'), crc)
+
+        return [data[i:i + cls.FRAME_SIZE]
+                for i in range(0, len(data), cls.FRAME_SIZE)]
+
+    @classmethod
+    def downloadClip(cls, port, slot=None):
+        """
+        Downloads a clip stored on the device.
+
+        @param port port of the Nightsky device
+        @param slot id of the slot; the active slot if none is given
+        @return the downloaded clip
+        """
+        clip = Clip()
+        clip.importRecords(cls.download(port, slot))
+        return clip
+
+    @classmethod
+    def verify(cls, port, clip, slot=None):
+        """
+        Verifies that the device stores exactly the exported clip.
+
+        @param port port of the Nightsky device
+        @param clip the clip that should be stored
+        @param slot id of the slot; the active slot if none is given
+        @return True if the stored frames equal the exported frames
+        """
+        return cls.download(port, slot) == clip.export()
+
+    @classmethod
+    def listSlots(cls, port):
+        """
+        Lists the clips stored on the device.
+
+        @param port port of the Nightsky device
+        @return tuple of the id of the active slot, a list with the amount of
+            compressed frames of every slot (0 for empty slots) and the
+            amount of free compressed frames
+        @raise CommunicationFaultException when the response is wrong
+        """
+        with cls.session(port) as serialPort:
+            serialPort.write(b'list')
+            listResp = serialPort.read(4)
+            if listResp != b'list':
+                raise cls.CommunicationFaultException(b'list', listResp)
+
+            header = serialPort.read(2)  # Slot count and active slot
+            if len(header) != 2:
+                raise cls.CommunicationFaultException('slot count', header)
+            slotCount, activeSlot = header[0], header[1]
+
+            # Frame count of every slot and free frames
+            counts = serialPort.read(slotCount + 1)
+            if len(counts) != slotCount + 1:
+                raise cls.CommunicationFaultException(
+                    '{0:d} slots'.format(slotCount), counts)
+
+        return activeSlot, list(counts[:-1]), counts[-1]
+
+    @classmethod
+    def switchSlot(cls, port, slot):
+        """
+        Activates another clip stored on the device.
+
+        @param port port of the Nightsky device
+        @param slot id of the slot
+        @raise CommunicationFaultException when the slot is empty or unknown
+        """
+        with cls.session(port) as serialPort:
+            serialPort.write(b'slot' + bytes([slot]))
+            resp = serialPort.read(4)
+
+        if resp != b'ok  ':
+            raise cls.CommunicationFaultException(b'ok  ', resp)
+
+    @classmethod
+    def startLive(cls, port):
+        """
+        Starts the live mode, in which the device shows streamed frames
+        instead of its clip.
+
+        @param port port of the Nightsky device
+        @return the opened serial port
+        @raise CommunicationFaultException when the response is wrong
+        """
+        serialPort = cls.connect(port, cls.BAUD_RATE,
+                                 timeout=cls.DOWNLOAD_TIMEOUT)
+        serialPort.write(b'live')
+        resp = serialPort.read(4)
+        if resp != b'live':
+            serialPort.close()
+            raise cls.CommunicationFaultException(b'live', resp)
+
+        return serialPort
+
+    @classmethod
+    def sendLive(cls, serialPort, setup):
+        """
+        Shows a setup on a device in live mode. The device doesn't respond,
+        so the call only blocks until the bytes are written.
+
+        @param serialPort serial port returned by startLive
+        @param setup the setup as integer (see Frame.export)
+        """
+        serialPort.write(setup.to_bytes(cls.LIVE_FRAME_SIZE, 'big'))
+
+    @classmethod
+    def endLive(cls, serialPort):
+        """
+        Ends the live mode; the device continues playing its clip.
+
+        @param serialPort serial port returned by startLive
+        """
+        serialPort.write(b'stop')
+        serialPort.flush()
+        serialPort.close()
@@ -0,0 +1,435 @@
+"""
+Persistent cache of exported clips and derived files, addressed by content
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from os.path import expanduser, join
+from model import Clip, Frame
+
+try:
+    import fcntl
+except ImportError:  # Windows: evictions aren't serialized between processes
+    fcntl = None
+
+
+class CompileCache:
+    """
+    Maps the content hash of a clip to its exported records and to files
+    derived from it (e.g. previews), so build scripts don't load and export
+    unchanged clips again. The key of a clip file is the hash of its frames
+    and its geometry, so a hit costs parsing the file, but no clip is built.
+
+    Every entry is a file <directory>/<first 2 digits>/<key>.<kind>, which
+    is written to a temporary file and renamed, so processes sharing the
+    cache never read partial entries. Entries carry a checksum; damaged
+    ones are dropped like misses. A hit touches the entry, and when the
+    cache grows beyond its size, the least recently used entries are
+    deleted until it is below LOW_WATER of the size.
+
+    The directory is set by NIGHTSKY_CACHE_DIR and the size by
+    NIGHTSKY_CACHE_MB (0 disables the cache).
+    """
+
+    directory = os.environ.get('NIGHTSKY_CACHE_DIR',
+                               expanduser(join('~', '.cache', 'nightsky')))
+    # Size of the cache in bytes
+    maxBytes = int(float(os.environ.get('NIGHTSKY_CACHE_MB', 256)) * 2 ** 20)
+    LOW_WATER = 0.8  # Eviction shrinks the cache to this part of its size
+    VERSION = 2  # Part of every key, so format changes invalidate entries
+    MAGIC = b'NSCA'
+    HEADER = struct.Struct('>4sBII')  # Magic, version, length, CRC-32
+    GEOMETRY = struct.Struct('>HHB')  # Width, height and size of a record
+    LOCK_NAME = 'lock'
+    # Age, after which temporary files were left by crashed processes (s)
+    STALE_SECONDS = 3600
+
+    class InvalidKindException(Exception):
+        """
+        Exception for kinds, which can't be part of a file name.
+        """
+
+        def __init__(self, kind):
+            """
+            constructor
+
+            @param kind the kind of the entry
+            """
+            super().__init__(self, 'Invalid kind of cache entry: {0}'
+                             .format(kind))
+
+    def __init__(self, directory=None, maxBytes=None):
+        """
+        constructor
+
+        @param directory directory of the cache (default: see class)
+        @param maxBytes size of the cache in bytes (default: see class)
+        """
+        if directory is not None:
+            self.directory = directory
+        if maxBytes is not None:
+            self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        # Estimated size of the entries (None until the cache was scanned)
+        self.size = None
+
+    @property
+    def enabled(self):
+        """
+        returns whether entries are stored
+
+        @return True if the cache has a size
+        """
+        return self.maxBytes > 0
+
+    # ==== Keys ====
+    @classmethod
+    def fileKey(cls, filePath):
+        """
+        Returns the key of a clip file. Only the frames and the geometry are
+        hashed, so e.g. another active frame doesn't change the key; the
+        key equals the one of the loaded clip (see clipKey).
+
+        @param filePath path to the file
+        @return the key as hex digits
+        """
+        fp = open(filePath, 'r')
+        dump = json.load(fp)
+        fp.close()
+
+        # Like Clip.load, but without building the frames
+        if 'setups' in dump:
+            setups = [int(setup, 16) for setup in dump['setups']]
+        else:
+            setups = [Frame(states).export() for states in dump['frames']]
+        durations = dump.get('durations', [1] * len(setups))
+        return cls.framesKey(dump.get('width', Clip.WIDTH),
+                             dump.get('height', Clip.HEIGHT),
+                             zip(setups, durations))
+
+    @classmethod
+    def clipKey(cls, clip):
+        """
+        Returns the key of the frames of a clip, e.g. of an unsaved clip.
+
+        @param clip the clip
+        @return the key as hex digits
+        """
+        return cls.framesKey(clip.width, clip.height,
+                             ((frame.export(), frame.duration)
+                              for frame in clip.frames))
+
+    @classmethod
+    def framesKey(cls, width, height, keys):
+        """
+        Hashes the geometry and the frames of a clip.
+
+        @param width stars per line
+        @param height lines of the matrix
+        @param keys iterable of tuples (setup, duration)
+        @return the key as hex digits
+        """
+        digest = hashlib.sha256(b'clip %d %d %d\n' % (cls.VERSION, width,
+                                                     height))
+        setupSize = -(-width * height // 8)
+        for setup, duration in keys:
+            digest.update(setup.to_bytes(setupSize, 'big') +
+                          duration.to_bytes(4, 'big'))
+        return digest.hexdigest()
+
+    def entryPath(self, key, kind):
+        """
+        Returns the path of an entry.
+
+        @param key the key of the clip
+        @param kind the kind of the entry, e.g. 'records' or 'animation.png'
+        @return the path
+        @raise InvalidKindException the kind contains other characters than
+            letters, digits, '.', '-' and '_'
+        """
+        if kind == '' or not all(c.isalnum() or c in '.-_' for c in kind):
+            raise self.__class__.InvalidKindException(kind)
+        return join(self.directory, key[:2], '{0}.{1}'.format(key, kind))
+
+    # ==== Entries ====
+    def get(self, key, kind):
+        """
+        Looks an entry up and marks it as recently used.
+
+        @param key the key of the clip
+        @param kind the kind of the entry
+        @return the data or None, if there is no (intact) entry
+        """
+        if not self.enabled:
+            return None
+
+        filePath = self.entryPath(key, kind)
+        try:
+            fp = open(filePath, 'rb')
+            content = fp.read()
+            fp.close()
+        except OSError:
+            self.misses += 1
+            return None
+
+        data = content[self.HEADER.size:]
+        if len(content) < self.HEADER.size or \
+                self.HEADER.unpack_from(content) != \
+                (self.MAGIC, self.VERSION, len(data), zlib.crc32(data)):
+            self.remove(filePath)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(filePath)
+        except OSError:
+            pass  # Evicted meanwhile
+        self.hits += 1
+        return data
+
+    def put(self, key, kind, data):
+        """
+        Stores an entry; the cache is shrunk if it has grown too large. An
+        entry, which can't be written (e.g. the disk is full or read-only),
+        isn't stored; the next lookup is a miss.
+
+        @param key the key of the clip
+        @param kind the kind of the entry
+        @param data the data as bytes
+        @return True if the entry was stored
+        """
+        if not self.enabled:
+            return False
+
+        filePath = self.entryPath(key, kind)
+        # A unique temporary file per writer; the rename is atomic
+        tmpFilePath = '{0}.{1:d}.{2:d}.tmp'.format(filePath, os.getpid(),
+                                                  threading.get_ident())
+        try:
+            oldSize = os.stat(filePath).st_size
+        except OSError:
+            oldSize = 0
+        try:
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            fp = open(tmpFilePath, 'wb')
+            try:
+                fp.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(data),
+                                          zlib.crc32(data)) + data)
+            finally:
+                fp.close()
+            os.replace(tmpFilePath, filePath)
+        except OSError:
+            self.remove(tmpFilePath)
+            return False
+
+        if self.size is None:
+            self.size = self.scan()[1]
+        else:
+            self.size += self.HEADER.size + len(data) - oldSize
+        if self.size > self.maxBytes:
+            self.evict()
+        return True
+
+    def fetch(self, key, kind, compute):
+        """
+        Returns an entry; on a miss it's computed and stored (see put).
+
+        @param key the key of the clip
+        @param kind the kind of the entry
+        @param compute function without arguments, which returns the data
+        @return the data
+        """
+        data = self.get(key, kind)
+        if data is None:
+            data = compute()
+            self.put(key, kind, data)
+        return data
+
+    @staticmethod
+    def remove(filePath):
+        """
+        Deletes an entry, unless another process did.
+
+        @param filePath path to the entry
+        @return True if it was deleted
+        """
+        try:
+            os.remove(filePath)
+            return True
+        except OSError:
+            return False
+
+    def scan(self):
+        """
+        Lists the entries.
+
+        @return tuple of a list of (last use, size, path) and the total size
+        """
+        entries = []
+        total = 0
+        staleTime = time.time() - self.STALE_SECONDS
+        try:
+            subdirs = [entry.path for entry in os.scandir(self.directory)
+                       if entry.is_dir()]
+        except OSError:
+            return entries, total
+
+        for subdir in subdirs:
+            try:
+                files = list(os.scandir(subdir))
+            except OSError:
+                continue
+            for entry in files:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Removed meanwhile
+                lastUse = stat.st_mtime
+                if entry.name.endswith('.tmp'):
+                    if lastUse > staleTime:
+                        continue  # Being written by another process
+                    lastUse = 0  # Left by a crashed process
+                entries.append((lastUse, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache is below
+        LOW_WATER of its size. Only one process evicts at a time; the others
+        skip it.
+        """
+        lockFile = None
+        if fcntl is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            lockFile = open(join(self.directory, self.LOCK_NAME), 'a')
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lockFile.close()
+                return
+
+        try:
+            entries, total = self.scan()
+            entries.sort()
+            limit = self.maxBytes * self.LOW_WATER
+            for lastUse, size, filePath in entries:
+                if total <= limit:
+                    break
+                if self.remove(filePath):
+                    total -= size
+            self.size = total
+        finally:
+            if lockFile is not None:
+                lockFile.close()
+
+    def clear(self):
+        """
+        Deletes all entries.
+        """
+        for lastUse, size, filePath in self.scan()[0]:
+            self.remove(filePath)
+        self.size = 0
+
+    # ==== Clips ====
+    def export(self, filePath):
+        """
+        Exports a clip file (see Clip.export); the file is only loaded, if
+        its records aren't cached.
+
+        @param filePath path to the .nsc file
+        @return tuple of the width, the height and the list of records
+        """
+        key = self.fileKey(filePath)
+
+        def compute():
+            return self.encodeRecords(Clip(filePath))
+        return self.decodeRecords(self.fetch(key, 'records', compute))
+
+    def exportClip(self, clip):
+        """
+        Exports a clip in memory (see Clip.export).
+
+        @param clip the clip
+        @return the list of records
+        """
+        key = self.clipKey(clip)
+        return self.decodeRecords(self.fetch(
+            key, 'records', lambda: self.encodeRecords(clip)))[2]
+
+    @classmethod
+    def encodeRecords(cls, clip):
+        """
+        Exports a clip into the data of a 'records' entry.
+
+        @param clip the clip
+        @return the geometry and the records as bytes
+        """
+        return cls.GEOMETRY.pack(clip.width, clip.height, clip.recordSize) + \
+            b''.join(clip.export())
+
+    @classmethod
+    def decodeRecords(cls, data):
+        """
+        Decodes the data of a 'records' entry.
+
+        @param data the data
+        @return tuple of the width, the height and the list of records
+        """
+        width, height, recordSize = cls.GEOMETRY.unpack_from(data)
+        start = cls.GEOMETRY.size
+        return width, height, [data[i:i + recordSize]
+                               for i in range(start, len(data), recordSize)]
+
+
+def main(argv):
+    """
+    Command line interface:
+        CompileCache.py info
+        CompileCache.py clear
+        CompileCache.py export CLIP OUTPUT
+    export writes the records of the clip (as uploaded) into OUTPUT.
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='CompileCache.py')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('info', help='print the size of the cache')
+    commands.add_parser('clear', help='delete all entries')
+    exportParser = commands.add_parser('export', help='export a clip')
+    exportParser.add_argument('clip')
+    exportParser.add_argument('output')
+    args = parser.parse_args(argv)
+
+    cache = CompileCache()
+    if args.command == 'info':
+        entries, total = cache.scan()
+        print('{0}: {1:d} entries, {2:.1f} of {3:.1f} MB'.format(
+            cache.directory, len(entries), total / 2 ** 20,
+            cache.maxBytes / 2 ** 20))
+    elif args.command == 'clear':
+        cache.clear()
+    elif args.command == 'export':
+        records = cache.export(args.clip)[2]
+        fp = open(args.output, 'wb')
+        fp.write(b''.join(records))
+        fp.close()
+        print('{0:d} records ({1})'.format(
+            len(records), 'cached' if cache.hits else 'exported'))
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,820 @@
+"""
+Clips composed of references to other clips (segments, repeats, reversal
+and concatenation), which are only expanded while they are exported
+"""
+
+import argparse
+import json
+import re
+import sys
+from itertools import chain, islice
+from os.path import abspath, dirname, join, relpath
+from Communicator import Communicator
+from EepromImage import EepromImage
+from MemoryBudget import MemoryBudget
+from model import Clip
+
+
+def mergeRuns(runs):
+    """
+    Merges neighbouring runs of the same setup like Clip.export does.
+
+    @param runs iterable of tuples (setup, duration)
+    @return generator of tuples (setup, duration)
+    """
+    runSetup = None
+    runDuration = 0
+    for setup, duration in runs:
+        if setup == runSetup:
+            runDuration += duration
+            continue
+        if runSetup is not None:
+            yield runSetup, runDuration
+        runSetup = setup
+        runDuration = duration
+
+    if runSetup is not None:
+        yield runSetup, runDuration
+
+
+class CompositionNode:
+    """
+    Part of a composition: a sequence of frames, which are given as keys
+    (setup, duration). Nodes are immutable, so the same node can be used
+    several times within a composition.
+
+    Every kind of node implements:
+        countFrames() -> the amount of frames
+        keys(start=0, end=None, backwards=False) -> generator of the keys of
+            the frames from start to end (the end of the node if None),
+            from the end to the start if backwards
+        toJson(ids) -> dictionary, which describes the node for a
+            composition file; ids maps the already described nodes to
+            their ids
+    """
+
+    def __init__(self):
+        """
+        constructor
+        """
+        self.cachedSize = None
+
+    @property
+    def size(self):
+        """
+        returns the number of frames without expanding the node
+
+        @return the amount of frames
+        """
+        if self.cachedSize is None:
+            self.cachedSize = self.countFrames()
+        return self.cachedSize
+
+    def totalDuration(self):
+        """
+        Computes the duration of all frames.
+
+        @return the duration in animation steps
+        """
+        return sum(duration for setup, duration in self.runs())
+
+    def runs(self, backwards=False):
+        """
+        Returns the frames as runs of identical setups.
+
+        @param backwards True to return the runs from the end to the start
+        @return generator of tuples (setup, duration)
+        """
+        return mergeRuns(self.keys(backwards=backwards))
+
+    def children(self):
+        """
+        Returns the nodes, which this node refers to.
+
+        @return list of nodes
+        """
+        return []
+
+    def bounds(self, start, end):
+        """
+        Limits a part to the frames of the node.
+
+        @param start first frame of the part
+        @param end end of the part or None
+        @return tuple of start and end; an empty part has start == end
+        """
+        end = self.size if end is None else max(0, min(end, self.size))
+        return min(max(0, start), end), end
+
+
+class FramesNode(CompositionNode):
+    """
+    Frames stored within the composition.
+    """
+
+    def __init__(self, keys):
+        """
+        constructor
+
+        @param keys list of tuples (setup, duration)
+        """
+        super().__init__()
+        self.frameKeys = list(keys)
+
+    def countFrames(self):
+        return len(self.frameKeys)
+
+    def keys(self, start=0, end=None, backwards=False):
+        start, end = self.bounds(start, end)
+        if backwards:
+            return (self.frameKeys[i] for i in range(end - 1, start - 1, -1))
+        return islice(self.frameKeys, start, end)
+
+    def toJson(self, ids):
+        return {'type': 'frames',
+                'setups': ['{0:x}'.format(setup)
+                           for setup, duration in self.frameKeys],
+                'durations': [duration for setup, duration in self.frameKeys]}
+
+
+class SourceNode(CompositionNode):
+    """
+    All frames of another clip file (.nsc) or composition (.nscc), which is
+    loaded on first use.
+    """
+
+    def __init__(self, composition, path):
+        """
+        constructor
+
+        @param composition the composition, which refers to the file
+        @param path path to the file, relative to the composition file
+        """
+        super().__init__()
+        self.composition = composition
+        self.path = path
+        self.target = None
+
+    def load(self):
+        """
+        Loads the referred file.
+
+        @return the node of its frames
+        @raise CyclicCompositionException the file refers to itself
+        @raise GeometryMismatchException the file has another matrix size
+        """
+        if self.target is None:
+            composition = self.composition
+            filePath = self.path
+            if composition.filePath is not None:
+                filePath = join(dirname(composition.filePath), self.path)
+
+            if filePath.endswith(ComposedClip.SUFFIX):
+                if abspath(filePath) in composition.loading:
+                    raise ComposedClip.CyclicCompositionException(self.path)
+                clip = ComposedClip(filePath, loading=composition.loading)
+                target = clip.root
+            else:
+                clip = Clip(filePath)
+                target = FramesNode((frame.export(), frame.duration)
+                                    for frame in clip.frames)
+
+            if (clip.width, clip.height) != (composition.width,
+                                             composition.height):
+                raise ComposedClip.GeometryMismatchException(self.path)
+            self.target = target
+        return self.target
+
+    def countFrames(self):
+        return self.load().size
+
+    def keys(self, start=0, end=None, backwards=False):
+        return self.load().keys(start, end, backwards)
+
+    def runs(self, backwards=False):
+        return self.load().runs(backwards)
+
+    def toJson(self, ids):
+        return {'type': 'source', 'path': self.path}
+
+
+class SegmentNode(CompositionNode):
+    """
+    A part of the frames of another node.
+    """
+
+    def __init__(self, child, start, end):
+        """
+        constructor
+
+        @param child the node
+        @param start first frame of the part
+        @param end end of the part (exclusive)
+        """
+        super().__init__()
+        self.child = child
+        self.start = start
+        self.end = end
+
+    def countFrames(self):
+        return max(0, min(self.end, self.child.size) - max(0, self.start))
+
+    def keys(self, start=0, end=None, backwards=False):
+        start, end = self.bounds(start, end)
+        offset = max(0, self.start)
+        return self.child.keys(offset + start, offset + end, backwards)
+
+    def children(self):
+        return [self.child]
+
+    def toJson(self, ids):
+        return {'type': 'segment', 'of': ids[self.child],
+                'start': self.start, 'end': self.end}
+
+
+class RepeatNode(CompositionNode):
+    """
+    The frames of another node repeated several times.
+    """
+
+    def __init__(self, child, count):
+        """
+        constructor
+
+        @param child the node
+        @param count amount of repetitions
+        """
+        super().__init__()
+        self.child = child
+        self.count = count
+
+    def countFrames(self):
+        return self.child.size * max(0, self.count)
+
+    def totalDuration(self):
+        return self.child.totalDuration() * max(0, self.count)
+
+    def keys(self, start=0, end=None, backwards=False):
+        start, end = self.bounds(start, end)
+        childSize = self.child.size
+        if start >= end:
+            return iter(())
+
+        # Only the repetitions within the part are visited
+        first, firstOffset = divmod(start, childSize)
+        last, lastEnd = divmod(end - 1, childSize)
+        parts = [(firstOffset if repetition == first else 0,
+                  lastEnd + 1 if repetition == last else childSize)
+                 for repetition in range(first, last + 1)]
+        if backwards:
+            parts.reverse()
+        return chain.from_iterable(self.child.keys(partStart, partEnd,
+                                                   backwards)
+                                   for partStart, partEnd in parts)
+
+    def runs(self, backwards=False):
+        # A single run (e.g. a held frame) stays a single long run
+        head = list(islice(self.child.runs(backwards), 2))
+        if self.count <= 0 or len(head) == 0:
+            return iter(())
+        if len(head) == 1:
+            return iter([(head[0][0], head[0][1] * self.count)])
+        return mergeRuns(chain.from_iterable(self.child.runs(backwards)
+                                             for _ in range(self.count)))
+
+    def children(self):
+        return [self.child]
+
+    def toJson(self, ids):
+        return {'type': 'repeat', 'of': ids[self.child], 'count': self.count}
+
+
+class ReverseNode(CompositionNode):
+    """
+    The frames of another node from its end to its start.
+    """
+
+    def __init__(self, child):
+        """
+        constructor
+
+        @param child the node
+        """
+        super().__init__()
+        self.child = child
+
+    def countFrames(self):
+        return self.child.size
+
+    def totalDuration(self):
+        return self.child.totalDuration()
+
+    def keys(self, start=0, end=None, backwards=False):
+        start, end = self.bounds(start, end)
+        return self.child.keys(self.size - end, self.size - start,
+                               not backwards)
+
+    def runs(self, backwards=False):
+        return self.child.runs(not backwards)
+
+    def children(self):
+        return [self.child]
+
+    def toJson(self, ids):
+        return {'type': 'reverse', 'of': ids[self.child]}
+
+
+class ConcatNode(CompositionNode):
+    """
+    The frames of several nodes one after another.
+    """
+
+    def __init__(self, children):
+        """
+        constructor
+
+        @param children list of nodes
+        """
+        super().__init__()
+        self.parts = list(children)
+
+    def countFrames(self):
+        return sum(child.size for child in self.parts)
+
+    def totalDuration(self):
+        return sum(child.totalDuration() for child in self.parts)
+
+    def keys(self, start=0, end=None, backwards=False):
+        start, end = self.bounds(start, end)
+
+        # Only the children within the part are visited
+        ranges = []
+        offset = 0
+        for child in self.parts:
+            if offset < end and offset + child.size > start:
+                ranges.append((child, max(0, start - offset),
+                               min(child.size, end - offset)))
+            offset += child.size
+        if backwards:
+            ranges.reverse()
+        return chain.from_iterable(child.keys(partStart, partEnd, backwards)
+                                   for child, partStart, partEnd in ranges)
+
+    def runs(self, backwards=False):
+        parts = reversed(self.parts) if backwards else self.parts
+        return mergeRuns(chain.from_iterable(child.runs(backwards)
+                                             for child in parts))
+
+    def children(self):
+        return list(self.parts)
+
+    def toJson(self, ids):
+        return {'type': 'concat', 'of': [ids[child] for child in self.parts]}
+
+
+class ComposedClip:
+    """
+    A clip, which is composed of other clips instead of containing copies of
+    their frames. The composition is a graph of nodes (see the node classes),
+    which is stored in a .nscc file; every node is stored once, even if it's
+    used several times. The frames are only produced while the clip is
+    exported or expanded, and held frames, which are repeated, are exported
+    as long runs without visiting every repetition.
+    """
+
+    SUFFIX = '.nscc'  # Suffix of composition files
+    NODE_TYPES = ('frames', 'source', 'segment', 'repeat', 'reverse',
+                  'concat')
+
+    class CyclicCompositionException(Exception):
+        """
+        Exception for compositions, which refer to themselves
+        """
+
+        def __init__(self, path):
+            """
+            constructor
+
+            @param path the file, which is referred to again
+            """
+            super().__init__(self, 'The composition {0} refers to itself.'
+                             .format(path))
+
+    class GeometryMismatchException(Exception):
+        """
+        Exception for referred clips with another matrix size
+        """
+
+        def __init__(self, path):
+            """
+            constructor
+
+            @param path the referred file
+            """
+            super().__init__(self, 'The clip {0} has another geometry.'
+                             .format(path))
+
+    class InvalidCompositionException(Exception):
+        """
+        Exception for malformed composition files
+        """
+
+        def __init__(self, reason):
+            """
+            constructor
+
+            @param reason description of the problem
+            """
+            super().__init__(self, 'Invalid composition: {0}'.format(reason))
+
+    def __init__(self, filePath=None, width=Clip.WIDTH, height=Clip.HEIGHT,
+                 loading=frozenset()):
+        """
+        constructor
+
+        @param filePath path to a composition file, which is loaded
+        @param width stars per line of the matrix
+        @param height lines of the matrix
+        @param loading absolute paths of the compositions, which are loaded
+            at the moment (to detect cycles)
+        """
+        self.filePath = filePath
+        self.width = width
+        self.height = height
+        self.loading = loading
+        self.sources = {}  # Path -> SourceNode, every file is loaded once
+        self.root = ConcatNode([])
+        if filePath is not None:
+            self.load(filePath)
+
+    @property
+    def size(self):
+        """
+        returns the number of frames without expanding the clip
+
+        @return the amount of frames
+        """
+        return self.root.size
+
+    @property
+    def starCount(self):
+        """
+        returns the number of stars within a frame
+
+        @return the amount of stars
+        """
+        return self.width * self.height
+
+    def fitsDevice(self):
+        """
+        Checks whether the clip has the geometry of the Nightsky device.
+
+        @return True if the clip can be played by the device
+        """
+        return self.width == Clip.WIDTH and self.height == Clip.HEIGHT
+
+    def totalDuration(self):
+        """
+        Computes the duration of the clip.
+
+        @return the duration in animation steps
+        """
+        return self.root.totalDuration()
+
+    # === Composing ===
+    def frames(self, keys):
+        """
+        Creates a node of frames, which are stored within the composition.
+
+        @param keys list of tuples (setup, duration)
+        @return the node
+        """
+        return FramesNode(keys)
+
+    def source(self, path):
+        """
+        Creates a node, which refers to all frames of a clip file or another
+        composition.
+
+        @param path path to the file, relative to the composition file
+        @return the node
+        """
+        if path not in self.sources:
+            self.sources[path] = SourceNode(self, path)
+        return self.sources[path]
+
+    def segment(self, node, start, end):
+        """
+        Creates a node of a part of the frames of a node.
+
+        @param node the node
+        @param start first frame of the part
+        @param end end of the part (exclusive)
+        @return the node
+        """
+        return SegmentNode(node, start, end)
+
+    def repeat(self, node, count):
+        """
+        Creates a node, which repeats the frames of a node.
+
+        @param node the node
+        @param count amount of repetitions
+        @return the node
+        """
+        return RepeatNode(node, count)
+
+    def reverse(self, node):
+        """
+        Creates a node, which plays the frames of a node backwards.
+
+        @param node the node
+        @return the node
+        """
+        return ReverseNode(node)
+
+    def concat(self, *nodes):
+        """
+        Creates a node, which plays nodes one after another.
+
+        @param nodes the nodes
+        @return the node
+        """
+        return ConcatNode(nodes)
+
+    def parse(self, expression):
+        """
+        Creates a node from an expression like
+            intro.nsc + (loop.nsc[0:10] + ~loop.nsc[0:10]) * 5
+        with + for concatenation, * N for repetition, ~ for reversal and
+        [start:end] for segments of clip files.
+
+        @param expression the expression
+        @return the node
+        @raise InvalidCompositionException the expression is malformed
+        """
+        tokens = re.findall(r'\s*(\d+|[+*~()\[\]:]|[^+*~()\[\]:\s]+)',
+                            expression)
+        pos = 0
+
+        def peek():
+            return tokens[pos] if pos < len(tokens) else None
+
+        def take(expected=None):
+            nonlocal pos
+            token = peek()
+            if token is None or (expected is not None and
+                                 token != expected):
+                raise self.InvalidCompositionException(
+                    'expected {0} at token {1:d}'.format(
+                        expected or 'more', pos))
+            pos += 1
+            return token
+
+        def number():
+            token = take()
+            if not token.isdigit():
+                raise self.InvalidCompositionException(
+                    'expected a number at token {0:d}'.format(pos - 1))
+            return int(token)
+
+        def atom():
+            token = take()
+            if token == '~':
+                return self.reverse(atom())
+            if token == '(':
+                node = concat()
+                take(')')
+            elif token in '+*)]:':
+                raise self.InvalidCompositionException(
+                    'unexpected {0} at token {1:d}'.format(token, pos - 1))
+            else:
+                node = self.source(token)
+            while peek() == '[':
+                take('[')
+                start = number()
+                take(':')
+                end = number()
+                take(']')
+                node = self.segment(node, start, end)
+            return node
+
+        def term():
+            node = atom()
+            while peek() == '*':
+                take('*')
+                node = self.repeat(node, number())
+            return node
+
+        def concat():
+            nodes = [term()]
+            while peek() == '+':
+                take('+')
+                nodes.append(term())
+            return nodes[0] if len(nodes) == 1 else self.concat(*nodes)
+
+        node = concat()
+        if pos != len(tokens):
+            raise self.InvalidCompositionException(
+                'unexpected {0} at token {1:d}'.format(tokens[pos], pos))
+        return node
+
+    # === Expansion ===
+    def keys(self):
+        """
+        Returns the frames one after another without expanding the clip.
+
+        @return generator of tuples (setup, duration)
+        """
+        return self.root.keys()
+
+    def export(self):
+        """
+        Exports the clip to records like Clip.export, run by run.
+
+        @return a list of compressed frames as bytes of the length recordSize
+        """
+        packer = Clip(width=self.width, height=self.height)
+        records = []
+        for setup, duration in self.root.runs():
+            packer.packRun(records, duration, setup)
+        return records
+
+    def toClip(self):
+        """
+        Expands the composition into an editable clip.
+
+        @return the new clip
+        """
+        clip = Clip(width=self.width, height=self.height)
+        for setup, duration in self.keys():
+            clip.frames.append(clip.useFrame(setup, duration))
+        if clip.size != 0:
+            clip.curFrame = 0
+        clip.revision += 1  # Expanding is no edit, like loading a file
+        return clip
+
+    # === Files ===
+    def save(self, filePath=None):
+        """
+        Saves the composition as graph; every node is stored once.
+
+        @param filePath optional new file path
+        """
+        if filePath is not None:
+            self.filePath = filePath
+
+        # Children are stored before the nodes, which refer to them
+        ids = {}
+        nodes = []
+        pending = [(self.root, False)]
+        while pending:
+            node, visited = pending.pop()
+            if node in ids:
+                continue
+            if visited:
+                ids[node] = len(nodes)
+                nodes.append(node.toJson(ids))
+            else:
+                pending.append((node, True))
+                pending.extend((child, False)
+                               for child in reversed(node.children()))
+
+        fp = open(self.filePath, 'w')
+        json.dump({'width': self.width, 'height': self.height,
+                   'nodes': nodes, 'root': ids[self.root]}, fp)
+        fp.close()
+
+    def load(self, filePath):
+        """
+        Loads a composition; the referred clips are loaded on first use.
+
+        @param filePath path to the file
+        @raise InvalidCompositionException the file is malformed
+        """
+        self.filePath = filePath
+        self.loading = self.loading | {abspath(filePath)}
+
+        fp = open(filePath, 'r')
+        dump = json.load(fp)
+        fp.close()
+
+        self.width = dump.get('width', Clip.WIDTH)
+        self.height = dump.get('height', Clip.HEIGHT)
+
+        # Nodes may only refer to nodes before them, so there's no cycle
+        nodes = []
+
+        def node(nodeId):
+            if not isinstance(nodeId, int) or not 0 <= nodeId < len(nodes):
+                raise self.InvalidCompositionException(
+                    'reference to node {0}'.format(nodeId))
+            return nodes[nodeId]
+
+        for data in dump['nodes']:
+            nodeType = data.get('type')
+            if nodeType == 'frames':
+                nodes.append(self.frames(zip(
+                    (int(setup, 16) for setup in data['setups']),
+                    data['durations'])))
+            elif nodeType == 'source':
+                nodes.append(self.source(data['path']))
+            elif nodeType == 'segment':
+                nodes.append(self.segment(node(data['of']), data['start'],
+                                          data['end']))
+            elif nodeType == 'repeat':
+                nodes.append(self.repeat(node(data['of']), data['count']))
+            elif nodeType == 'reverse':
+                nodes.append(self.reverse(node(data['of'])))
+            elif nodeType == 'concat':
+                nodes.append(self.concat(*map(node, data['of'])))
+            else:
+                raise self.InvalidCompositionException(
+                    'unknown node {0}'.format(nodeType))
+        self.root = node(dump['root'])
+
+
+def main(argv):
+    """
+    Command line interface:
+        Composition.py create OUTPUT.nscc EXPRESSION [--width W --height H]
+        Composition.py info COMPOSITION
+        Composition.py expand COMPOSITION OUTPUT.nsc [--force]
+        Composition.py image COMPOSITION OUTPUT.hex
+        Composition.py upload COMPOSITION PORT [--slot SLOT]
+    See ComposedClip.parse for the expressions.
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='Composition.py')
+    commands = parser.add_subparsers(dest='command')
+    createParser = commands.add_parser('create',
+                                       help='compose clips by an expression')
+    createParser.add_argument('output')
+    createParser.add_argument('expression')
+    createParser.add_argument('--width', type=int, default=Clip.WIDTH)
+    createParser.add_argument('--height', type=int, default=Clip.HEIGHT)
+    infoParser = commands.add_parser('info', help='print the size')
+    infoParser.add_argument('composition')
+    expandParser = commands.add_parser('expand', help='save as .nsc clip')
+    expandParser.add_argument('composition')
+    expandParser.add_argument('output')
+    expandParser.add_argument('--force', action='store_true',
+                              help='expand even beyond the memory budget')
+    imageParser = commands.add_parser('image', help='export EEPROM image')
+    imageParser.add_argument('composition')
+    imageParser.add_argument('output')
+    uploadParser = commands.add_parser('upload', help='upload to a device')
+    uploadParser.add_argument('composition')
+    uploadParser.add_argument('port')
+    uploadParser.add_argument('--slot', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        clip = ComposedClip(width=args.width, height=args.height)
+        clip.root = clip.parse(args.expression)
+        # The paths are given relative to the working directory
+        for source in clip.sources.values():
+            source.path = relpath(source.path, dirname(abspath(args.output)))
+        clip.save(args.output)
+        return 0
+
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    clip = ComposedClip(args.composition)
+    if args.command == 'info':
+        records = clip.export()
+        print('{0:d} frames, {1:d} steps, {2:d} records'.format(
+            clip.size, clip.totalDuration(), len(records)))
+    elif args.command == 'expand':
+        size = MemoryBudget.estimateClip(clip.size, clip.starCount)
+        if not args.force and not MemoryBudget.fits(size):
+            print('The clip needs about {0}, but the memory budget is {1} '
+                  '(use --force).'.format(MemoryBudget.format(size),
+                                          MemoryBudget.format(
+                                              MemoryBudget.getBudget())),
+                  file=sys.stderr)
+            return 1
+        clip.toClip().save(args.output)
+    elif not clip.fitsDevice():
+        print('Only clips of the Nightsky device can be exported or '
+              'uploaded.', file=sys.stderr)
+        return 1
+    elif args.command == 'image':
+        EepromImage.fromRecords(clip.export()).save(args.output)
+    elif args.command == 'upload':
+        Communicator.start(args.port, args.slot)
+        for record in clip.export():
+            Communicator.transmitFrame(record)
+        Communicator.end()
+        if not Communicator.verify(args.port, clip, args.slot):
+            print('Verification failed.', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,112 @@
+"""
+Background discovery of connected Nightsky devices
+"""
+
+import threading
+from Communicator import Communicator
+
+
+class DeviceDiscovery:
+    """
+    Keeps the list of connected Nightsky devices up to date. The USB serial
+    ports are watched by a background thread; only ports, which appear, are
+    pinged, so the list can be read at any time without opening a port.
+    """
+
+    POLL_INTERVAL = 1  # Time between two looks at the USB ports in seconds
+
+    def __init__(self):
+        """
+        constructor
+        """
+        self.devices = {}  # Port -> True for Nightsky devices, else False
+        self.lock = threading.Lock()  # Serializes the scans
+        self.scanned = threading.Event()  # Set after the first scan
+        self.stopped = threading.Event()
+        self.listeners = []  # Callbacks, which get the list of devices
+        self.thread = None
+
+    def start(self):
+        """
+        Starts watching the ports.
+        """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops watching the ports.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def ports(self):
+        """
+        Returns the connected Nightsky devices.
+
+        @return sorted list with the ports of the devices
+        """
+        return sorted(port for port, isDevice in list(self.devices.items())
+                      if isDevice)
+
+    def waitForScan(self, timeout=None):
+        """
+        Waits until the ports were scanned at least once.
+
+        @param timeout maximum time to wait in seconds
+        @return the connected Nightsky devices (see ports)
+        """
+        self.scanned.wait(timeout)
+        return self.ports()
+
+    def scan(self):
+        """
+        Looks for appeared and disappeared ports and pings the new ones.
+
+        @return True if the list of devices has changed
+        """
+        with self.lock:
+            candidates = set(Communicator.candidatePorts())
+            changed = False
+
+            for port in list(self.devices):
+                if port not in candidates:
+                    changed |= self.devices.pop(port)
+
+            for port in candidates:
+                if port not in self.devices:
+                    self.devices[port] = Communicator.ping(port)
+                    changed |= self.devices[port]
+
+        self.scanned.set()
+        if changed:
+            devices = self.ports()
+            for listener in self.listeners:
+                listener(devices)
+
+        return changed
+
+    def rescan(self):
+        """
+        Pings all ports again, which didn't respond so far (e.g. a device,
+        which was busy while it was connected).
+
+        @return the connected Nightsky devices (see ports)
+        """
+        with self.lock:
+            for port, isDevice in list(self.devices.items()):
+                if not isDevice:
+                    del self.devices[port]
+        self.scan()
+        return self.ports()
+
+    def run(self):
+        """
+        Watches the ports (background thread).
+        """
+        while not self.stopped.is_set():
+            self.scan()
+            self.stopped.wait(self.POLL_INTERVAL)
@@ -0,0 +1,356 @@
+"""
+EEPROM images to provision Nightsky devices without the serial protocol
+"""
+
+from array import array
+from os.path import splitext
+from model import Clip
+
+
+class EepromImage:
+    """
+    Represents the complete EEPROM content of a Nightsky device, laid out as
+    the firmware writes it: a clip directory followed by the frames of all
+    slots, packed without gaps.
+    """
+
+    EEPROM_SIZE = 1024  # Size of the EEPROM of an ArduinoUNO in byte
+    FRAME_SIZE = 5  # Size of a record in byte
+    MAX_FRAME_COUNT = 200  # Maximum amount of records of all slots
+    SLOT_COUNT = 4  # Amount of clips, that can be stored
+    DIR_MAGIC = b'NS'  # Marks a formatted clip directory
+    DIR_ACTIVE_ADDR = 2  # Address of the id of the active slot
+    DIR_SLOTS_ADDR = 3  # Address of the slot table (first record, count)
+    DATA_ADDR = 16  # Address of the first record
+    ERASED_BYTE = 0xFF  # Value of an erased EEPROM cell
+    HEX_LINE_LENGTH = 16  # Data bytes per line of an Intel HEX file
+
+    class CompressedClipTooLong(Exception):
+        """
+        Exception for clips, which don't fit into the EEPROM
+        """
+
+        def __init__(self, recordCount):
+            """
+            constructor
+
+            @param recordCount amount of records of the compressed clips
+            """
+            super().__init__(self,
+                             'Compressed clips have {0:d} records, but only '
+                             '{1:d} fit into the EEPROM.'
+                             .format(recordCount,
+                                     EepromImage.MAX_FRAME_COUNT))
+
+    class InvalidImageException(Exception):
+        """
+        Exception for malformed image files
+        """
+
+        def __init__(self, reason):
+            """
+            constructor
+
+            @param reason description of the problem
+            """
+            super().__init__(self, 'Invalid EEPROM image: {0}'.format(reason))
+
+    def __init__(self, data=None):
+        """
+        constructor
+
+        @param data raw content of the EEPROM; if none is given, the image is
+            erased
+        """
+        if data is None:
+            data = bytes([self.ERASED_BYTE]) * self.EEPROM_SIZE
+
+        if len(data) > self.EEPROM_SIZE:
+            raise self.__class__.InvalidImageException(
+                'image has {0:d} bytes'.format(len(data)))
+
+        # Pad short images like an erased EEPROM
+        self.data = bytearray(data) + bytearray(
+            [self.ERASED_BYTE] * (self.EEPROM_SIZE - len(data)))
+
+    @classmethod
+    def fromSlots(cls, slots, activeSlot=0):
+        """
+        Creates an image containing several clips.
+
+        @param slots list of up to SLOT_COUNT lists of compressed frames as
+            bytes of the length 5 (None or an empty list for empty slots)
+        @param activeSlot id of the slot, which is played
+        @return the image
+        @raise CompressedClipTooLong too many records for the firmware
+        """
+        recordCount = sum(len(records) for records in slots if records)
+        if recordCount > cls.MAX_FRAME_COUNT:
+            raise cls.CompressedClipTooLong(recordCount)
+
+        image = cls()
+        image.formatDirectory()
+        image.setActiveSlot(activeSlot)
+
+        start = 0
+        for slot, records in enumerate(slots):
+            if not records:
+                continue
+            for i, record in enumerate(records):
+                image.saveFrame(start + i, record)
+            image.setSlot(slot, start, len(records))
+            start += len(records)
+
+        return image
+
+    @classmethod
+    def fromRecords(cls, records):
+        """
+        Creates an image containing the given records as the only clip.
+
+        @param records list of compressed frames as bytes of the length 5
+        @return the image
+        @raise CompressedClipTooLong too many records for the firmware
+        """
+        return cls.fromSlots([records])
+
+    @classmethod
+    def fromClip(cls, clip):
+        """
+        Creates an image containing the exported clip.
+
+        @param clip the clip
+        @return the image
+        """
+        return cls.fromRecords(clip.export())
+
+    # === Layout (mirrors the firmware) ===
+    def isFormatted(self):
+        """
+        Checks whether the image contains a clip directory.
+
+        @return True if the directory exists
+        """
+        return bytes(self.data[0:2]) == self.DIR_MAGIC
+
+    def formatDirectory(self):
+        """
+        Writes an empty clip directory.
+        """
+        self.data[0:2] = self.DIR_MAGIC
+        self.data[self.DIR_ACTIVE_ADDR] = 0
+        for slot in range(self.SLOT_COUNT):
+            self.setSlot(slot, 0, 0)
+
+    @property
+    def activeSlot(self):
+        """
+        returns the id of the slot, which is played
+        """
+        slot = self.data[self.DIR_ACTIVE_ADDR]
+        return slot if slot < self.SLOT_COUNT else 0
+
+    def setActiveSlot(self, slot):
+        """
+        Sets the slot, which is played.
+
+        @param slot id of the slot
+        """
+        self.data[self.DIR_ACTIVE_ADDR] = slot
+
+    def getSlot(self, slot):
+        """
+        Returns the position of the clip of a slot.
+
+        @param slot id of the slot
+        @return tuple of the first record and the amount of records
+        """
+        addr = self.DIR_SLOTS_ADDR + slot * 2
+        return self.data[addr], self.data[addr + 1]
+
+    def setSlot(self, slot, start, length):
+        """
+        Sets the position of the clip of a slot.
+
+        @param slot id of the slot
+        @param start id of the first record
+        @param length amount of records
+        """
+        addr = self.DIR_SLOTS_ADDR + slot * 2
+        self.data[addr] = start
+        self.data[addr + 1] = length
+
+    def saveFrame(self, frameId, record):
+        """
+        Writes a record at the desired position.
+
+        @param frameId index (position) of the record
+        @param record compressed frame as bytes of the length 5
+        """
+        startAddr = self.DATA_ADDR + frameId * self.FRAME_SIZE
+        self.data[startAddr:startAddr + self.FRAME_SIZE] = record
+
+    def records(self, slot=None):
+        """
+        Returns the records of a clip.
+
+        @param slot id of the slot; the active slot if none is given
+        @return list of compressed frames as bytes of the length 5
+        @raise InvalidImageException the image has no clip directory
+        """
+        if not self.isFormatted():
+            raise self.__class__.InvalidImageException('missing directory')
+
+        if slot is None:
+            slot = self.activeSlot
+
+        start, length = self.getSlot(slot)
+        if start + length > self.MAX_FRAME_COUNT:
+            raise self.__class__.InvalidImageException(
+                'slot {0:d} out of bound'.format(slot))
+
+        startAddr = self.DATA_ADDR + start * self.FRAME_SIZE
+        return [bytes(self.data[addr:addr + self.FRAME_SIZE])
+                for addr in range(startAddr,
+                                  startAddr + length * self.FRAME_SIZE,
+                                  self.FRAME_SIZE)]
+
+    def slots(self):
+        """
+        Returns the records of all slots.
+
+        @return list of SLOT_COUNT lists of compressed frames
+        """
+        return [self.records(slot) for slot in range(self.SLOT_COUNT)]
+
+    def toClip(self, slot=None):
+        """
+        Decodes a clip of the image.
+
+        @param slot id of the slot; the active slot if none is given
+        @return the decoded clip
+        """
+        clip = Clip()
+        clip.importRecords(self.records(slot))
+        return clip
+
+    # === File formats ===
+    def save(self, filePath):
+        """
+        Saves the image. Files ending with .hex or .eep are written in the
+        Intel HEX format, all others as raw binary.
+
+        @param filePath path to the file
+        """
+        if self.isHexFile(filePath):
+            fp = open(filePath, 'w')
+            fp.write(self.toIntelHex())
+        else:
+            fp = open(filePath, 'wb')
+            fp.write(bytes(self.data))
+        fp.close()
+
+    @classmethod
+    def load(cls, filePath):
+        """
+        Loads an image. The format is chosen like in save.
+
+        @param filePath path to the file
+        @return the image
+        """
+        if cls.isHexFile(filePath):
+            fp = open(filePath, 'r')
+            image = cls.fromIntelHex(fp.read())
+        else:
+            fp = open(filePath, 'rb')
+            image = cls(fp.read())
+        fp.close()
+
+        return image
+
+    @staticmethod
+    def isHexFile(filePath):
+        """
+        Checks whether a file should be in the Intel HEX format.
+
+        @param filePath path to the file
+        @return True for .hex and .eep files
+        """
+        return splitext(filePath)[1].lower() in ('.hex', '.eep')
+
+    def toIntelHex(self):
+        """
+        Converts the image into the Intel HEX format as used by avrdude.
+
+        @return the content of the hex file as string
+        """
+        lines = []
+        for addr in range(0, self.EEPROM_SIZE, self.HEX_LINE_LENGTH):
+            chunk = self.data[addr:addr + self.HEX_LINE_LENGTH]
+            lines.append(self.hexRecord(addr, 0x00, chunk))
+        lines.append(self.hexRecord(0, 0x01, b''))  # End of file
+
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def fromIntelHex(cls, content):
+        """
+        Parses an image in the Intel HEX format.
+
+        @param content content of the hex file as string
+        @return the image
+        @raise InvalidImageException the content is malformed
+        """
+        data = bytearray([cls.ERASED_BYTE] * cls.EEPROM_SIZE)
+        baseAddr = 0
+
+        for line in content.splitlines():
+            line = line.strip()
+            if line == '':
+                continue
+            if not line.startswith(':'):
+                raise cls.InvalidImageException('missing start code')
+
+            try:
+                raw = bytes.fromhex(line[1:])
+            except ValueError:
+                raise cls.InvalidImageException('no hex digits')
+
+            if len(raw) < 5 or len(raw) != raw[0] + 5:
+                raise cls.InvalidImageException('wrong record length')
+            if sum(raw) & 0xFF != 0:
+                raise cls.InvalidImageException('wrong checksum')
+
+            addr = baseAddr + ((raw[1] << 8) | raw[2])
+            recordType = raw[3]
+            payload = raw[4:-1]
+
+            if recordType == 0x00:  # Data
+                if addr + len(payload) > cls.EEPROM_SIZE:
+                    raise cls.InvalidImageException('data out of bound')
+                data[addr:addr + len(payload)] = payload
+            elif recordType == 0x01:  # End of file
+                break
+            elif recordType == 0x02:  # Extended segment address
+                baseAddr = int.from_bytes(payload, 'big') << 4
+            elif recordType == 0x04:  # Extended linear address
+                baseAddr = int.from_bytes(payload, 'big') << 16
+
+        return cls(data)
+
+    @staticmethod
+    def hexRecord(addr, recordType, payload):
+        """
+        Builds a single line of an Intel HEX file.
+
+        @param addr 16 bit address of the payload
+        @param recordType type of the record
+        @param payload data of the record
+        @return the line without line break
+        """
+        raw = array('B', [len(payload), (addr >> 8) & 0xFF, addr & 0xFF,
+                          recordType])
+        raw.extend(payload)
+        raw.append((-sum(raw)) & 0xFF)  # Two's complement checksum
+
+        return ':' + bytes(raw).hex().upper()
@@ -0,0 +1,465 @@
+"""
+Cycle cost simulation of the firmware's main loop (refresh rate and timing)
+"""
+
+import argparse
+import json
+import sys
+from Composition import ComposedClip
+from FlashImage import FlashImage
+from model import Clip
+
+
+class FirmwareSimulator:
+    """
+    Runs a clip through a model of loop() in arduino/main.ino on a virtual
+    clock. Every call of the loop has a cost in microseconds (see COSTS), so
+    the simulation predicts how fast the lines of the matrix are multiplexed,
+    how long every line is lit and how much the frames deviate from their
+    durations, without a scope.
+
+    The model follows the firmware: a record is loaded (from the EEPROM or
+    the flash) when the duration of the current frame is over, one line is
+    shifted out and latched per loop, and a step ends when millis() is at
+    least STEP_DURATION after the previous step. Between loops, serialEvent
+    handles requests, which arrive at a given rate, and the timer interrupt
+    of millis() runs every TIMER_PERIOD microseconds.
+    """
+
+    # Default costs in microseconds (ATmega328P at 16 MHz, Arduino core)
+    COSTS = {
+        'loop': 1.5,  # Call of loop() and the test for the next frame
+        'digitalWrite': 4.0,  # digitalWrite of the latch pin
+        'shiftOut': 110.0,  # shiftOut of a byte (16 digitalWrites)
+        'lineModulo': 14.0,  # (curLine + 1) % LINE_AMOUNT (int division)
+        'millis': 1.5,  # Call of millis()
+        'eepromRead': 1.0,  # EEPROM.read of a byte
+        'flashRead': 2.0,  # memcpy_P of a record
+        'decode': 6.0,  # showRecord
+        'serialCheck': 1.0,  # Serial.available() in serialEventRun
+        'serialEvent': 60.0,  # A request, whose bytes have been received
+        'timerInterrupt': 6.0,  # Timer 0 overflow interrupt (millis)
+    }
+    STEP_DURATION = 100  # Time of an animation step in ms (firmware)
+    LINE_AMOUNT = 5
+    FRAME_SIZE = 5  # Size of a record in byte
+    EEPROM_FRAME_COUNT = 200  # Records, which fit into the EEPROM
+    TIMER_PERIOD = 1024  # Time between two timer interrupts in microseconds
+    # Refresh rates (of the whole matrix) without and with visible flicker
+    FLICKER_FREE_RATE = 100
+    FLICKER_RATE = 60
+
+    class EmptyClipException(Exception):
+        """
+        Exception for clips without frames (the firmware would write its
+        default clip).
+        """
+
+        def __init__(self):
+            """
+            constructor
+            """
+            super().__init__(self, 'The clip has no frames.')
+
+    def __init__(self, records, flash=False, costs=None, serialRate=0):
+        """
+        constructor
+
+        @param records list of compressed frames (see Clip.export)
+        @param flash True to read the records from the flash (FLASH_CLIP)
+            instead of the EEPROM
+        @param costs dictionary name -> microseconds, which replaces some of
+            the default costs
+        @param serialRate amount of requests per second, which are handled
+            by serialEvent
+        @raise EmptyClipException the clip has no frames
+        @raise KeyError unknown name of a cost
+        """
+        if len(records) == 0:
+            raise self.__class__.EmptyClipException()
+        self.records = list(records)
+        self.flash = flash
+        self.costs = dict(self.COSTS)
+        for name, cost in (costs or {}).items():
+            if name not in self.COSTS:
+                raise KeyError(name)
+            self.costs[name] = cost
+        self.serialRate = serialRate
+        # Every microsecond of the loop is stretched by the timer interrupts
+        self.stretch = 1 + self.costs['timerInterrupt'] / self.TIMER_PERIOD
+
+    @classmethod
+    def fromClip(cls, clip, **kwargs):
+        """
+        Creates a simulator for the exported records of a clip.
+
+        @param clip the clip (or a ComposedClip)
+        @param kwargs further arguments of the constructor
+        @return the simulator
+        """
+        return cls(clip.export(), **kwargs)
+
+    def fitsMemory(self):
+        """
+        Checks whether the records fit into the EEPROM or the flash.
+
+        @return True if they fit
+        """
+        if self.flash:
+            return len(self.records) <= FlashImage.MAX_FRAME_COUNT
+        return len(self.records) <= self.EEPROM_FRAME_COUNT
+
+    def loadCost(self):
+        """
+        Returns the cost of loadFrame or loadFlashFrame.
+
+        @return the cost in microseconds
+        """
+        if self.flash:
+            return self.costs['flashRead'] + self.costs['decode']
+        return self.FRAME_SIZE * self.costs['eepromRead'] + \
+            self.costs['decode']
+
+    # ==== Simulation ====
+    def run(self, passes=1, maxSeconds=None):
+        """
+        Plays the clip from the start of the firmware.
+
+        @param passes amount of times, the clip is played
+        @param maxSeconds stops after this simulated time
+        @return the report (see report)
+        """
+        self.reset()
+        endTime = maxSeconds * 1e6 if maxSeconds is not None else None
+        while self.passes < passes:
+            if endTime is not None and self.time >= endTime:
+                break
+            steady = self.iteration(passes)
+            if steady is not None:
+                self.fastForward(steady, endTime)
+        return self.report()
+
+    def reset(self):
+        """
+        Resets the firmware and the statistics.
+        """
+        # State of the firmware
+        self.time = 0.0  # Simulated time in microseconds
+        self.curFrameDuration = 0
+        self.nextFrameId = 0
+        self.curLine = 0
+        self.lastStepTime = 0
+        self.nextSerialTime = 1e6 / self.serialRate if self.serialRate \
+            else None
+
+        # Statistics
+        self.passes = 0
+        self.loops = 0
+        self.minLoop = None
+        self.maxLoop = 0.0
+        self.lastLatch = None  # Time and line of the last latch
+        self.lineLatches = [None] * self.LINE_AMOUNT  # Last latch per line
+        self.lineTimes = [0.0] * self.LINE_AMOUNT  # Lit time per line
+        self.maxGap = 0.0  # Longest time between two latches of a line
+        self.frameStart = None  # Time and nominal duration of the frame
+        self.frameCount = 0
+        self.nominalTime = 0.0
+        self.actualTime = 0.0
+        self.maxFrameError = 0.0
+        self.stepStart = 0.0
+        self.steps = [0, 0.0, 0.0, 0.0]  # Count, sum, sum of squares, max
+
+    def spend(self, name, count=1):
+        """
+        Advances the clock by the cost of a call.
+
+        @param name name of the cost
+        @param count amount of calls
+        """
+        self.time += count * self.costs[name] * self.stretch
+
+    def millis(self):
+        """
+        Returns the value of millis() at the current time.
+
+        @return the time in ms
+        """
+        return int(self.time // 1000)
+
+    def iteration(self, passes):
+        """
+        Simulates one call of loop() and the following serialEventRun.
+
+        @param passes amount of passes, after which the simulation stops
+        @return tuple of the cost of the loop, the offset of the latch and
+            the offset of the step test (in microseconds), if the loop only
+            rendered a line and can be repeated by fastForward, else None
+        """
+        startTime = self.time
+        steady = True
+        self.spend('loop')
+
+        # Load next frame, when it's over
+        if self.curFrameDuration < 1:
+            if self.nextFrameId >= len(self.records):
+                self.endFrame()
+                self.passes += 1
+                if self.passes >= passes:
+                    return None
+                # restartAnimation
+                self.spend('millis')
+                self.curFrameDuration = 0
+                self.nextFrameId = 0
+                self.lastStepTime = self.millis()
+                self.stepStart = self.time
+            self.endFrame()
+            self.time += self.loadCost() * self.stretch
+            record = self.records[self.nextFrameId]
+            self.curFrameDuration = (record[0] << 2) + (record[1] >> 6)
+            self.frameStart = (self.time,
+                               self.curFrameDuration * self.STEP_DURATION)
+            self.nextFrameId += 1
+            steady = False
+
+        # Render current line
+        self.spend('digitalWrite')
+        self.spend('shiftOut', 2)
+        self.spend('digitalWrite')
+        latchOffset = self.time - startTime
+        self.latch(self.curLine, self.time)
+        self.spend('lineModulo')
+        self.curLine = (self.curLine + 1) % self.LINE_AMOUNT
+
+        # Determine end of step; the second millis() of the condition is
+        # called, whenever the first comparison fails
+        self.spend('millis')
+        stepOffset = self.time - startTime
+        if self.millis() - self.lastStepTime >= self.STEP_DURATION:
+            self.spend('millis')
+            self.lastStepTime = self.millis()
+            self.curFrameDuration = (self.curFrameDuration - 1) & 0xFFFF
+            self.addStep(self.time - self.stepStart)
+            self.stepStart = self.time
+            steady = False
+        else:
+            self.spend('millis')
+
+        # serialEventRun
+        self.spend('serialCheck')
+        if self.nextSerialTime is not None and \
+                self.time >= self.nextSerialTime:
+            self.spend('serialEvent')
+            self.nextSerialTime += 1e6 / self.serialRate
+            steady = False
+
+        self.addLoop(self.time - startTime)
+        if steady:
+            return self.time - startTime, latchOffset, stepOffset
+        return None
+
+    def fastForward(self, steady, endTime=None):
+        """
+        Repeats a loop, which only rendered a line, until a step could end,
+        a request could arrive or the time is up. Those loops cost the same
+        time, so their statistics are added without simulating every one.
+
+        @param steady tuple of the cost of the loop and the offsets of the
+            latch and of the step test (see iteration)
+        @param endTime time, at which the simulation stops
+        """
+        cost, latchOffset, stepOffset = steady
+        limit = (self.lastStepTime + self.STEP_DURATION) * 1000 - stepOffset
+        if self.nextSerialTime is not None:
+            limit = min(limit, self.nextSerialTime - cost)
+        if endTime is not None:
+            limit = min(limit, endTime)
+        # The last loop before the limit is simulated (rounding of the time)
+        count = int((limit - self.time) // cost) - 1
+        if count <= 0:
+            return
+
+        startTime = self.time
+        # The first latches of every line complete their gaps
+        for i in range(min(count, self.LINE_AMOUNT)):
+            self.latch((self.curLine + i) % self.LINE_AMOUNT,
+                       startTime + i * cost + latchOffset)
+        # Further latches credit a loop to the previous line and are a
+        # matrix refresh apart from the previous latch of their line
+        if count > self.LINE_AMOUNT:
+            latches = count - self.LINE_AMOUNT
+            for j in range(self.LINE_AMOUNT):
+                line = (self.curLine + self.LINE_AMOUNT - 1 + j) % \
+                    self.LINE_AMOUNT
+                self.lineTimes[line] += cost * \
+                    ((latches - j + self.LINE_AMOUNT - 1) // self.LINE_AMOUNT)
+            self.maxGap = max(self.maxGap, cost * self.LINE_AMOUNT)
+            for i in range(count - self.LINE_AMOUNT, count):
+                line = (self.curLine + i) % self.LINE_AMOUNT
+                self.lineLatches[line] = startTime + i * cost + latchOffset
+            self.lastLatch = (startTime + (count - 1) * cost + latchOffset,
+                              (self.curLine + count - 1) % self.LINE_AMOUNT)
+
+        self.curLine = (self.curLine + count) % self.LINE_AMOUNT
+        self.time = startTime + count * cost
+        self.loops += count
+
+    # ==== Statistics ====
+    def latch(self, line, latchTime):
+        """
+        Records the latch of a line: the previous line was lit until now.
+
+        @param line id of the latched line
+        @param latchTime time of the latch
+        """
+        if self.lastLatch is not None:
+            self.lineTimes[self.lastLatch[1]] += latchTime - self.lastLatch[0]
+        if self.lineLatches[line] is not None:
+            self.maxGap = max(self.maxGap,
+                              latchTime - self.lineLatches[line])
+        self.lineLatches[line] = latchTime
+        self.lastLatch = (latchTime, line)
+
+    def endFrame(self):
+        """
+        Compares the shown time of the current frame with its duration.
+        """
+        if self.frameStart is None:
+            return
+        startTime, nominal = self.frameStart
+        actual = (self.time - startTime) / 1000
+        self.frameCount += 1
+        self.nominalTime += nominal
+        self.actualTime += actual
+        self.maxFrameError = max(self.maxFrameError, abs(actual - nominal))
+        self.frameStart = None
+
+    def addStep(self, duration):
+        """
+        Records the duration of a step.
+
+        @param duration the duration in microseconds
+        """
+        self.steps[0] += 1
+        self.steps[1] += duration
+        self.steps[2] += duration * duration
+        self.steps[3] = max(self.steps[3], duration)
+
+    def addLoop(self, duration):
+        """
+        Records the duration of a simulated loop.
+
+        @param duration the duration in microseconds
+        """
+        self.loops += 1
+        self.maxLoop = max(self.maxLoop, duration)
+        if self.minLoop is None or duration < self.minLoop:
+            self.minLoop = duration
+
+    def report(self):
+        """
+        Summarizes the simulation.
+
+        @return dictionary with the refresh rate, the duty cycle of every
+            line, the flicker risk and the timing errors of the frames and
+            steps
+        """
+        seconds = self.time / 1e6
+        refreshRate = self.loops / self.LINE_AMOUNT / max(seconds, 1e-9)
+        minRefreshRate = 1e6 / self.maxGap if self.maxGap > 0 \
+            else refreshRate
+        litTime = max(sum(self.lineTimes), 1e-9)
+        duty = [lineTime / litTime for lineTime in self.lineTimes]
+
+        if minRefreshRate >= self.FLICKER_FREE_RATE:
+            flickerRisk = 'low'
+        elif minRefreshRate >= self.FLICKER_RATE:
+            flickerRisk = 'medium'
+        else:
+            flickerRisk = 'high'
+
+        stepCount, stepSum, stepSquares, maxStep = self.steps
+        stepMean = stepSum / max(1, stepCount)
+        stepJitter = max(0.0, stepSquares / max(1, stepCount) -
+                         stepMean ** 2) ** 0.5
+
+        return {
+            'records': len(self.records),
+            'memory': 'flash' if self.flash else 'eeprom',
+            'fitsMemory': self.fitsMemory(),
+            'passes': self.passes,
+            'seconds': seconds,
+            'loops': self.loops,
+            'loopMicros': {'mean': self.time / max(1, self.loops),
+                           'min': self.minLoop or 0.0,
+                           'max': self.maxLoop},
+            'refreshRate': refreshRate,
+            'minRefreshRate': minRefreshRate,
+            'lineDuty': duty,
+            'lineDutySpread': max(duty) / max(min(duty), 1e-9) - 1,
+            'flickerRisk': flickerRisk,
+            'frames': {'count': self.frameCount,
+                       'nominalMs': self.nominalTime,
+                       'actualMs': self.actualTime,
+                       'driftMs': self.actualTime - self.nominalTime,
+                       'maxErrorMs': self.maxFrameError},
+            'steps': {'count': stepCount,
+                      'meanMs': stepMean / 1000,
+                      'jitterMs': stepJitter / 1000,
+                      'maxMs': maxStep / 1000},
+        }
+
+
+def main(argv):
+    """
+    Command line interface:
+        FirmwareSimulator.py CLIP [--flash] [--passes N] [--seconds S]
+                             [--serial-rate HZ] [--cost NAME=MICROSECONDS]
+    CLIP is a clip (.nsc) or composition (.nscc); the report is printed as
+    JSON. --cost replaces a cost of the model and may be repeated.
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='FirmwareSimulator.py')
+    parser.add_argument('clip')
+    parser.add_argument('--flash', action='store_true',
+                        help='play from the flash (FLASH_CLIP)')
+    parser.add_argument('--passes', type=int, default=1)
+    parser.add_argument('--seconds', type=float)
+    parser.add_argument('--serial-rate', type=float, default=0,
+                        help='requests per second')
+    parser.add_argument('--cost', action='append', default=[],
+                        help='NAME=MICROSECONDS, names: ' +
+                        ', '.join(sorted(FirmwareSimulator.COSTS)))
+    args = parser.parse_args(argv)
+
+    costs = {}
+    for cost in args.cost:
+        name, _, value = cost.partition('=')
+        if name not in FirmwareSimulator.COSTS:
+            print('Unknown cost: {0}'.format(name), file=sys.stderr)
+            return 2
+        costs[name] = float(value)
+
+    if args.clip.endswith(ComposedClip.SUFFIX):
+        clip = ComposedClip(args.clip)
+    else:
+        clip = Clip(args.clip)
+    if not clip.fitsDevice():
+        print('Only clips of the Nightsky device can be simulated.',
+              file=sys.stderr)
+        return 1
+
+    try:
+        simulator = FirmwareSimulator.fromClip(clip, flash=args.flash,
+                                               costs=costs,
+                                               serialRate=args.serial_rate)
+    except FirmwareSimulator.EmptyClipException as e:
+        print(e.args[-1], file=sys.stderr)
+        return 1
+    print(json.dumps(simulator.run(args.passes, args.seconds), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,212 @@
+"""
+Clips compiled into the flash memory of the firmware (C header with PROGMEM
+records)
+"""
+
+import argparse
+import re
+import sys
+from os.path import abspath, dirname, join
+from CompileCache import CompileCache
+from Composition import ComposedClip
+from model import Clip
+
+
+class FlashImage:
+    """
+    Represents a clip, which is compiled into the firmware. The records are
+    exactly the ones of Clip.export (and therefore of the EEPROM), written as
+    PROGMEM array into a C header. The firmware plays it, if it's built with
+    FLASH_CLIP defined (see arduino/main.ino).
+    """
+
+    FRAME_SIZE = 5  # Size of a record in byte
+    # Flash, which is left for the clip: 32 KB minus the bootloader and the
+    # firmware
+    FLASH_CAPACITY = 24 * 1024
+    MAX_FRAME_COUNT = FLASH_CAPACITY // FRAME_SIZE
+    HEADER_NAME = 'flash_clip.h'  # Name of the header within the firmware
+
+    class CompressedClipTooLong(Exception):
+        """
+        Exception for clips, which don't fit into the flash
+        """
+
+        def __init__(self, recordCount):
+            """
+            constructor
+
+            @param recordCount amount of records of the compressed clip
+            """
+            super().__init__(self,
+                             'Compressed clip has {0:d} records, but only '
+                             '{1:d} fit into the flash.'.format(
+                                 recordCount, FlashImage.MAX_FRAME_COUNT))
+
+    class InvalidHeaderException(Exception):
+        """
+        Exception for files, which aren't generated flash clips
+        """
+
+        def __init__(self, reason):
+            """
+            constructor
+
+            @param reason description of the problem
+            """
+            super().__init__(self, 'Invalid flash clip: {0}'.format(reason))
+
+    def __init__(self, records):
+        """
+        constructor
+
+        @param records list of compressed frames as bytes of the length 5
+        @raise CompressedClipTooLong too many records for the flash
+        """
+        if len(records) > self.MAX_FRAME_COUNT:
+            raise self.__class__.CompressedClipTooLong(len(records))
+        self.records = list(records)
+
+    @classmethod
+    def fromClip(cls, clip):
+        """
+        Creates an image of the exported clip.
+
+        @param clip the clip (or a ComposedClip)
+        @return the image
+        @raise CompressedClipTooLong too many records for the flash
+        """
+        return cls(clip.export())
+
+    def toClip(self):
+        """
+        Decodes the clip of the image.
+
+        @return the decoded clip
+        """
+        clip = Clip()
+        clip.importRecords(self.records)
+        return clip
+
+    # === File format ===
+    def toHeader(self):
+        """
+        Generates the C header, a record per line.
+
+        @return the content of the header
+        """
+        lines = [
+            '/**',
+            ' * Clip for the flash memory of a Nightsky device, generated by '
+            'client/FlashImage.py.',
+            ' * The firmware plays it, if it\'s built with FLASH_CLIP '
+            'defined.',
+            ' */',
+            '',
+            '#ifndef FLASH_CLIP_H',
+            '#define FLASH_CLIP_H',
+            '',
+            '#include <avr/pgmspace.h>',
+            '',
+            '#define FLASH_CLIP_LENGTH {0:d} // Amount of frames'.format(
+                len(self.records)),
+            '',
+            'const unsigned char flashClip[{0:d}] PROGMEM = {{'.format(
+                max(1, len(self.records) * self.FRAME_SIZE))]
+        for frameId, record in enumerate(self.records):
+            lines.append('    {0}, // {1:d}'.format(
+                ', '.join('0x{0:02x}'.format(value) for value in record),
+                frameId))
+        if len(self.records) == 0:
+            lines.append('    0x00 // Empty arrays aren\'t allowed')
+        lines.extend(['};', '', '#endif', ''])
+        return '\n'.join(lines)
+
+    def save(self, filePath):
+        """
+        Saves the image as C header.
+
+        @param filePath path to the header
+        """
+        fp = open(filePath, 'w')
+        fp.write(self.toHeader())
+        fp.close()
+
+    @classmethod
+    def load(cls, filePath):
+        """
+        Loads a generated header.
+
+        @param filePath path to the header
+        @return the image
+        @raise InvalidHeaderException the file isn't a generated header
+        """
+        fp = open(filePath, 'r')
+        content = fp.read()
+        fp.close()
+
+        length = re.search(r'#define FLASH_CLIP_LENGTH (\d+)', content)
+        array = re.search(r'flashClip\[\d+\] PROGMEM = \{(.*?)\};', content,
+                          re.DOTALL)
+        if length is None or array is None:
+            raise cls.InvalidHeaderException('missing clip')
+
+        data = bytes(int(value, 16) for value in
+                     re.findall(r'0x([0-9a-fA-F]{2})',
+                                re.sub(r'//[^\n]*', '', array.group(1))))
+        frameCount = int(length.group(1))
+        if len(data) < frameCount * cls.FRAME_SIZE:
+            raise cls.InvalidHeaderException('truncated records')
+
+        return cls([data[i:i + cls.FRAME_SIZE]
+                    for i in range(0, frameCount * cls.FRAME_SIZE,
+                                   cls.FRAME_SIZE)])
+
+
+def main(argv):
+    """
+    Command line interface:
+        FlashImage.py CLIP [-o OUTPUT]
+    CLIP is a clip (.nsc) or composition (.nscc); the header is written to
+    arduino/flash_clip.h next to the firmware by default.
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='FlashImage.py')
+    parser.add_argument('clip')
+    parser.add_argument('-o', '--output')
+    args = parser.parse_args(argv)
+
+    # Clip files are only loaded, if their records aren't cached
+    if args.clip.endswith(ComposedClip.SUFFIX):
+        clip = ComposedClip(args.clip)
+        geometry = (clip.width, clip.height)
+        records = clip.export()
+    else:
+        width, height, records = CompileCache().export(args.clip)
+        geometry = (width, height)
+    if geometry != (Clip.WIDTH, Clip.HEIGHT):
+        print('Only clips of the Nightsky device can be compiled.',
+              file=sys.stderr)
+        return 1
+
+    output = args.output
+    if output is None:
+        output = join(dirname(dirname(abspath(__file__))), 'arduino',
+                      FlashImage.HEADER_NAME)
+
+    try:
+        image = FlashImage(records)
+    except FlashImage.CompressedClipTooLong as e:
+        print(e.args[-1], file=sys.stderr)
+        return 1
+    image.save(output)
+    print('{0:d} records ({1:d} bytes) written to {2}'.format(
+        len(image.records), len(image.records) * FlashImage.FRAME_SIZE,
+        output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
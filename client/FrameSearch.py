@@ -0,0 +1,163 @@
+"""
+Search for frames by their star setup
+"""
+
+from itertools import islice
+
+
+def popcount(value):
+    """
+    Counts the set bits of an integer.
+
+    @param value a non negative integer
+    @return the amount of set bits
+    """
+    return bin(value).count('1')
+
+
+class FrameSearchIndex:
+    """
+    Index over the setups of the frames of a clip, which answers exact and
+    near-match (Hamming distance) queries.
+
+    The distinct setups are bucketed by blocks of their bits: if two setups
+    differ in at most k stars and the setup is split into more than k
+    blocks, at least one block is identical (pigeonhole principle). So only
+    the setups sharing a block with the query have to be compared.
+    The index is rebuilt lazily, when the clip has changed.
+    """
+
+    def __init__(self, clip, blockCount=6):
+        """
+        constructor
+
+        @param clip the clip to search in
+        @param blockCount amount of blocks the setups are split into;
+            queries with a distance below this amount use the buckets
+        """
+        self.clip = clip
+        self.blockCount = blockCount
+        self.revision = None
+        self.positions = {}  # Setup -> ascending list of frame ids
+        self.blocks = []  # List of (shift, mask, {block value -> setups})
+
+    def refresh(self):
+        """
+        Rebuilds the index, if the clip has changed since the last build.
+        """
+        if self.revision == self.clip.revision:
+            return
+
+        self.positions = {}
+        for frameId, frame in enumerate(self.clip.frames):
+            self.positions.setdefault(frame.export(), []).append(frameId)
+
+        # Split the bits into blocks of (nearly) the same size
+        starCount = self.clip.starCount
+        blockCount = max(1, min(self.blockCount, starCount))
+        self.blocks = []
+        start = 0
+        for i in range(blockCount):
+            width = starCount // blockCount + \
+                (1 if i < starCount % blockCount else 0)
+            buckets = {}
+            mask = (1 << width) - 1
+            for setup in self.positions:
+                buckets.setdefault((setup >> start) & mask, []).append(setup)
+            self.blocks.append((start, mask, buckets))
+            start += width
+
+        self.revision = self.clip.revision
+
+    def find(self, setup):
+        """
+        Returns all frames with exactly the given setup.
+
+        @param setup the setup as integer (see Frame.export)
+        @return ascending list of frame ids
+        """
+        self.refresh()
+        return list(self.positions.get(setup, []))
+
+    def similarSetups(self, setup, maxDistance):
+        """
+        Returns the distinct setups of the clip, which differ in at most
+        maxDistance stars from the given setup.
+
+        @param setup the setup as integer
+        @param maxDistance maximum amount of differing stars
+        @return dict setup -> distance
+        """
+        self.refresh()
+
+        if maxDistance < len(self.blocks):
+            # Any maxDistance + 1 blocks contain an identical one; use the
+            # ones with the smallest buckets
+            candidateLists = sorted(
+                (buckets.get((setup >> shift) & mask, [])
+                 for shift, mask, buckets in self.blocks), key=len)
+            candidates = set()
+            for candidateList in candidateLists[:maxDistance + 1]:
+                candidates.update(candidateList)
+        else:
+            candidates = self.positions.keys()
+
+        result = {}
+        for candidate in candidates:
+            distance = popcount(candidate ^ setup)
+            if distance <= maxDistance:
+                result[candidate] = distance
+
+        return result
+
+    def findSimilar(self, setup, maxDistance):
+        """
+        Returns all frames, which differ in at most maxDistance stars from
+        the given setup.
+
+        @param setup the setup as integer
+        @param maxDistance maximum amount of differing stars
+        @return ascending list of frame ids
+        """
+        frameIds = []
+        for candidate in self.similarSetups(setup, maxDistance):
+            frameIds.extend(self.positions[candidate])
+
+        return sorted(frameIds)
+
+    def nearDuplicates(self, maxDistance=1):
+        """
+        Returns the pairs of distinct setups, which differ in at least one
+        and at most maxDistance stars. This compares every setup with its
+        candidates, so it's meant for explicit queries.
+
+        @param maxDistance maximum amount of differing stars
+        @return list of (setup, other setup, distance) with setup < other
+        """
+        self.refresh()
+
+        pairs = []
+        for setup in self.positions:
+            for other, distance in self.similarSetups(
+                    setup, maxDistance).items():
+                if setup < other:
+                    pairs.append((setup, other, distance))
+
+        return pairs
+
+    def mergeCandidates(self, maxDistance=1):
+        """
+        Returns the frames, which are near duplicates of their successor.
+        Merging them saves a record on the device, because export only
+        combines identical consecutive frames. Only consecutive frames are
+        compared, so this doesn't need the index.
+
+        @param maxDistance maximum amount of differing stars
+        @return list of frame ids i, where frame i and i + 1 are near
+            duplicates
+        """
+        frames = self.clip.frames
+        return [i for i, (frame, nextFrame) in
+                enumerate(zip(frames, islice(frames, 1, None)))
+                if 0 < popcount(frame.export() ^ nextFrame.export())
+                <= maxDistance]
@@ -0,0 +1,331 @@
+"""
+Sequence of frames with logarithmic inserts, removals and moves
+"""
+
+from itertools import chain, islice
+
+
+class FrameSequence:
+    """
+    Replacement of the list of the frames of a clip. The frames are stored
+    in chunks (short lists) and a Fenwick tree over the lengths of the
+    chunks finds the chunk of an index in logarithmic time. Inserting,
+    removing or moving a frame only shifts the frames within its chunk
+    instead of the whole tail of the clip. Indexed access costs a lookup in
+    the tree; iterating walks the chunks, which is as fast as iterating a
+    list.
+
+    Copies (see copy and freeze) share their chunks: a chunk is copied by
+    the first change after it was shared. So a snapshot of a long clip
+    costs only the list of its chunks.
+    """
+
+    CHUNK_SIZE = 512  # Frames per chunk; chunks are split at twice the size
+
+    class FrozenSequenceException(Exception):
+        """
+        Exception for modifications of frozen sequences.
+        """
+
+        def __init__(self):
+            """
+            constructor
+            """
+            super().__init__(self, 'The frames of a snapshot are read-only.')
+
+    def __init__(self, frames=()):
+        """
+        constructor
+
+        @param frames iterable of the initial frames
+        """
+        self.chunks = []
+        # Ids of the chunks, which aren't shared with a copy
+        self.owned = set()
+        # Fenwick tree over the lengths of the chunks (None until it's needed
+        # after chunks were split or merged)
+        self.tree = None
+        self.length = 0
+        self.frozen = False
+        self.extend(frames)
+
+    def __len__(self):
+        """
+        returns the amount of frames
+
+        @return the amount of frames
+        """
+        return self.length
+
+    def __iter__(self):
+        """
+        iterates the frames in order
+
+        @return iterator of the frames
+        """
+        return chain.from_iterable(self.chunks)
+
+    def __reversed__(self):
+        """
+        iterates the frames in reverse order
+
+        @return iterator of the frames
+        """
+        return chain.from_iterable(reversed(chunk)
+                                   for chunk in reversed(self.chunks))
+
+    def __getitem__(self, index):
+        """
+        returns a frame or a list of frames
+
+        @param index position of the frame (negative from the end) or a slice
+        @return the frame or a list for slices
+        @raise IndexError the position is out of range
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            if start >= stop:
+                return []
+            return list(self.iterate(start, stop))
+
+        chunkId, offset = self.locate(index)
+        return self.chunks[chunkId][offset]
+
+    def __setitem__(self, index, frame):
+        """
+        replaces a frame
+
+        @param index position of the frame (negative from the end)
+        @param frame the new frame
+        @raise IndexError the position is out of range
+        @raise FrozenSequenceException the sequence is frozen
+        """
+        self.checkMutable()
+        chunkId, offset = self.locate(index)
+        self.ownChunk(chunkId)[offset] = frame
+
+    def __delitem__(self, index):
+        """
+        removes a frame; an emptied chunk is dropped and a short chunk is
+        merged with the next one
+
+        @param index position of the frame (negative from the end)
+        @raise IndexError the position is out of range
+        @raise FrozenSequenceException the sequence is frozen
+        """
+        self.checkMutable()
+        chunkId, offset = self.locate(index)
+        chunk = self.ownChunk(chunkId)
+        del chunk[offset]
+        self.length -= 1
+
+        if len(chunk) == 0:
+            del self.chunks[chunkId]
+            self.owned.discard(id(chunk))
+            self.tree = None
+        elif len(chunk) < self.CHUNK_SIZE // 2 and \
+                chunkId + 1 < len(self.chunks) and \
+                len(chunk) + len(self.chunks[chunkId + 1]) <= self.CHUNK_SIZE:
+            chunk.extend(self.chunks[chunkId + 1])
+            self.owned.discard(id(self.chunks[chunkId + 1]))
+            del self.chunks[chunkId + 1]
+            self.tree = None
+        elif self.tree is not None:
+            self.updateTree(chunkId, -1)
+
+    def __sizeof__(self):
+        """
+        returns the memory of the sequence (chunks, references and index)
+
+        @return the size in bytes
+        """
+        size = object.__sizeof__(self) + self.chunks.__sizeof__() + \
+            self.owned.__sizeof__()
+        if self.tree is not None:
+            size += self.tree.__sizeof__()
+        return size + sum(chunk.__sizeof__() for chunk in self.chunks)
+
+    def __repr__(self):
+        """
+        returns the frames like a list
+
+        @return the representation
+        """
+        return 'FrameSequence({0!r})'.format(list(self))
+
+    def insert(self, index, frame):
+        """
+        inserts a frame like list.insert; positions beyond the end append
+
+        @param index position of the new frame (negative from the end)
+        @param frame the frame
+        @raise FrozenSequenceException the sequence is frozen
+        """
+        self.checkMutable()
+        if index < 0:
+            index = max(0, index + self.length)
+        if len(self.chunks) == 0:
+            chunk = [frame]
+            self.chunks.append(chunk)
+            self.owned.add(id(chunk))
+            self.tree = None
+            self.length = 1
+            return
+
+        if index >= self.length:
+            chunkId = len(self.chunks) - 1
+            offset = len(self.chunks[chunkId])
+        else:
+            chunkId, offset = self.locate(index)
+        chunk = self.ownChunk(chunkId)
+        chunk.insert(offset, frame)
+        self.length += 1
+
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            tail = chunk[self.CHUNK_SIZE:]
+            del chunk[self.CHUNK_SIZE:]
+            self.chunks.insert(chunkId + 1, tail)
+            self.owned.add(id(tail))
+            self.tree = None
+        elif self.tree is not None:
+            self.updateTree(chunkId, 1)
+
+    def append(self, frame):
+        """
+        appends a frame
+
+        @param frame the frame
+        @raise FrozenSequenceException the sequence is frozen
+        """
+        self.insert(self.length, frame)
+
+    def extend(self, frames):
+        """
+        appends several frames
+
+        @param frames iterable of the frames
+        @raise FrozenSequenceException the sequence is frozen
+        """
+        for frame in frames:
+            self.insert(self.length, frame)
+
+    def copy(self):
+        """
+        returns a copy, which shares the chunks until either side changes
+        them
+
+        @return the FrameSequence
+        """
+        other = FrameSequence()
+        other.chunks = list(self.chunks)
+        other.tree = self.tree
+        other.length = self.length
+        # Neither side may change the shared chunks in place any more
+        self.owned = set()
+        if self.tree is not None:
+            self.tree = list(self.tree)
+        return other
+
+    def freeze(self):
+        """
+        returns a read-only copy (see copy)
+
+        @return the frozen FrameSequence
+        """
+        if self.frozen:
+            return self
+        other = self.copy()
+        other.frozen = True
+        return other
+
+    # ==== Chunks ====
+    def checkMutable(self):
+        """
+        Checks whether the sequence may be changed.
+
+        @raise FrozenSequenceException the sequence is frozen
+        """
+        if self.frozen:
+            raise self.__class__.FrozenSequenceException()
+
+    def ownChunk(self, chunkId):
+        """
+        Returns a chunk for a modification; a shared chunk is copied first.
+
+        @param chunkId index of the chunk
+        @return the chunk
+        """
+        chunk = self.chunks[chunkId]
+        if id(chunk) not in self.owned:
+            chunk = list(chunk)
+            self.chunks[chunkId] = chunk
+            self.owned.add(id(chunk))
+        return chunk
+
+    def locate(self, index):
+        """
+        Finds the chunk of a frame.
+
+        @param index position of the frame (negative from the end)
+        @return tuple of the index of the chunk and the offset within it
+        @raise IndexError the position is out of range
+        """
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError('frame index out of range')
+        if len(self.chunks) == 1:
+            return 0, index
+
+        if self.tree is None:
+            self.buildTree()
+        tree = self.tree
+        chunkId = 0
+        step = 1 << (len(self.chunks).bit_length() - 1)
+        while step:
+            nextId = chunkId + step
+            if nextId <= len(self.chunks) and tree[nextId] <= index:
+                chunkId = nextId
+                index -= tree[nextId]
+            step >>= 1
+        return chunkId, index
+
+    def buildTree(self):
+        """
+        Builds the Fenwick tree over the lengths of the chunks.
+        """
+        tree = [0]
+        tree.extend(len(chunk) for chunk in self.chunks)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def updateTree(self, chunkId, delta):
+        """
+        Updates the Fenwick tree for a changed length of a chunk.
+
+        @param chunkId index of the chunk
+        @param delta the change of its length
+        """
+        tree = self.tree
+        i = chunkId + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def iterate(self, start, stop):
+        """
+        Iterates a range of the frames.
+
+        @param start position of the first frame
+        @param stop position after the last frame
+        @return iterator of the frames
+        """
+        chunkId, offset = self.locate(start)
+        frames = chain([islice(self.chunks[chunkId], offset, None)],
+                       islice(self.chunks, chunkId + 1, None))
+        return islice(chain.from_iterable(frames), stop - start)
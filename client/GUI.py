@@ -4,13 +4,27 @@ basic gui
 
 from PyQt5.QtWidgets import QPushButton, QListWidget, QGraphicsView,\
     QListWidgetItem, QGraphicsScene, QFileDialog, QAction, QMenu, QMenuBar,\
-    QLabel, QProgressBar
+    QLabel, QProgressBar, QMessageBox, QSpinBox, QInputDialog
 from PyQt5.uic import loadUi
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
-from os.path import expanduser, dirname, basename
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, Qt
+from os.path import expanduser, dirname, basename, abspath, join
 from model import Clip
-from StarRenderer import StarRenderer
+from StarRenderer import StarRenderer, MatrixRenderer, Stroke
 from Communicator import Communicator
+from EepromImage import EepromImage
+from FlashImage import FlashImage
+from SequenceImport import SequenceImporter
+from Preview import PreviewRenderer
+from Telemetry import TransmissionTelemetry
+from Profiler import Profiler
+from FrameSearch import FrameSearchIndex
+from Journal import Journal
+from MemoryBudget import MemoryBudget
+from DeviceDiscovery import DeviceDiscovery
+from SerialTrace import TraceRecorder
+import os
+import serial
+import threading
 import time
 
 
@@ -19,6 +33,9 @@ class GUI:
     GUI class
     """
 
+    MEMORY_INTERVAL = 2000  # Interval of the memory readout in ms
+    STROKE_REPAINT_INTERVAL = 16  # Repaints of a stroke (a display frame)
+
     def __init__(self, app):
         """
         constructor
@@ -31,6 +48,14 @@ class GUI:
         self.clip = Clip()
         self.clip.addFrame()  # Add initial frame
         self.changed = False  # Indicates whether the file has been changed
+        self.clip.listeners.append(self.clipChanged)
+        # Autosave of the edits; saves and failures come from its thread
+        self.journalEvents = JournalEvents()
+        self.journalEvents.saved.connect(self.journalSaved)
+        self.journalEvents.failed.connect(self.journalFailed)
+        self.pendingSave = None  # Revision, which is being saved
+        self.openJournal()
+        self.app.aboutToQuit.connect(self.quit)
 
         self.ui = loadUi('resources/gui.ui')
         self.__initRightSidebar()
@@ -38,51 +63,107 @@ class GUI:
 
         # Left canvas
         sceneView = self.ui.findChild(QGraphicsView, 'starCanvas')
-        scene = QGraphicsScene(sceneView)
-        sceneView.setScene(scene)
-
-        # Overwrite the mouse press event
+        self.scene = QGraphicsScene(sceneView)
+        sceneView.setScene(self.scene)
+
+        # Overwrite the mouse events: a click toggles a star, dragging paints
+        # or erases the stars under the mouse (in all selected frames)
+        self.stroke = None  # Stroke, which is drawn
+        self.strokeTimer = QTimer()
+        self.strokeTimer.setSingleShot(True)
+        self.strokeTimer.setInterval(self.STROKE_REPAINT_INTERVAL)
+        self.strokeTimer.timeout.connect(self.repaintStroke)
+
+        @Profiler.timed('sceneMousePressEvent')
         def sceneMousePressEvent(event):
             """
-            Catches the mouse press event of the scene.
+            Catches the mouse press event of the scene and starts a stroke.
 
             @param event the event object, that belongs to the mouse press
                 event
             """
-            star = scene.itemAt(event.scenePos(), sceneView.transform())
-
-            if star is not None:
-                self.clip.toggleStar(star.starId)
-                self.starRenderer.update()
-
-        scene.mousePressEvent = sceneMousePressEvent
-
-        starPositions = [(643, 35), (523, 50), (333, 20), (265, 58),
-                         (202, 28), (120, 25),
-                         (634, 92), (468, 80), (411, 49), (269, 80), (108, 78),
-                         (80, 55),
-                         (707, 145), (580, 155), (411, 152), (274, 100),
-                         (130, 87), (22, 97),
-                         (658, 227), (479, 172), (441, 160), (335, 213),
-                         (232, 152), (67, 168),
-                         (718, 262), (520, 202), (468, 250), (332, 258),
-                         (194, 214), (105, 228)]
-        self.starRenderer = StarRenderer(scene, starPositions, self.clip)
+            if event.button() != Qt.LeftButton or self.clip.activeFrame < 0:
+                return
+            starId = self.starRenderer.starAt(event.scenePos(),
+                                              sceneView.transform())
+
+            if starId is not None:
+                self.stroke = Stroke(
+                    self.starRenderer,
+                    self.clip.frames[self.clip.activeFrame].export(), starId,
+                    event.scenePos(), self.selectedFrameRange())
+                self.repaintStroke()
+
+        @Profiler.timed('sceneMouseMoveEvent')
+        def sceneMouseMoveEvent(event):
+            """
+            Adds the stars under the mouse to the stroke; the canvas is
+            repainted at most once per display frame.
+
+            @param event the event object of the mouse move
+            """
+            if self.stroke is not None and \
+                    self.stroke.moveTo(event.scenePos(),
+                                       sceneView.transform()) and \
+                    not self.strokeTimer.isActive():
+                self.strokeTimer.start()
+
+        @Profiler.timed('sceneMouseReleaseEvent')
+        def sceneMouseReleaseEvent(event):
+            """
+            Ends the stroke and applies it to the clip in a single edit.
+
+            @param event the event object of the mouse release
+            """
+            if self.stroke is None or event.button() != Qt.LeftButton:
+                return
+            stroke = self.stroke
+            self.stroke = None
+            self.strokeTimer.stop()
+            self.clip.paintStars(stroke.frameIds[0], stroke.frameIds[1],
+                                 stroke.stars, stroke.state)
+            self.starRenderer.update()
+
+        self.scene.mousePressEvent = sceneMousePressEvent
+        self.scene.mouseMoveEvent = sceneMouseMoveEvent
+        self.scene.mouseReleaseEvent = sceneMouseReleaseEvent
+
+        # Positions of the stars of the Nightsky device
+        self.starPositions = PreviewRenderer.STAR_POSITIONS
+        self.starRenderer = self.createRenderer(self.clip)
         self.ui.show()
 
         self.updateFrameList()
         self.frameList.setCurrentRow(0)
 
+        # Memory readout in the status bar
+        if MemoryBudget.tracing:
+            MemoryBudget.startTracing()
+        self.memoryLabel = QLabel()
+        self.ui.statusBar().addPermanentWidget(self.memoryLabel)
+        self.memoryState = None  # Clip and revision of the readout
+        self.memoryTimer = QTimer()
+        self.memoryTimer.timeout.connect(self.updateMemoryReadout)
+        self.memoryTimer.start(self.MEMORY_INTERVAL)
+        self.updateMemoryReadout()
+
         # Setup animation ability
         self.animationThread = AnimationThread(self)
         self.animationThread.finished.connect(self.animationStopped)
 
         # Upload to arduino
 
+        # Optional recording of the serial communication
+        serialTracePath = os.environ.get('NIGHTSKY_SERIAL_TRACE')
+        if serialTracePath:
+            Communicator.portFactory = TraceRecorder(serialTracePath)
+
         # Device search
+        self.deviceDiscovery = DeviceDiscovery()
+        self.deviceDiscovery.start()
         self.searchDevicesDialog = loadUi('resources/searchDevicesDialog.ui')
         self.searchDevicesDialog.setWindowFlags(Qt.WindowTitleHint)
-        self.searchDevicesThread = SearchDevicesThread()
+        self.searchDevicesThread = SearchDevicesThread(self.deviceDiscovery)
         self.searchDevicesThread.completed.connect(self.searchDevicesDialog.close)
 
         self.notFoundDialog = loadUi('resources/notFoundDialog.ui')  # Dialog if no device is found
@@ -101,10 +182,44 @@ class GUI:
         self.transmissionThread.setProgressLimits.connect(self.setTransmissionProgressLimits)
         self.transmissionThread.aborted.connect(self.disableTransmissionAbortionButton)
         self.transmissionThread.completed.connect(self.disableTransmissionAbortionButton)
+        self.transmissionThread.telemetryReport.connect(self.showTelemetry)
         abortButton = self.transmissionStateDialog.findChild(QPushButton,
                                                              'abortButton')
         abortButton.clicked.connect(self.transmissionThread.abort)
 
+        # Import of image sequences
+        self.importThread = ImportSequenceThread()
+        self.importThread.completed.connect(self.importCompleted)
+
+        # Download from device
+        self.downloadThread = DownloadThread()
+        self.downloadThread.completed.connect(self.downloadCompleted)
+
+        # Live preview on a device
+        self.liveStreamThread = LiveStreamThread()
+        self.liveStreamThread.failed.connect(self.liveStreamFailed)
+
+        # Clip slots of a device
+        self.slotsDialog = loadUi('resources/slotsDialog.ui')
+        self.slotsThread = DeviceSlotsThread()
+        self.slotsThread.completed.connect(self.slotsCompleted)
+        self.slotsDialog.findChild(QPushButton, 'activateButton').clicked \
+            .connect(self.buttonActivateSlot)
+        self.slotsDialog.findChild(QPushButton, 'uploadButton').clicked \
+            .connect(self.buttonUploadToSlot)
+
+        # Search for similar frames
+        self.searchIndex = FrameSearchIndex(self.clip)
+        self.searchHits = []  # Frame ids of the last search
+        self.searchHitId = -1  # Index of the current hit within searchHits
+        self.searchPanel = loadUi('resources/searchPanel.ui')
+        self.searchPanel.findChild(QPushButton, 'findButton').clicked.connect(
+            self.buttonFindSimilar)
+        self.searchPanel.findChild(
+            QPushButton, 'prevHitButton').clicked.connect(self.buttonPrevHit)
+        self.searchPanel.findChild(
+            QPushButton, 'nextHitButton').clicked.connect(self.buttonNextHit)
+
     def __initRightSidebar(self):
         """
         Initiates the widgets of the right sidebar.
@@ -133,6 +248,9 @@ class GUI:
 
         self.frameList = self.ui.findChild(QListWidget, 'frameList')
         self.frameList.currentRowChanged.connect(self.frameListChangeRow)
+
+        self.durationSpinBox = self.ui.findChild(QSpinBox, 'durationSpinBox')
+        self.durationSpinBox.valueChanged.connect(self.durationChanged)
         # Setup drag and drop support
         frameListModel = self.frameList.model()
         frameListModel.rowsMoved.connect(self.frameListMoveFrame)
@@ -153,6 +271,27 @@ class GUI:
         newActionButton = self.ui.findChild(QAction, 'actionNew')
         newActionButton.triggered.connect(self.actionNew)
 
+        newMatrixActionButton = self.ui.findChild(QAction,
+                                                  'actionNew_matrix_clip')
+        newMatrixActionButton.triggered.connect(self.actionNewMatrix)
+
+        importImageActionButton = self.ui.findChild(
+            QAction, 'actionImport_EEPROM_image')
+        importImageActionButton.triggered.connect(self.actionImportImage)
+
+        exportImageActionButton = self.ui.findChild(
+            QAction, 'actionExport_EEPROM_image')
+        exportImageActionButton.triggered.connect(self.actionExportImage)
+
+        exportFlashActionButton = self.ui.findChild(
+            QAction, 'actionExport_firmware_clip')
+        exportFlashActionButton.triggered.connect(self.actionExportFlashImage)
+
+        importSequenceActionButton = self.ui.findChild(
+            QAction, 'actionImport_image_sequence')
+        importSequenceActionButton.triggered.connect(
+            self.actionImportSequence)
+
         toggleAllStarsActionButton = self.ui.findChild(
             QAction, 'actionToggle_all_stars')
         toggleAllStarsActionButton.triggered.connect(self.actionToggleAllStars)
@@ -165,6 +304,10 @@ class GUI:
                                                     'actionAll_stars_off')
         allStarsOffActionButton.triggered.connect(self.actionAllStarsOff)
 
+        findSimilarActionButton = self.ui.findChild(
+            QAction, 'actionFind_similar_frames')
+        findSimilarActionButton.triggered.connect(self.actionFindSimilar)
+
         self.runClipActionButton = self.ui.findChild(QAction, 'actionRun_clip')
         self.runClipActionButton.triggered.connect(self.actionRunClip)
 
@@ -175,7 +318,137 @@ class GUI:
         uploadActionButton = self.ui.findChild(QAction, 'actionUpload')
         uploadActionButton.triggered.connect(self.actionUpload)
 
+        downloadActionButton = self.ui.findChild(QAction, 'actionDownload')
+        downloadActionButton.triggered.connect(self.actionDownload)
+
+        deviceSlotsActionButton = self.ui.findChild(QAction,
+                                                    'actionDevice_slots')
+        deviceSlotsActionButton.triggered.connect(self.actionDeviceSlots)
+
+        self.livePreviewActionButton = self.ui.findChild(
+            QAction, 'actionLive_preview')
+        self.livePreviewActionButton.toggled.connect(self.actionLivePreview)
+
+        profilingActionButton = self.ui.findChild(QAction,
+                                                  'actionProfiling')
+        profilingActionButton.setChecked(Profiler.enabled)
+        profilingActionButton.toggled.connect(self.actionProfiling)
+
+        recordProfileActionButton = self.ui.findChild(QAction,
+                                                      'actionRecord_profile')
+        recordProfileActionButton.toggled.connect(self.actionRecordProfile)
+
     # === File management ===
+    def setClip(self, clip):
+        """
+        Replaces the edited clip.
+
+        @param clip the new clip
+        """
+
+        # Add obligatory frame
+        if clip.size == 0:
+            clip.addFrame()
+            clip.setActiveFrame(0)
+
+        self.journal.close()
+        geometryChanged = (clip.width, clip.height) != \
+            (self.clip.width, self.clip.height)
+        self.clip = clip
+        self.clip.listeners.append(self.clipChanged)
+        self.openJournal()
+        self.pendingSave = None
+        self.setChanged(False)
+
+        if geometryChanged:
+            self.scene.clear()
+            self.starRenderer = self.createRenderer(self.clip)
+        else:
+            self.starRenderer.setClip(self.clip)
+        self.searchIndex = FrameSearchIndex(self.clip)
+        self.searchHits = []
+        self.updateSearchPanel()
+        self.updateFrameList()
+
+    def confirmMemory(self, title, size):
+        """
+        Asks, whether a clip may be opened or generated, which exceeds the
+        memory budget.
+
+        @param title title of the message
+        @param size estimated memory of the clip in bytes
+        @return True if the clip fits or shall be created anyway
+        """
+        if MemoryBudget.fits(size):
+            return True
+
+        answer = QMessageBox.question(
+            self.ui, title,
+            self.ui.tr('The clip needs about {0}, but the memory budget is '
+                       '{1} (NIGHTSKY_MEMORY_BUDGET_MB). Continue anyway?')
+            .format(MemoryBudget.format(size),
+                    MemoryBudget.format(MemoryBudget.getBudget())))
+        return answer == QMessageBox.Yes
+
+    def updateMemoryReadout(self):
+        """
+        Shows the memory of the clip and the editor in the status bar; it's
+        only measured again, when the clip has changed.
+        """
+        state = (id(self.clip), self.clip.revision)
+        if state == self.memoryState and not MemoryBudget.tracing:
+            return
+        self.memoryState = state
+
+        report = MemoryBudget.report(self.clip, MemoryBudget.editorBytes(
+            self.frameList.count(), len(self.scene.items()),
+            self.starRenderer.imageBytes()))
+        used = report['clip'] + report['editor']
+        self.memoryLabel.setText(
+            self.ui.tr('Clip {0} ({1:.0f} B/frame), editor {2} of {3}')
+            .format(MemoryBudget.format(report['clip']), report['frameCost'],
+                    MemoryBudget.format(report['editor']),
+                    MemoryBudget.format(report['budget'])))
+        self.memoryLabel.setStyleSheet(
+            '' if MemoryBudget.fits(used) else 'color: red')
+
+        # Allocations per module, if tracemalloc runs
+        self.memoryLabel.setToolTip('\n'.join(
+            '{0}: {1}'.format(name, MemoryBudget.format(size))
+            for name, size in sorted(report.get('traced', {}).items(),
+                                     key=lambda item: -item[1])))
+
+    def createRenderer(self, clip):
+        """
+        Creates the renderer for the geometry of a clip: the stars of the
+        Nightsky device are drawn at their positions, other matrices as
+        image.
+
+        @param clip the clip
+        @return the renderer
+        """
+        if clip.fitsDevice():
+            return StarRenderer(self.scene, self.starPositions, clip)
+        return MatrixRenderer(self.scene, clip)
+
+    def checkDeviceGeometry(self, title):
+        """
+        Warns, if the clip can't be played by the Nightsky device.
+
+        @param title title of the warning
+        @return True if the clip fits the device
+        """
+        if self.clip.fitsDevice():
+            return True
+
+        QMessageBox.warning(
+            self.ui, title,
+            self.ui.tr('The device has {0:d}x{1:d} stars, but the clip '
+                       '{2:d}x{3:d}.').format(Clip.WIDTH, Clip.HEIGHT,
+                                              self.clip.width,
+                                              self.clip.height))
+        return False
+
     def actionOpenNsc(self, event):
         """
         Opens a nightsky clip file.
@@ -193,12 +466,21 @@ class GUI:
 
         # Load file
         try:
-            self.clip = Clip(filePath)
-            self.starRenderer.setClip(self.clip)
-            self.updateFrameList()
+            if not self.confirmMemory(self.ui.tr('Open Nightsky Clip'),
+                                      MemoryBudget.estimateFile(filePath)):
+                return
+            clip = Clip(filePath)
         except FileNotFoundError:
             # Skip because of abort
-            pass
+            return
+
+        # Recover the edits, which weren't saved because of a crash
+        replayed = Journal.recover(clip)
+        self.setClip(clip)
+        if replayed != 0:
+            self.journal.compact()
+            self.ui.statusBar().showMessage(
+                self.ui.tr('Recovered {0:d} unsaved edits').format(replayed))
 
     def actionSaveAsNsc(self, event):
         """
@@ -221,7 +503,16 @@ class GUI:
             if fileName.split('.')[-1] != 'nsc':
                 filePath += '.nsc'
 
+            oldFilePath = self.clip.filePath
+            self.journal.close()
             self.clip.save(filePath)
+            Journal.discard(filePath)
+            # The edits in the journal of the old file are saved in the new
+            # one; they mustn't be recovered into the old file
+            if oldFilePath is not None:
+                Journal.discard(oldFilePath)
+            self.openJournal()
+            self.setChanged(False)
 
     def actionSaveNsc(self, event):
         """
@@ -230,47 +521,299 @@ class GUI:
         @param event QEvent object of the event
         """
 
-        try:
-            self.clip.save()
-        except Clip.NoFilePathException:
+        if self.clip.filePath is None:
             self.actionSaveAsNsc(event)
+            return
+
+        # The edits are already journaled, the full save runs in background;
+        # the clip is marked as saved, when it succeeded (see journalSaved)
+        self.pendingSave = self.clip.revision
+        self.journal.compact()
+
+    def openJournal(self):
+        """
+        Starts the journal of the current clip.
+        """
+        self.journal = Journal(self.clip)
+        self.journal.addListener(self.journalEvents.report)
+
+    def journalSaved(self, revision):
+        """
+        Marks the clip as saved after the background save of actionSaveNsc.
+
+        @param revision revision of the saved clip
+        """
+        if self.pendingSave is None or revision < self.pendingSave:
+            return
+        self.pendingSave = None
+        if revision == self.clip.revision:
+            self.setChanged(False)
+
+    def journalFailed(self, message):
+        """
+        Reports a failed write of the journal or a failed save.
+
+        @param message the error message
+        """
+        self.pendingSave = None
+        self.setChanged(True)
+        QMessageBox.warning(self.ui, self.ui.tr('Save Nightsky Clip'),
+                            self.ui.tr('The clip could not be saved: {0}')
+                            .format(message))
+
+    def clipChanged(self, edit):
+        """
+        Marks the clip as changed (listener of the clip).
+
+        @param edit the edit as tuple
+        """
+        if not self.changed:
+            self.setChanged(True)
+        self.updateLivePreview()
+
+    def setChanged(self, changed):
+        """
+        Sets whether the clip has unsaved changes and shows it in the title.
+
+        @param changed True if there are unsaved changes
+        """
+        self.changed = changed
+        title = 'Nightsky'
+        if self.clip.filePath is not None:
+            title = basename(self.clip.filePath) + ' - ' + title
+        if changed:
+            title = '*' + title
+        self.ui.setWindowTitle(title)
+
+    def quit(self):
+        """
+        Writes the pending edits of the journal, ends the live preview and
+        waits for a running import before the application quits.
+        """
+        self.journal.close()
+        self.deviceDiscovery.stop()
+        self.importThread.wait()
+        if self.liveStreamThread.isRunning():
+            self.liveStreamThread.stop()
+            self.liveStreamThread.wait()
 
     def actionNew(self, event):
         """
         Creates a new clip.
         """
-        self.clip = Clip()
-        self.clip.addFrame()
-        self.starRenderer.setClip(self.clip)
-        self.updateFrameList()
+        self.setClip(Clip())
+
+    def actionNewMatrix(self, event):
+        """
+        Creates a new clip for a matrix of any size.
+        """
+        title = self.ui.tr('New matrix clip')
+        width, ok = QInputDialog.getInt(self.ui, title,
+                                        self.ui.tr('Stars per line:'),
+                                        Clip.WIDTH, 1, 256)
+        if not ok:
+            return
+        height, ok = QInputDialog.getInt(self.ui, title,
+                                         self.ui.tr('Lines:'),
+                                         Clip.HEIGHT, 1, 256)
+        if not ok:
+            return
+
+        self.setClip(Clip(width=width, height=height))
+
+    def actionImportImage(self, event):
+        """
+        Imports a clip from an EEPROM image.
+
+        @param event QEvent object of the event
+        """
+
+        startDir = expanduser('~')
+        if self.clip.filePath:
+            startDir = dirname(self.clip.filePath)
+
+        filePath = QFileDialog.getOpenFileName(
+            self.ui, self.ui.tr('Import EEPROM image'), startDir,
+            self.ui.tr('EEPROM images (*.bin *.hex *.eep)'))[0]
+
+        if filePath == '':
+            return
+
+        try:
+            clip = EepromImage.load(filePath).toClip()
+        except EepromImage.InvalidImageException as e:
+            QMessageBox.warning(self.ui, self.ui.tr('Import EEPROM image'),
+                                str(e.args[-1]))
+            return
+
+        self.setClip(clip)
+
+    def actionExportImage(self, event):
+        """
+        Exports the clip as EEPROM image for flashing with e.g. avrdude.
+
+        @param event QEvent object of the event
+        """
+
+        startFilePath = expanduser('~')
+        if self.clip.filePath:
+            startFilePath = self.clip.filePath.rsplit('.', 1)[0] + '.hex'
+
+        filePath = QFileDialog.getSaveFileName(
+            self.ui, self.ui.tr('Export EEPROM image'), startFilePath,
+            self.ui.tr('EEPROM images (*.bin *.hex *.eep)'))[0]
+
+        fileName = basename(filePath)
+        if fileName == '':
+            return
+
+        if not self.checkDeviceGeometry(self.ui.tr('Export EEPROM image')):
+            return
+
+        # Check if suffix is given and add it if necessary
+        if fileName.split('.')[-1] not in ('bin', 'hex', 'eep'):
+            filePath += '.hex'
+
+        try:
+            EepromImage.fromClip(self.clip).save(filePath)
+        except EepromImage.CompressedClipTooLong as e:
+            QMessageBox.warning(self.ui, self.ui.tr('Export EEPROM image'),
+                                str(e.args[-1]))
+
+    def actionExportFlashImage(self, event):
+        """
+        Exports the clip as C header, which is compiled into the firmware.
+
+        @param event QEvent object of the event
+        """
+
+        startFilePath = join(dirname(dirname(abspath(__file__))), 'arduino',
+                             FlashImage.HEADER_NAME)
+
+        filePath = QFileDialog.getSaveFileName(
+            self.ui, self.ui.tr('Export firmware clip'), startFilePath,
+            self.ui.tr('C headers (*.h)'))[0]
+
+        if basename(filePath) == '':
+            return
+
+        if not self.checkDeviceGeometry(self.ui.tr('Export firmware clip')):
+            return
+
+        try:
+            FlashImage.fromClip(self.clip).save(filePath)
+        except FlashImage.CompressedClipTooLong as e:
+            QMessageBox.warning(self.ui, self.ui.tr('Export firmware clip'),
+                                str(e.args[-1]))
+
+    def actionImportSequence(self, event):
+        """
+        Creates a clip from an image sequence (a frame per image).
+
+        @param event QEvent object of the event
+        """
+        if self.importThread.isRunning():
+            return
+
+        startDir = expanduser('~')
+        if self.clip.filePath:
+            startDir = dirname(self.clip.filePath)
+
+        filePaths = QFileDialog.getOpenFileNames(
+            self.ui, self.ui.tr('Import image sequence'), startDir,
+            self.ui.tr('Image sequences (*.pgm *.ppm *.pnm *.npy)'))[0]
+
+        if len(filePaths) == 0:
+            return
+
+        # The stars of the device are sampled where they are on the canvas
+        positions = None
+        if self.clip.fitsDevice():
+            xs = [x for x, y in self.starPositions]
+            ys = [y for x, y in self.starPositions]
+            positions = [((x - min(xs)) / (max(xs) - min(xs)),
+                          (y - min(ys)) / (max(ys) - min(ys)))
+                         for x, y in self.starPositions]
+
+        importer = SequenceImporter(self.clip.width, self.clip.height,
+                                    positions, dither=True)
+        try:
+            if not self.confirmMemory(
+                    self.ui.tr('Import image sequence'),
+                    MemoryBudget.estimateClip(
+                        importer.countImages(filePaths),
+                        self.clip.starCount)):
+                return
+        except (SequenceImporter.UnsupportedFormatException, OSError) as e:
+            QMessageBox.warning(self.ui, self.ui.tr('Import image sequence'),
+                                str(e.args[-1]))
+            return
+
+        # The images are decoded in the background
+        self.importThread.importer = importer
+        self.importThread.filePaths = sorted(filePaths)
+        self.importThread.start()
+        self.ui.statusBar().showMessage(
+            self.ui.tr('Importing {0:d} files...').format(len(filePaths)))
+
+    def importCompleted(self):
+        """
+        Opens the clip of the imported image sequence.
+        """
+        self.ui.statusBar().clearMessage()
+        if self.importThread.clip is None:
+            QMessageBox.warning(self.ui, self.ui.tr('Import image sequence'),
+                                self.importThread.error)
+            return
+
+        self.setClip(self.importThread.clip)
+
+    def repaintStroke(self):
+        """
+        Shows the active frame with the stroke, which is drawn.
+        """
+        if self.stroke is not None:
+            self.starRenderer.show(self.stroke.preview())
+
+    def selectedFrameRange(self):
+        """
+        Returns the frames, which get a stroke: the selected frames or the
+        active frame.
+
+        @return tuple of the first and the last frame id
+        """
+        rows = [index.row() for index in self.frameList.selectedIndexes()]
+        if len(rows) < 2:
+            return self.clip.activeFrame, self.clip.activeFrame
+        return min(rows), max(rows)
 
     def actionToggleAllStars(self, event):
         """
         Toggles all stars.
         """
-        for i in range(30):
-            self.clip.toggleStar(i)
+        allStars = (1 << self.clip.starCount) - 1
+        self.clip.setActiveSetup(
+            self.clip.frames[self.clip.activeFrame].export() ^ allStars)
         self.starRenderer.update()
 
     def actionAllStarsOn(self, event):
         """
-        Toggles all stars.
+        Turns all stars on.
         """
-        for i in range(30):
-            self.clip.setStarState(i, True)
+        self.clip.setActiveSetup((1 << self.clip.starCount) - 1)
         self.starRenderer.update()
 
     def actionAllStarsOff(self, event):
         """
-        Toggles all stars.
+        Turns all stars off.
         """
-        for i in range(30):
-            self.clip.setStarState(i, False)
+        self.clip.setActiveSetup(0)
         self.starRenderer.update()
 
     # ========
 
     # === Frame management ===
+    @Profiler.timed('updateFrameList')
     def updateFrameList(self):
         """
         Updates the frame list.
@@ -278,12 +821,24 @@ class GUI:
 
         self.frameList.clear()
         for i in range(len(self.clip.frames)):
-            item = QListWidgetItem('Frame {0:d}'.format(i))
+            item = QListWidgetItem(self.frameListText(i))
             self.frameList.addItem(item)
 
         self.frameList.setCurrentRow(self.clip.activeFrame)
         self.starRenderer.update()
 
+    def frameListText(self, frameId):
+        """
+        Returns the text of a frame within the frame list.
+
+        @param frameId id of the frame
+        @return the text
+        """
+        duration = self.clip.frames[frameId].duration
+        return 'Frame {0:d} ({1:.1f} s)'.format(
+            frameId, duration * AnimationThread.TIME_STEP_DURATION / 1000)
+
+    @Profiler.timed('frameListChangeRow')
     def frameListChangeRow(self, row):
         """
         Event handler for changing active row.
@@ -294,18 +849,47 @@ class GUI:
         try:
             self.clip.setActiveFrame(row)
             self.starRenderer.update()
+            self.updateLivePreview()
+            self.durationSpinBox.blockSignals(True)
+            self.durationSpinBox.setValue(self.clip.getDuration())
+            self.durationSpinBox.blockSignals(False)
         except Clip.FrameIdOutOfBoundException:
             # On updateFrameList row is -1
             pass
 
-    def frameListMoveFrame(self, event):
+    def durationChanged(self, duration):
+        """
+        Event handler for changing the duration of the active frame.
+
+        @param duration the new duration in animation steps
         """
-        Moves a frame by a drag and drop event.
+        if self.clip.activeFrame < 0:
+            return
+
+        self.clip.setDuration(duration)
+        item = self.frameList.item(self.clip.activeFrame)
+        if item is not None:
+            item.setText(self.frameListText(self.clip.activeFrame))
+
+    @Profiler.timed('frameListMoveFrame')
+    def frameListMoveFrame(self, parent, start, end, destination, row):
         """
+        Moves the frames by a drag and drop event (several frames, if a
+        range is selected).
 
-        # Well, thats pretty ugly, but the easiest way for my intentions
-        newPos = self.frameList.currentRow()
-        self.clip.moveFrame(newPos)
+        @param parent the parent of the moved rows (unused)
+        @param start first moved row
+        @param end last moved row
+        @param destination the new parent (unused)
+        @param row the row, before which the rows are inserted
+        """
+        for i in range(end - start + 1):
+            if row > start:
+                self.clip.applyEdit(('move', start, row - 1))
+            else:
+                self.clip.applyEdit(('move', start + i, row + i))
+        if 0 <= self.frameList.currentRow() < self.clip.size:
+            self.clip.setActiveFrame(self.frameList.currentRow())
         self.updateFrameList()
 
     def buttonAddFrame(self, event):
@@ -383,6 +967,79 @@ class GUI:
 
     # ========
 
+    # === Search ===
+    def actionFindSimilar(self, event):
+        """
+        Shows the panel to search for similar frames.
+        """
+        self.updateSearchPanel()
+        self.searchPanel.show()
+        self.searchPanel.raise_()
+
+    def buttonFindSimilar(self, event):
+        """
+        Searches for frames, which look like the currently active frame.
+        """
+        maxDistance = self.searchPanel.findChild(
+            QSpinBox, 'distanceSpinBox').value()
+        setup = self.clip.frames[self.clip.activeFrame].export()
+
+        self.searchHits = self.searchIndex.findSimilar(setup, maxDistance)
+        self.searchHitId = self.searchHits.index(self.clip.activeFrame)
+        self.updateSearchPanel()
+
+    def buttonNextHit(self, event):
+        """
+        Jumps to the next hit of the last search.
+        """
+        self.jumpToHit(self.searchHitId + 1)
+
+    def buttonPrevHit(self, event):
+        """
+        Jumps to the previous hit of the last search.
+        """
+        self.jumpToHit(self.searchHitId - 1)
+
+    def jumpToHit(self, hitId):
+        """
+        Makes a hit of the last search the active frame.
+        The hits wrap around at the beginning and the end.
+
+        @param hitId index of the hit
+        """
+        if len(self.searchHits) == 0:
+            return
+
+        self.searchHitId = hitId % len(self.searchHits)
+        frameId = self.searchHits[self.searchHitId]
+        if frameId < self.clip.size:
+            self.clip.setActiveFrame(frameId)
+            self.updateFrameList()
+        self.updateSearchPanel()
+
+    def updateSearchPanel(self):
+        """
+        Updates the labels of the search panel.
+        """
+        hitLabel = self.searchPanel.findChild(QLabel, 'hitLabel')
+        if len(self.searchHits) == 0:
+            hitLabel.setText(self.ui.tr('No search'))
+        else:
+            hitLabel.setText(self.ui.tr('Frame {0:d} (hit {1:d} of {2:d})')
+                             .format(self.searchHits[self.searchHitId],
+                                     self.searchHitId + 1,
+                                     len(self.searchHits)))
+
+        maxDistance = self.searchPanel.findChild(
+            QSpinBox, 'distanceSpinBox').value()
+        if self.searchPanel.isVisible() and maxDistance > 0:
+            candidates = self.searchIndex.mergeCandidates(maxDistance)
+            self.searchPanel.findChild(QLabel, 'nearDuplicatesLabel').setText(
+                self.ui.tr('{0:d} frames are near duplicates of their '
+                           'successor.').format(len(candidates)))
+
+    # ========
+
     # === Animation ===
     def actionRunClip(self):
         """
@@ -416,33 +1073,230 @@ class GUI:
 
     # ========
 
+    # === Live preview ===
+    def actionLivePreview(self, checked):
+        """
+        Starts or stops streaming the shown frame to a device.
+
+        @param checked True if the live preview should be started
+        """
+        if not checked:
+            self.liveStreamThread.stop()
+            self.liveStreamThread.wait()
+            return
+
+        port = None
+        if self.checkDeviceGeometry(self.ui.tr('Live preview')):
+            port = self.choosePort()
+        if port is None:
+            self.livePreviewActionButton.blockSignals(True)
+            self.livePreviewActionButton.setChecked(False)
+            self.livePreviewActionButton.blockSignals(False)
+            return
+
+        self.liveStreamThread.port = port
+        self.liveStreamThread.reset()
+        self.liveStreamThread.start()
+        self.updateLivePreview()
+
+    def updateLivePreview(self):
+        """
+        Streams the active frame, if the live preview is running.
+        """
+        if not self.liveStreamThread.isRunning() or \
+                not self.clip.fitsDevice():
+            return
+
+        if 0 <= self.clip.activeFrame < self.clip.size:
+            self.liveStreamThread.show(
+                self.clip.frames[self.clip.activeFrame].export())
+
+    def liveStreamFailed(self, error):
+        """
+        Stops the live preview after a communication problem.
+
+        @param error description of the problem
+        """
+        self.livePreviewActionButton.blockSignals(True)
+        self.livePreviewActionButton.setChecked(False)
+        self.livePreviewActionButton.blockSignals(False)
+        QMessageBox.warning(self.ui, self.ui.tr('Live preview'), error)
+
+    # ========
+
+    # === Profiling ===
+    def actionProfiling(self, checked):
+        """
+        Enables or disables the instrumentation of the event handlers.
+
+        @param checked True if the profiling should be enabled
+        """
+        Profiler.enabled = checked
+        if checked:
+            Profiler.reset()
+
+    def actionRecordProfile(self, checked):
+        """
+        Starts a recording or stops it and saves the report.
+
+        @param checked True if the recording should be started
+        """
+        if checked:
+            Profiler.enabled = True
+            self.ui.findChild(QAction, 'actionProfiling').setChecked(True)
+            Profiler.startRecording()
+            return
+
+        filePath = QFileDialog.getSaveFileName(
+            self.ui, self.ui.tr('Save profile report'),
+            expanduser('~/nightsky-profile.txt'),
+            self.ui.tr('Text files (*.txt)'))[0]
+        Profiler.stopRecording(filePath if filePath != '' else None)
+
+    # ========
+
     # === Upload ===
-    def actionUpload(self):
+    def choosePort(self):
         """
-        Executes the upload.
+        Lets the user choose one of the connected devices. The devices are
+        only searched, if none is known yet.
+
+        @return the chosen port or None, if no port was chosen
         """
-        self.searchDevicesThread.start()
-        self.searchDevicesDialog.exec()
-        ports = self.searchDevicesThread.getPorts()
+        ports = self.deviceDiscovery.ports()
+        if len(ports) == 0:
+            self.searchDevicesThread.start()
+            self.searchDevicesDialog.exec()
+            ports = self.searchDevicesThread.getPorts()
 
         if len(ports) == 0:
             # No Device found
             self.notFoundDialog.exec()
-        else:
-            portsList = self.choosePortDialog.findChild(QListWidget,
-                                                        'portsList')
-            portsList.clear()
-            for port in ports:
-                item = QListWidgetItem(port)
-                portsList.addItem(item)
-                portsList.setCurrentRow(0)
-
-            if self.choosePortDialog.exec() == 1:
-                # ok-button pressed
-                self.transmissionThread.port = portsList.currentItem().text()
-                self.transmissionThread.clip = self.clip
-                self.transmissionStateDialog.show()
-                self.transmissionThread.start()
+            return None
+
+        portsList = self.choosePortDialog.findChild(QListWidget, 'portsList')
+        portsList.clear()
+        for port in ports:
+            item = QListWidgetItem(port)
+            portsList.addItem(item)
+            portsList.setCurrentRow(0)
+
+        if self.choosePortDialog.exec() != 1:
+            return None
+
+        # ok-button pressed
+        return portsList.currentItem().text()
+
+    def actionUpload(self):
+        """
+        Executes the upload.
+        """
+        if not self.checkDeviceGeometry(self.ui.tr('Upload')):
+            return
+
+        port = self.choosePort()
+        if port is not None:
+            self.transmissionThread.port = port
+            self.transmissionThread.clip = self.clip.snapshot()
+            self.transmissionThread.slot = None
+            self.transmissionStateDialog.show()
+            self.transmissionThread.start()
+
+    def actionDownload(self):
+        """
+        Downloads the clip stored on a device.
+        """
+        port = self.choosePort()
+        if port is not None:
+            self.downloadThread.port = port
+            self.downloadThread.start()
+
+    def downloadCompleted(self):
+        """
+        Opens the downloaded clip.
+        """
+        if self.downloadThread.clip is None:
+            QMessageBox.warning(self.ui, self.ui.tr('Download'),
+                                self.downloadThread.error)
+            return
+
+        self.setClip(self.downloadThread.clip)
+
+    def actionDeviceSlots(self):
+        """
+        Shows the clip slots of a device.
+        """
+        port = self.choosePort()
+        if port is None:
+            return
+
+        self.slotsThread.port = port
+        self.requestSlots(None)
+        self.slotsDialog.show()
+
+    def requestSlots(self, switchTo):
+        """
+        Reads the slots of the device in the background.
+
+        @param switchTo id of the slot, which is activated before, or None
+        """
+        self.slotsDialog.findChild(QLabel, 'stateLabel').setText(
+            self.ui.tr('Read slots...'))
+        self.slotsDialog.findChild(QPushButton, 'activateButton') \
+            .setEnabled(False)
+        self.slotsDialog.findChild(QPushButton, 'uploadButton') \
+            .setEnabled(False)
+        self.slotsThread.switchTo = switchTo
+        self.slotsThread.start()
+
+    def slotsCompleted(self):
+        """
+        Shows the read slots.
+        """
+        stateLabel = self.slotsDialog.findChild(QLabel, 'stateLabel')
+        if self.slotsThread.slots is None:
+            stateLabel.setText(self.slotsThread.error)
+            return
+
+        activeSlot, counts, free = self.slotsThread.slots
+        slotsList = self.slotsDialog.findChild(QListWidget, 'slotsList')
+        row = max(0, slotsList.currentRow())
+        slotsList.clear()
+        for slot, count in enumerate(counts):
+            slotsList.addItem(QListWidgetItem(
+                'Slot {0:d}{1}: {2:d} records'.format(
+                    slot, ' (active)' if slot == activeSlot else '', count)))
+        slotsList.setCurrentRow(min(row, len(counts) - 1))
+
+        stateLabel.setText('{0:d} records free'.format(free))
+        self.slotsDialog.findChild(QPushButton, 'activateButton') \
+            .setEnabled(True)
+        self.slotsDialog.findChild(QPushButton, 'uploadButton') \
+            .setEnabled(True)
+
+    def buttonActivateSlot(self, event):
+        """
+        Lets the device play the selected slot.
+        """
+        slotsList = self.slotsDialog.findChild(QListWidget, 'slotsList')
+        if slotsList.currentRow() >= 0:
+            self.requestSlots(slotsList.currentRow())
+
+    def buttonUploadToSlot(self, event):
+        """
+        Uploads the clip into the selected slot.
+        """
+        slotsList = self.slotsDialog.findChild(QListWidget, 'slotsList')
+        if slotsList.currentRow() < 0 or \
+                not self.checkDeviceGeometry(self.ui.tr('Upload')):
+            return
+
+        self.slotsDialog.close()
+        self.transmissionThread.port = self.slotsThread.port
+        self.transmissionThread.clip = self.clip.snapshot()
+        self.transmissionThread.slot = slotsList.currentRow()
+        self.transmissionStateDialog.show()
+        self.transmissionThread.start()
 
     def startTransmission(self):
         """
@@ -451,8 +1305,9 @@ class GUI:
         bar = self.transmissionStateDialog.findChild(QProgressBar, 'progressBar')
         bar.setValue(0)
         bar.setMinimum(0)
-        # Set temporary max size (+ 3 because of compression, start and end)
-        bar.setMaximum(self.clip.size + 3)
+        # Set temporary max size (+ 4 because of compression, start, end and
+        # verification)
+        bar.setMaximum(self.clip.size + 4)
         abortButton = self.transmissionStateDialog.findChild(QPushButton, 'abortButton')
         abortButton.setEnabled(True)
 
@@ -467,6 +1322,25 @@ class GUI:
         bar.setMinimum(min)
         bar.setMaximum(max)
 
+    def showTelemetry(self, report):
+        """
+        Summarizes the telemetry of a transmission in the status bar.
+
+        @param report the report (see TransmissionTelemetry.report)
+        """
+        text = self.ui.tr('Upload: {0:d} frames').format(report['frames'])
+        if report['bytesPerSecond'] is not None:
+            text += self.ui.tr(', {0:.0f} B/s').format(
+                report['bytesPerSecond'])
+        if report['rtt']['p90'] is not None:
+            text += self.ui.tr(', round trip p90 {0:.0f} ms').format(
+                report['rtt']['p90'] * 1000)
+        errors = sum(report['errors'].values())
+        if errors != 0:
+            text += self.ui.tr(', {0:d} errors ({1})').format(
+                errors, ', '.join(sorted(report['errors'])))
+        self.ui.statusBar().showMessage(text)
+
     def setTransmissionStateText(self, msg):
         """
         Sets the text of the transmission state dialog
@@ -491,6 +1365,27 @@ class GUI:
         abortButton.setEnabled(False)
 
 
+class JournalEvents(QObject):
+    """
+    Passes the events of the journal's background thread to the GUI thread.
+    """
+
+    saved = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def report(self, event, data):
+        """
+        Listener of the journal (see Journal.addListener).
+
+        @param event 'saved' or 'failed'
+        @param data the revision of the saved clip or the error message
+        """
+        if event == 'saved':
+            self.saved.emit(data)
+        else:
+            self.failed.emit(data)
+
+
 class AnimationThread(QThread):
     """
     Thread class to run the animation
@@ -498,6 +1393,9 @@ class AnimationThread(QThread):
 
     TIME_STEP_DURATION = 100  # Duration of a time step in ms
 
+    # Shows a frame within the gui thread
+    showFrame = pyqtSignal(int)
+
     def __init__(self, gui):
         """
         constructor
@@ -507,21 +1405,30 @@ class AnimationThread(QThread):
         super().__init__()
         self.stopped = False
         self.gui = gui
+        self.clip = None
+        self.showFrame.connect(gui.frameList.setCurrentRow)
+
+    def start(self):
+        """
+        Starts the thread with a snapshot of the current clip.
+        """
+        self.clip = self.gui.clip.snapshot()
+        super().start()
 
     def run(self):
         """
         Runs the thread.
         """
 
-        clip = self.gui.clip
-        while not self.stopped:
+        clip = self.clip
+        while not self.stopped and clip.size != 0:
             if clip.activeFrame == clip.size - 1:
                 clip.setActiveFrame(0)
             else:
                 clip.nextFrame()
-            self.gui.frameList.setCurrentRow(self.gui.clip.activeFrame)
-            self.gui.starRenderer.update()
-            self.msleep(self.__class__.TIME_STEP_DURATION)
+            self.showFrame.emit(clip.activeFrame)
+            self.msleep(self.__class__.TIME_STEP_DURATION *
+                        clip.frames[clip.activeFrame].duration)
 
         self.stopped = False  # Set not stopped to enabled restart
 
@@ -540,18 +1447,22 @@ class SearchDevicesThread(QThread):
 
     completed = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, deviceDiscovery):
         """
         constructor
+
+        @param deviceDiscovery the DeviceDiscovery, which watches the ports
         """
         super().__init__()
+        self.deviceDiscovery = deviceDiscovery
         self.ports = None
 
     def run(self):
         """
         Run method
         """
-        self.ports = Communicator.getPorts()
+        self.deviceDiscovery.waitForScan()
+        self.ports = self.deviceDiscovery.rescan()
         self.completed.emit()
 
     def getPorts(self):
@@ -561,6 +1472,176 @@ class SearchDevicesThread(QThread):
         return self.ports
 
 
+class DownloadThread(QThread):
+    """
+    Thread to download the clip stored on a device
+    """
+
+    completed = pyqtSignal()
+
+    def __init__(self):
+        """
+        constructor
+        """
+        super().__init__()
+        self.port = None
+        self.clip = None
+        self.error = None
+
+    def run(self):
+        """
+        Run method
+        """
+        self.clip = None
+        self.error = None
+        try:
+            self.clip = Communicator.downloadClip(self.port)
+        except (Communicator.CommunicationFaultException,
+                Communicator.ChecksumMismatchException, OSError,
+                serial.SerialException) as e:
+            self.error = str(e.args[-1])
+        self.completed.emit()
+
+
+class ImportSequenceThread(QThread):
+    """
+    Thread to create a clip from an image sequence
+    """
+
+    completed = pyqtSignal()
+
+    def __init__(self):
+        """
+        constructor
+        """
+        super().__init__()
+        self.importer = None
+        self.filePaths = None
+        self.clip = None
+        self.error = None
+
+    def run(self):
+        """
+        Run method
+        """
+        self.clip = None
+        self.error = None
+        try:
+            self.clip = self.importer.toClip(self.filePaths)
+        except (SequenceImporter.UnsupportedFormatException, OSError) as e:
+            self.error = str(e.args[-1])
+        self.completed.emit()
+
+
+class LiveStreamThread(QThread):
+    """
+    Thread, which streams the shown frame to a device in live mode.
+    Only the newest setup is sent, so bursts of edits and animation frames
+    are coalesced to the rate of the serial link.
+    """
+
+    failed = pyqtSignal(str)
+
+    def __init__(self):
+        """
+        constructor
+        """
+        super().__init__()
+        self.port = None
+        self.condition = threading.Condition()
+        self.pendingSetup = None  # Newest setup, which should be shown
+        self.stopped = False
+
+    def reset(self):
+        """
+        Prepares a new stream (before start).
+        """
+        self.pendingSetup = None
+        self.stopped = False
+
+    def show(self, setup):
+        """
+        Queues a setup; a setup, which wasn't sent yet, is replaced.
+
+        @param setup the setup as integer (see Frame.export)
+        """
+        with self.condition:
+            self.pendingSetup = setup
+            self.condition.notify()
+
+    def stop(self):
+        """
+        Stops the stream; the device continues playing its clip.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self):
+        """
+        Run method
+        """
+        try:
+            serialPort = Communicator.startLive(self.port)
+        except (Communicator.CommunicationFaultException, OSError) as e:
+            self.failed.emit(str(e.args[-1]))
+            return
+
+        # Time to transfer a frame (a byte takes 10 bit with start and stop)
+        interval = Communicator.LIVE_FRAME_SIZE * 10 / Communicator.BAUD_RATE
+        sentSetup = None
+        try:
+            while True:
+                with self.condition:
+                    while not self.stopped and \
+                            self.pendingSetup in (None, sentSetup):
+                        self.condition.wait()
+                    if self.stopped:
+                        break
+                    setup = self.pendingSetup
+
+                Communicator.sendLive(serialPort, setup)
+                sentSetup = setup
+                time.sleep(interval)  # Newer setups are coalesced meanwhile
+            Communicator.endLive(serialPort)
+        except OSError as e:
+            serialPort.close()
+            self.failed.emit(str(e.args[-1]))
+
+
+class DeviceSlotsThread(QThread):
+    """
+    Thread to read (and switch) the clip slots of a device
+    """
+
+    completed = pyqtSignal()
+
+    def __init__(self):
+        """
+        constructor
+        """
+        super().__init__()
+        self.port = None
+        self.switchTo = None  # Slot, which is activated before reading
+        self.slots = None
+        self.error = None
+
+    def run(self):
+        """
+        Run method
+        """
+        self.slots = None
+        self.error = None
+        try:
+            if self.switchTo is not None:
+                Communicator.switchSlot(self.port, self.switchTo)
+            self.slots = Communicator.listSlots(self.port)
+        except (Communicator.CommunicationFaultException, OSError,
+                serial.SerialException) as e:
+            self.error = str(e.args[-1])
+        self.completed.emit()
+
+
 class TransmissionThread(QThread):
     """
     Thread class to run the transmission
@@ -573,6 +1654,8 @@ class TransmissionThread(QThread):
     addProgress = pyqtSignal()
     aborted = pyqtSignal()
     completed = pyqtSignal()
+    # Telemetry report of a transmission
+    telemetryReport = pyqtSignal(dict)
 
     def __init__(self):
         """
@@ -581,12 +1664,30 @@ class TransmissionThread(QThread):
         super().__init__()
         self.clip = None
         self.port = None
+        self.slot = None  # Slot on the device; None for the active one
         self.abortionState = False
+        # Optional file, where every report is appended as JSON line
+        self.telemetryLogPath = os.environ.get('NIGHTSKY_TELEMETRY_LOG')
 
     def run(self):
         """
         Runs the thread.
         """
+        telemetry = TransmissionTelemetry(self.port)
+        Communicator.telemetry = telemetry
+
+        try:
+            self.transmit()
+        finally:
+            Communicator.telemetry = None
+            self.telemetryReport.emit(telemetry.report())
+            if self.telemetryLogPath:
+                telemetry.writeJsonLine(self.telemetryLogPath)
+
+    def transmit(self):
+        """
+        Transmits the clip.
+        """
         self.abortionState = False
         self.startTransmissionProcess.emit()
 
@@ -595,9 +1696,10 @@ class TransmissionThread(QThread):
 
         # Clip compression
         self.setText.emit('Compress frames...')
-        compressedFrames = self.clip.export()
+        with Communicator.measure('compression'):
+            compressedFrames = self.clip.export()
         clipLength = len(compressedFrames)
-        self.setProgressLimits.emit(0, clipLength + 3)
+        self.setProgressLimits.emit(0, clipLength + 4)
         self.addProgress.emit()
 
         if self.abortionState:
@@ -605,7 +1707,7 @@ class TransmissionThread(QThread):
 
         # Handshake
         self.setText.emit('Start transmission...')
-        Communicator.start(self.port)
+        Communicator.start(self.port, self.slot)
         self.addProgress.emit()
 
         if self.abortionState:
@@ -634,7 +1736,21 @@ class TransmissionThread(QThread):
         Communicator.end()
         self.addProgress.emit()
 
-        self.setText.emit('Transmission complete...')
+        # Read the clip back in one transfer instead of trusting every frame
+        self.setText.emit('Verify transmission...')
+        try:
+            with Communicator.measure('verification'):
+                verified = Communicator.verify(self.port, self.clip,
+                                               self.slot)
+        except (Communicator.CommunicationFaultException,
+                Communicator.ChecksumMismatchException):
+            verified = False
+        self.addProgress.emit()
+
+        if verified:
+            self.setText.emit('Transmission complete...')
+        else:
+            self.setText.emit('Verification failed, please upload again...')
         time.sleep(2)
 
     def abort(self):
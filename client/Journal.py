@@ -0,0 +1,208 @@
+"""
+Append-only journal of the edits of a clip for autosave and crash recovery
+"""
+
+import json
+import os
+import queue
+import threading
+
+
+class Journal:
+    """
+    Writes every edit of a clip as JSON line into a journal next to its
+    .nsc file. The journal is written by a background thread and compacted
+    periodically into an atomic full save of the clip, which empties the
+    journal again. Opening a clip replays a left journal (see recover).
+
+    Every line is numbered; the saved clip stores the number of the last
+    edit it contains, so edits of a journal, which wasn't removed after a
+    save (e.g. by a crash), aren't replayed twice. Listeners get the events
+    ('saved', revision of the saved clip) and ('failed', error message)
+    from the background thread. After a failed write, edits are only kept
+    in memory until the next successful compaction.
+    """
+
+    SUFFIX = '.journal'  # Suffix of the journal file
+    COMPACT_EDITS = 1000  # Amount of edits, which trigger a compaction
+
+    def __init__(self, clip):
+        """
+        constructor; the journal starts recording the edits of the clip
+
+        @param clip the clip; it needs a file path to be journaled
+        """
+        self.clip = clip
+        self.filePath = None
+        if clip.filePath is not None:
+            self.filePath = self.journalPath(clip.filePath)
+
+        self.pendingEdits = 0  # Edits since the last compaction
+        self.listeners = []  # Callbacks, which get (event, data)
+        # Set by a failed write; the journal misses edits until a compaction
+        self.broken = False
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        clip.listeners.append(self.record)
+
+    @classmethod
+    def journalPath(cls, clipFilePath):
+        """
+        Returns the path of the journal of a clip file.
+
+        @param clipFilePath path to the .nsc file
+        @return path to the journal file
+        """
+        return clipFilePath + cls.SUFFIX
+
+    @classmethod
+    def recover(cls, clip):
+        """
+        Replays the journal of a loaded clip, if there is one.
+
+        @param clip the clip loaded from its file
+        @return the amount of replayed edits
+        """
+        if clip.filePath is None:
+            return 0
+
+        try:
+            fp = open(cls.journalPath(clip.filePath), 'r')
+        except FileNotFoundError:
+            return 0
+
+        replayed = 0
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # The last line was only partly written by a crash
+            # Older journals have no sequence numbers
+            if isinstance(entry, dict):
+                if entry['seq'] <= clip.journalSequence:
+                    continue  # The saved clip already contains the edit
+                clip.journalSequence = entry['seq']
+                entry = entry['edit']
+            clip.applyEdit(tuple(entry))
+            replayed += 1
+        fp.close()
+
+        return replayed
+
+    @classmethod
+    def discard(cls, clipFilePath):
+        """
+        Removes the journal of a clip file, e.g. after it was overwritten.
+
+        @param clipFilePath path to the .nsc file
+        """
+        try:
+            os.remove(cls.journalPath(clipFilePath))
+        except FileNotFoundError:
+            pass
+
+    def record(self, edit):
+        """
+        Records an edit (listener of the clip).
+
+        @param edit the edit as tuple (see Clip.applyEdit)
+        """
+        if self.filePath is None:
+            return
+
+        self.clip.journalSequence += 1
+        self.queue.put(('edit', {'seq': self.clip.journalSequence,
+                                 'edit': edit}))
+        self.pendingEdits += 1
+        if self.pendingEdits >= self.COMPACT_EDITS:
+            self.compact()
+
+    def compact(self):
+        """
+        Saves the complete clip in the background and empties the journal.
+        A snapshot of the clip is saved, so the clip can be edited meanwhile.
+        """
+        if self.filePath is None:
+            return
+
+        self.queue.put(('compact', self.clip.snapshot()))
+        self.pendingEdits = 0
+
+    def addListener(self, listener):
+        """
+        Adds a listener of the saves and failures.
+
+        @param listener callback, which gets (event, data); it's called from
+            the background thread
+        """
+        self.listeners.append(listener)
+
+    def notify(self, event, data):
+        """
+        Calls all listeners.
+
+        @param event 'saved' or 'failed'
+        @param data the revision of the saved clip or the error message
+        """
+        for listener in self.listeners:
+            listener(event, data)
+
+    def sync(self):
+        """
+        Waits until all recorded edits and compactions are written.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Stops recording, writes the pending edits and ends the thread.
+        """
+        if self.record in self.clip.listeners:
+            self.clip.listeners.remove(self.record)
+        self.queue.put(('close', None))
+        self.thread.join()
+
+    def run(self):
+        """
+        Writes the journal (background thread).
+        """
+        fp = None
+        while True:
+            command, data = self.queue.get()
+            try:
+                if command == 'edit' and not self.broken:
+                    if fp is None:
+                        fp = open(self.filePath, 'a')
+                    fp.write(json.dumps(data) + '\n')
+                    if self.queue.empty():
+                        fp.flush()
+                elif command == 'compact':
+                    data.save()
+                    # The saved clip contains all edits of the journal
+                    if fp is not None:
+                        fp.close()
+                        fp = None
+                    if os.path.exists(self.filePath):
+                        os.remove(self.filePath)
+                    self.broken = False
+                    self.notify('saved', data.revision)
+                elif command == 'close' and fp is not None:
+                    closing, fp = fp, None
+                    closing.close()
+            except OSError as e:
+                if command == 'edit':
+                    # Later edits would be replayed without this one
+                    self.broken = True
+                    if fp is not None:
+                        try:
+                            fp.close()
+                        except OSError:
+                            pass
+                        fp = None
+                self.notify('failed', str(e))
+            finally:
+                self.queue.task_done()
+            if command == 'close':
+                return
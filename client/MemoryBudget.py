@@ -0,0 +1,247 @@
+"""
+Accounting of the memory of clips and the editor and a budget for it
+"""
+
+import os
+import re
+import sys
+import tracemalloc
+from itertools import islice
+from os.path import dirname, abspath, basename
+from model import Clip, Frame
+
+
+class MemoryBudget:
+    """
+    Measures the memory of clips (their frame lists, the shared frames and
+    the content index) and estimates the memory of the Qt objects of the
+    editor, which tracemalloc can't see. Clips, which would exceed the
+    budget, can be detected before they are opened or generated.
+
+    The budget is set by the environment variable NIGHTSKY_MEMORY_BUDGET_MB
+    (in MB, default 512).
+    With NIGHTSKY_MEMORY_TRACE, tracemalloc is started, so the allocations
+    of every module can be reported as well.
+    """
+
+    # Memory, which clips and the editor may use (in bytes); read from the
+    # environment on first use (see getBudget)
+    budget = None
+    DEFAULT_BUDGET_MB = 512
+    # Starts tracemalloc for reports per module
+    tracing = os.environ.get('NIGHTSKY_MEMORY_TRACE', '') not in ('', '0')
+
+    # Estimated sizes of Qt objects (outside of the Python heap)
+    LIST_ITEM_BYTES = 256  # Item of the frame list including its text
+    SCENE_ITEM_BYTES = 512  # Item of the scene (e.g. a star ellipse)
+    # Bytes of a frame within a .nsc file without its hex digits
+    FILE_FRAME_BYTES = 6
+    # Bytes at the start of a .nsc file, which contain its geometry
+    FILE_HEADER_BYTES = 256
+    # Above this amount of distinct frames a sample of them is measured
+    MAX_MEASURED_FRAMES = 10000
+    CLIENT_DIR = dirname(abspath(__file__))
+
+    @classmethod
+    def getBudget(cls):
+        """
+        Returns the budget; a malformed NIGHTSKY_MEMORY_BUDGET_MB is reported
+        and replaced by the default.
+
+        @return the budget in bytes
+        """
+        if cls.budget is None:
+            value = os.environ.get('NIGHTSKY_MEMORY_BUDGET_MB',
+                                   str(cls.DEFAULT_BUDGET_MB))
+            try:
+                megabytes = float(value)
+            except ValueError:
+                print('Invalid NIGHTSKY_MEMORY_BUDGET_MB {0!r}, using {1:d} MB'
+                      .format(value, cls.DEFAULT_BUDGET_MB), file=sys.stderr)
+                megabytes = cls.DEFAULT_BUDGET_MB
+            cls.budget = int(megabytes * 2 ** 20)
+        return cls.budget
+
+    @classmethod
+    def clipBytes(cls, clip):
+        """
+        Measures the memory of a clip. Shared frames are counted once; if
+        there are many of them, an evenly spaced sample is measured.
+
+        @param clip the clip
+        @return the size in bytes
+        """
+        size = sys.getsizeof(clip.frames)
+        snapshot = clip.snapshotFrames[1]
+        if snapshot is not None and snapshot is not clip.frames:
+            # The snapshot shares the chunks, which weren't edited since
+            size += sys.getsizeof(snapshot.chunks)
+
+        index = clip.frameIndex
+        size += sys.getsizeof(index)
+        step = max(1, -(-len(index) // cls.MAX_MEASURED_FRAMES))
+        sampleSize = 0
+        sampleCount = 0
+        for key, entry in islice(index.items(), 0, None, step):
+            sampleSize += sys.getsizeof(key) + sys.getsizeof(entry) + \
+                cls.frameBytes(entry[0])
+            sampleCount += 1
+        return size + sampleSize * len(index) // max(1, sampleCount)
+
+    @staticmethod
+    def frameBytes(frame):
+        """
+        Measures the memory of a single frame.
+
+        @param frame the frame
+        @return the size in bytes
+        """
+        return sys.getsizeof(frame) + sys.getsizeof(frame.__dict__) + \
+            sys.getsizeof(frame.setup)
+
+    @classmethod
+    def frameCost(cls, clip):
+        """
+        Returns the average memory of a frame of a clip.
+
+        @param clip the clip
+        @return the size in bytes per frame
+        """
+        return cls.clipBytes(clip) / max(1, clip.size)
+
+    @classmethod
+    def estimateClip(cls, frameCount, starCount):
+        """
+        Estimates the memory of a clip before it's created, assuming that
+        all frames differ (the worst case), including the editor's items.
+
+        @param frameCount amount of frames
+        @param starCount amount of stars within a frame
+        @return the size in bytes
+        """
+        frame = Frame.fromExport((1 << starCount) - 1, starCount)
+        key = (frame.setup, frame.duration)
+        perFrame = cls.frameBytes(frame) + sys.getsizeof(key) + \
+            sys.getsizeof([frame, 1])
+        perFrame += 8  # Reference in the frame sequence (shared by snapshots)
+        perFrame += 3 * 8  # Entry of the index (hash, key and value)
+        return frameCount * (perFrame + cls.LIST_ITEM_BYTES)
+
+    @classmethod
+    def estimateFile(cls, filePath):
+        """
+        Estimates the memory of a clip file before it's loaded, from the size
+        of the file and the geometry in its header.
+
+        @param filePath path to the .nsc file
+        @return the size in bytes
+        """
+        fp = open(filePath, 'rb')
+        header = fp.read(cls.FILE_HEADER_BYTES)
+        fp.close()
+        width = re.search(rb'"width":\s*(\d+)', header)
+        height = re.search(rb'"height":\s*(\d+)', header)
+        starCount = (int(width.group(1)) if width else Clip.WIDTH) * \
+            (int(height.group(1)) if height else Clip.HEIGHT)
+
+        fileFrameBytes = cls.FILE_FRAME_BYTES + -(-starCount // 4)
+        frameCount = os.path.getsize(filePath) // fileFrameBytes
+        return cls.estimateClip(frameCount, starCount)
+
+    @classmethod
+    def editorBytes(cls, listItems, sceneItems, imageBytes=0):
+        """
+        Estimates the memory of the Qt objects of the editor.
+
+        @param listItems amount of items of the frame list
+        @param sceneItems amount of items of the scene
+        @param imageBytes size of the images of the scene
+        @return the size in bytes
+        """
+        return listItems * cls.LIST_ITEM_BYTES + \
+            sceneItems * cls.SCENE_ITEM_BYTES + imageBytes
+
+    @classmethod
+    def fits(cls, size, used=0):
+        """
+        Checks whether additional memory fits into the budget.
+
+        @param size the additional memory in bytes
+        @param used memory, which remains in use, in bytes
+        @return True if the budget isn't exceeded
+        """
+        return used + size <= cls.getBudget()
+
+    # === tracemalloc ===
+    @classmethod
+    def startTracing(cls):
+        """
+        Starts tracing the allocations.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        cls.tracing = True
+
+    @classmethod
+    def stopTracing(cls):
+        """
+        Stops tracing the allocations and drops the traces.
+        """
+        tracemalloc.stop()
+        cls.tracing = False
+
+    @classmethod
+    def tracedBytes(cls):
+        """
+        Returns the traced memory per module of the client.
+
+        @return dictionary module name -> size in bytes (other modules are
+            combined as 'other'); empty if tracing is off
+        """
+        if not tracemalloc.is_tracing():
+            return {}
+
+        modules = {}
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        for stat in snapshot.statistics('filename'):
+            fileName = stat.traceback[0].filename
+            name = 'other'
+            if dirname(abspath(fileName)) == cls.CLIENT_DIR:
+                name = basename(fileName).rsplit('.', 1)[0]
+            modules[name] = modules.get(name, 0) + stat.size
+        return modules
+
+    @staticmethod
+    def format(size):
+        """
+        Formats a memory size.
+
+        @param size the size in bytes
+        @return the size with unit, e.g. '1.5 MB'
+        """
+        for unit in ('B', 'KB', 'MB'):
+            if abs(size) < 1024:
+                return '{0:.{1}f} {2}'.format(size, 0 if unit == 'B' else 1,
+                                              unit)
+            size /= 1024
+        return '{0:.1f} GB'.format(size)
+
+    @classmethod
+    def report(cls, clip, editorBytes=0):
+        """
+        Summarizes the memory of a clip and the editor.
+
+        @param clip the clip
+        @param editorBytes estimated memory of the Qt objects of the editor
+        @return dictionary with the sizes in bytes
+        """
+        clipBytes = cls.clipBytes(clip)
+        report = {'clip': clipBytes,
+                  'frameCost': clipBytes / max(1, clip.size),
+                  'editor': editorBytes,
+                  'budget': cls.getBudget()}
+        traced = cls.tracedBytes()
+        if len(traced) != 0:
+            report['traced'] = traced
+        return report
@@ -0,0 +1,357 @@
+"""
+Renders clips without Qt (ASCII art, images and animations)
+"""
+
+import argparse
+import struct
+import sys
+import zlib
+from CompileCache import CompileCache
+from model import Clip
+
+
+class PreviewRenderer:
+    """
+    Renders frames into 8 bit grayscale images. Every star is a precomputed
+    sprite (the runs of its pixels per image line). The setups are looked up
+    byte by byte: the pixel runs of all lit stars of a byte value are cached,
+    so a frame costs a copy of the background and a few slice assignments.
+    """
+
+    # Positions of the stars of the Nightsky device on the canvas
+    STAR_POSITIONS = ((643, 35), (523, 50), (333, 20), (265, 58), (202, 28),
+                      (120, 25),
+                      (634, 92), (468, 80), (411, 49), (269, 80), (108, 78),
+                      (80, 55),
+                      (707, 145), (580, 155), (411, 152), (274, 100),
+                      (130, 87), (22, 97),
+                      (658, 227), (479, 172), (441, 160), (335, 213),
+                      (232, 152), (67, 168),
+                      (718, 262), (520, 202), (468, 250), (332, 258),
+                      (194, 214), (105, 228))
+    STAR_SIZE = 13  # Diameter of a star of the device in pixels
+    CELL_SIZE = 12  # Size of a star of other matrices in pixels
+    BACKGROUND = 0  # Gray values like on the canvas
+    OFF = 100
+    ON = 200
+    MAX_CACHED_FRAMES = 1024  # Rendered frames, which are kept
+    # Longest delay of an APNG frame in centiseconds; longer images are
+    # written as several frames
+    MAX_DELAY = 0xFFFF
+
+    def __init__(self, clip, scale=1.0):
+        """
+        constructor
+
+        @param clip the clip, whose geometry is rendered
+        @param scale factor for the size of the images
+        """
+        self.clip = clip
+        self.starCount = clip.starCount
+
+        # Positions and size of the stars
+        if clip.fitsDevice():
+            size = max(1, int(round(self.STAR_SIZE * scale)))
+            positions = [(int(x * scale), int(y * scale))
+                         for x, y in self.STAR_POSITIONS]
+        else:
+            cellSize = max(1, int(round(self.CELL_SIZE * scale)))
+            size = max(1, cellSize - 2)
+            positions = [((starId % clip.width) * cellSize + 1,
+                          (starId // clip.width) * cellSize + 1)
+                         for starId in range(self.starCount)]
+        self.width = max(x for x, y in positions) + size + 1
+        self.height = max(y for x, y in positions) + size + 1
+
+        # Sprites as lists of (start, end) within the pixels
+        self.sprites = [self.sprite(x, y, size) for x, y in positions]
+
+        background = bytearray([self.BACKGROUND]) * (self.width * self.height)
+        for sprite in self.sprites:
+            for start, end in sprite:
+                background[start:end] = bytes([self.OFF]) * (end - start)
+        self.background = bytes(background)
+
+        # Setups are split into bytes; the first byte is padded at the front
+        self.padding = -self.starCount % 8
+        self.byteCount = (self.starCount + self.padding) // 8
+        self.runs = [{} for _ in range(self.byteCount)]
+        self.frames = {}  # Setup -> rendered pixels
+
+    def sprite(self, x, y, size):
+        """
+        Computes the pixel runs of a round star.
+
+        @param x left edge of the star
+        @param y top edge of the star
+        @param size diameter of the star
+        @return list of (start, end) indices within the pixels
+        """
+        center = (size - 1) / 2
+        radius = size / 2
+        runs = []
+        for dy in range(size):
+            dx = [dx for dx in range(size)
+                  if (dx - center) ** 2 + (dy - center) ** 2 <= radius ** 2]
+            if len(dx) != 0:
+                start = (y + dy) * self.width + x
+                runs.append((start + dx[0], start + dx[-1] + 1))
+        return runs
+
+    def litRuns(self, byteId, value):
+        """
+        Returns the pixel runs of the lit stars of a byte of a setup.
+
+        @param byteId index of the byte within the padded setup
+        @param value the value of the byte
+        @return list of (start, end, pixels)
+        """
+        runs = self.runs[byteId].get(value)
+        if runs is None:
+            runs = []
+            for bit in range(8):
+                starId = byteId * 8 + bit - self.padding
+                if value & (0x80 >> bit) and 0 <= starId < self.starCount:
+                    runs.extend((start, end, bytes([self.ON]) * (end - start))
+                                for start, end in self.sprites[starId])
+            self.runs[byteId][value] = runs
+        return runs
+
+    def render(self, setup):
+        """
+        Renders a frame.
+
+        @param setup the setup as integer (see Frame.export)
+        @return the pixels (width * height gray values, line by line)
+        """
+        pixels = self.frames.get(setup)
+        if pixels is not None:
+            return pixels
+
+        image = bytearray(self.background)
+        for byteId, value in enumerate(setup.to_bytes(self.byteCount, 'big')):
+            if value:
+                for start, end, lit in self.litRuns(byteId, value):
+                    image[start:end] = lit
+        pixels = bytes(image)
+
+        if len(self.frames) >= self.MAX_CACHED_FRAMES:
+            self.frames.clear()
+        self.frames[setup] = pixels
+        return pixels
+
+    def ascii(self, setup):
+        """
+        Renders a frame as ASCII art, a line of text per line of the matrix.
+
+        @param setup the setup as integer
+        @return the text ('#' is on, '.' is off)
+        """
+        bits = format(setup, '0{0:d}b'.format(self.starCount))
+        bits = bits.replace('1', '#').replace('0', '.')
+        width = self.clip.width
+        return '\n'.join(bits[i:i + width]
+                         for i in range(0, self.starCount, width))
+
+    def contactSheet(self, setups, columns=8, gap=4):
+        """
+        Renders frames side by side into one image.
+
+        @param setups list of setups as integers
+        @param columns frames per line of the sheet
+        @param gap distance between the frames in pixels
+        @return tuple of width, height and pixels of the sheet
+        """
+        rows = max(1, -(-len(setups) // columns))
+        columns = max(1, min(columns, len(setups)))
+        sheetWidth = columns * (self.width + gap) + gap
+        sheetHeight = rows * (self.height + gap) + gap
+        sheet = bytearray([self.BACKGROUND]) * (sheetWidth * sheetHeight)
+
+        for i, setup in enumerate(setups):
+            pixels = self.render(setup)
+            left = gap + (i % columns) * (self.width + gap)
+            top = gap + (i // columns) * (self.height + gap)
+            for y in range(self.height):
+                start = (top + y) * sheetWidth + left
+                sheet[start:start + self.width] = \
+                    pixels[y * self.width:(y + 1) * self.width]
+
+        return sheetWidth, sheetHeight, bytes(sheet)
+
+    # === Image files ===
+    @staticmethod
+    def saveImage(filePath, width, height, pixels):
+        """
+        Saves a grayscale image as PNG, PGM or PPM (chosen by the suffix).
+
+        @param filePath path to the file
+        @param width width of the image
+        @param height height of the image
+        @param pixels the gray values line by line
+        """
+        suffix = filePath.rsplit('.', 1)[-1].lower()
+        fp = open(filePath, 'wb')
+        if suffix == 'png':
+            fp.write(PreviewRenderer.png(width, height, [pixels]))
+        elif suffix == 'ppm':
+            fp.write('P6\n{0:d} {1:d}\n255\n'.format(width, height).encode())
+            fp.write(bytes(value for value in pixels for _ in range(3)))
+        else:
+            fp.write('P5\n{0:d} {1:d}\n255\n'.format(width, height).encode())
+            fp.write(pixels)
+        fp.close()
+
+    @staticmethod
+    def pngChunk(chunkType, data):
+        """
+        Builds a PNG chunk.
+
+        @param chunkType type of the chunk as bytes
+        @param data content of the chunk
+        @return the chunk
+        """
+        return struct.pack('>I', len(data)) + chunkType + data + \
+            struct.pack('>I', zlib.crc32(chunkType + data))
+
+    @classmethod
+    def png(cls, width, height, images, delays=None):
+        """
+        Encodes grayscale images as PNG; several images become an animated
+        PNG.
+
+        @param width width of the images
+        @param height height of the images
+        @param images list of pixels
+        @param delays delay of every image in milliseconds (animations);
+            they are stored in centiseconds
+        @return the content of the file
+        """
+        def compress(pixels):
+            # Every line starts with the filter type (0 = none)
+            return zlib.compress(b''.join(
+                b'\x00' + pixels[y * width:(y + 1) * width]
+                for y in range(height)))
+
+        data = [b'\x89PNG\r\n\x1a\n', cls.pngChunk(
+            b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))]
+
+        if len(images) == 1:
+            data.append(cls.pngChunk(b'IDAT', compress(images[0])))
+        else:
+            # Delays in centiseconds
+            frames = []
+            for pixels, delay in zip(images, delays):
+                compressed = compress(pixels)
+                delay = (delay + 5) // 10
+                while delay > cls.MAX_DELAY:
+                    frames.append((compressed, cls.MAX_DELAY))
+                    delay -= cls.MAX_DELAY
+                frames.append((compressed, delay))
+
+            data.append(cls.pngChunk(b'acTL', struct.pack('>II', len(frames),
+                                                          0)))
+            sequence = 0
+            for i, (compressed, delay) in enumerate(frames):
+                data.append(cls.pngChunk(b'fcTL', struct.pack(
+                    '>IIIIIHHBB', sequence, width, height, 0, 0, delay, 100,
+                    0, 0)))
+                sequence += 1
+                if i == 0:
+                    data.append(cls.pngChunk(b'IDAT', compressed))
+                else:
+                    data.append(cls.pngChunk(b'fdAT', struct.pack(
+                        '>I', sequence) + compressed))
+                    sequence += 1
+
+        data.append(cls.pngChunk(b'IEND', b''))
+        return b''.join(data)
+
+    def animation(self, stepDuration=100):
+        """
+        Renders the whole clip as animated PNG. Identical consecutive frames
+        are combined; an empty clip is rendered as a step without stars.
+
+        @param stepDuration duration of an animation step in milliseconds
+        @return the content of the file
+        """
+        images = []
+        delays = []
+        lastSetup = None
+        for frame in self.clip.frames:
+            if frame.export() == lastSetup:
+                delays[-1] += frame.duration * stepDuration
+                continue
+            lastSetup = frame.export()
+            images.append(self.render(lastSetup))
+            delays.append(frame.duration * stepDuration)
+
+        if len(images) == 0:
+            images.append(self.render(0))  # An empty clip shows no stars
+            delays.append(stepDuration)
+        if len(images) == 1:
+            images.append(images[0])  # An animation needs two frames
+            delays = [delays[0] // 2, delays[0] - delays[0] // 2]
+        return self.png(self.width, self.height, images, delays)
+
+
+def main(argv):
+    """
+    Command line interface:
+        Preview.py CLIP --ascii
+        Preview.py CLIP --sheet OUTPUT [--columns N] [--scale S]
+        Preview.py CLIP --animation OUTPUT.png [--scale S]
+        Preview.py CLIP --frame N --image OUTPUT [--scale S]
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='Preview.py')
+    parser.add_argument('clip')
+    parser.add_argument('--ascii', action='store_true',
+                        help='print all frames as text')
+    parser.add_argument('--sheet', help='contact sheet (.png/.pgm/.ppm)')
+    parser.add_argument('--animation', help='animated PNG')
+    parser.add_argument('--image', help='single frame (.png/.pgm/.ppm)')
+    parser.add_argument('--frame', type=int, default=0)
+    parser.add_argument('--columns', type=int, default=8)
+    parser.add_argument('--scale', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    # Animations are cached, so unchanged clips aren't even loaded
+    if args.animation:
+        cache = CompileCache()
+        animation = cache.fetch(
+            cache.fileKey(args.clip), 'animation-{0:g}.png'.format(args.scale),
+            lambda: PreviewRenderer(Clip(args.clip), args.scale).animation())
+        fp = open(args.animation, 'wb')
+        fp.write(animation)
+        fp.close()
+    if not (args.ascii or args.sheet or args.image):
+        return 0
+
+    clip = Clip(args.clip)
+    renderer = PreviewRenderer(clip, args.scale)
+    setups = [frame.export() for frame in clip.frames]
+    if args.image and not 0 <= args.frame < len(setups):
+        print('The clip has no frame {0:d} ({1:d} frames).'.format(
+            args.frame, len(setups)), file=sys.stderr)
+        return 1
+
+    if args.ascii:
+        for frameId, setup in enumerate(setups):
+            print('Frame {0:d} ({1:d} steps)'.format(
+                frameId, clip.frames[frameId].duration))
+            print(renderer.ascii(setup))
+    if args.sheet:
+        renderer.saveImage(args.sheet,
+                           *renderer.contactSheet(setups, args.columns))
+    if args.image:
+        renderer.saveImage(args.image, renderer.width, renderer.height,
+                           renderer.render(setups[args.frame]))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
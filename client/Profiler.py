@@ -0,0 +1,164 @@
+"""
+Opt-in profiling of the event handlers, which run on the GUI thread
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+
+class Profiler:
+    """
+    Times instrumented handlers, counts their calls and keeps traces of slow
+    events. The profiler is disabled by default and can be enabled with the
+    environment variable NIGHTSKY_PROFILE or at runtime.
+    """
+
+    # Enables the instrumentation
+    enabled = os.environ.get('NIGHTSKY_PROFILE', '') not in ('', '0')
+    # Events, which take longer, are kept as slow events (in seconds)
+    slowThreshold = float(os.environ.get('NIGHTSKY_PROFILE_SLOW_MS', 50)) / 1000
+    MAX_SLOW_EVENTS = 100  # Amount of kept slow events
+
+    stats = {}  # Handler name -> [calls, total time, max time]
+    slowEvents = deque(maxlen=MAX_SLOW_EVENTS)
+    local = threading.local()  # Per thread traces of the running handlers
+    recording = None  # cProfile.Profile of a running recording
+
+    @classmethod
+    def timed(cls, name):
+        """
+        Decorator, which instruments a handler.
+
+        @param name name of the handler in the reports
+        @return the decorator
+        """
+        def decorator(handler):
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                if not cls.enabled:
+                    return handler(*args, **kwargs)
+
+                callStack = cls.callStack()
+                trace = [(name, len(callStack), None)]
+                callStack.append(trace)
+                startTime = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    duration = time.perf_counter() - startTime
+                    callStack.pop()
+                    trace[0] = (name, len(callStack), duration)
+                    cls.addCall(name, duration, trace)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def callStack(cls):
+        """
+        Returns the traces of the running handlers of the current thread.
+
+        @return list of traces; the innermost handler is the last one
+        """
+        if not hasattr(cls.local, 'callStack'):
+            cls.local.callStack = []
+        return cls.local.callStack
+
+    @classmethod
+    def addCall(cls, name, duration, trace):
+        """
+        Adds a finished call to the statistics.
+
+        @param name name of the handler
+        @param duration duration of the call in seconds
+        @param trace list of (name, depth, duration) of the call and all
+            instrumented calls within
+        """
+        stat = cls.stats.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = max(stat[2], duration)
+
+        callStack = cls.callStack()
+        if len(callStack) != 0:
+            # Nested call: becomes part of the trace of the outer event
+            callStack[-1].extend(trace)
+        elif duration >= cls.slowThreshold:
+            cls.slowEvents.append({'time': time.time(), 'name': name,
+                                   'duration': duration, 'trace': trace})
+
+    @classmethod
+    def reset(cls):
+        """
+        Drops all collected statistics and slow events.
+        """
+        cls.stats.clear()
+        cls.slowEvents.clear()
+
+    @classmethod
+    def startRecording(cls):
+        """
+        Starts a cProfile recording of an interaction.
+        """
+        cls.recording = cProfile.Profile()
+        cls.recording.enable()
+
+    @classmethod
+    def stopRecording(cls, filePath=None):
+        """
+        Stops the running recording.
+
+        @param filePath optional file, where the report is written into
+        @return the report as string
+        """
+        if cls.recording is None:
+            return ''
+
+        cls.recording.disable()
+        stream = io.StringIO()
+        stream.write(cls.report())
+        stream.write('\n=== cProfile ===\n')
+        stats = pstats.Stats(cls.recording, stream=stream)
+        stats.sort_stats('cumulative').print_stats(50)
+        cls.recording = None
+
+        if filePath is not None:
+            fp = open(filePath, 'w')
+            fp.write(stream.getvalue())
+            fp.close()
+
+        return stream.getvalue()
+
+    @classmethod
+    def report(cls):
+        """
+        Formats the statistics and slow events.
+
+        @return the report as string
+        """
+        lines = ['=== Handlers ===',
+                 '{0:<30} {1:>8} {2:>12} {3:>12} {4:>12}'.format(
+                     'handler', 'calls', 'total ms', 'mean ms', 'max ms')]
+        for name, (calls, total, maxTime) in sorted(
+                cls.stats.items(), key=lambda item: -item[1][1]):
+            lines.append('{0:<30} {1:>8d} {2:>12.3f} {3:>12.3f} {4:>12.3f}'
+                         .format(name, calls, total * 1000,
+                                 total * 1000 / calls, maxTime * 1000))
+
+        lines.append('')
+        lines.append('=== Slow events (>= {0:.1f} ms) ==='
+                     .format(cls.slowThreshold * 1000))
+        for event in cls.slowEvents:
+            lines.append('{0} {1} {2:.3f} ms'.format(
+                time.strftime('%H:%M:%S', time.localtime(event['time'])),
+                event['name'], event['duration'] * 1000))
+            for name, depth, duration in event['trace'][1:]:
+                lines.append('    {0}{1} {2:.3f} ms'.format(
+                    '  ' * depth, name, duration * 1000))
+
+        return '\n'.join(lines) + '\n'
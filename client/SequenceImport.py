@@ -0,0 +1,454 @@
+"""
+Import of image sequences (PGM/PPM files or .npy arrays) into clips
+"""
+
+import ast
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from os.path import getsize, splitext
+from model import Clip
+
+
+class SequenceImporter:
+    """
+    Converts a stream of images into frames by sampling every image at the
+    positions of the stars and thresholding (or dithering) the brightness.
+
+    The images are processed one after another, so only a bounded amount of
+    them is in memory. Files are decoded by a pool of threads, the sampling
+    of an image is a single itemgetter call over precomputed offsets.
+    """
+
+    # Ordered dithering (4x4 Bayer matrix); the stars are laid out as grid
+    BAYER_MATRIX = ((0, 8, 2, 10), (12, 4, 14, 6),
+                    (3, 11, 1, 9), (15, 7, 13, 5))
+    # Decoded images per file, which may wait for the sampling
+    IMAGES_AHEAD = 4
+
+    class UnsupportedFormatException(Exception):
+        """
+        Exception for files, which can't be imported
+        """
+
+        def __init__(self, reason):
+            """
+            constructor
+
+            @param reason description of the problem
+            """
+            super().__init__(self, 'Unsupported image: {0}'.format(reason))
+
+    def __init__(self, width=Clip.WIDTH, height=Clip.HEIGHT, positions=None,
+                 threshold=128, dither=False, workers=4):
+        """
+        constructor
+
+        @param width stars per line of the created clips
+        @param height lines of the created clips
+        @param positions list of (x, y) per star within the image, both
+            between 0 and 1; if none are given, the stars are the centers of
+            a grid over the whole image
+        @param threshold brightness (0 to 255), from which a star is on
+        @param dither True to dither the brightness instead of a fixed
+            threshold
+        @param workers amount of threads, which decode files
+        """
+        self.width = width
+        self.height = height
+        if positions is None:
+            positions = [((x + 0.5) / width, (y + 0.5) / height)
+                         for y in range(height) for x in range(width)]
+        self.positions = positions
+        self.threshold = threshold
+        self.dither = dither
+        self.workers = workers
+
+        # Brightness limit of every star
+        self.limits = []
+        for starId in range(width * height):
+            if dither:
+                y, x = divmod(starId, width)
+                rank = self.BAYER_MATRIX[y % 4][x % 4]
+                self.limits.append((rank * 2 + 1) * 8)  # (rank + 0.5) * 16
+            else:
+                self.limits.append(threshold)
+
+        self.samplers = {}  # (width, height, channels) -> itemgetter
+
+    # === Decoding ===
+    def images(self, filePaths):
+        """
+        Decodes the images of several files in order. PGM/PPM files may
+        contain several images (e.g. a stream of ffmpeg), .npy files contain
+        an array of the shape (height, width), (frames, height, width) or
+        (frames, height, width, channels).
+
+        @param filePaths list of paths to the files
+        @return generator of tuples (width, height, channels, samples)
+        """
+        pnmPaths = []
+        for filePath in filePaths:
+            if splitext(filePath)[1].lower() == '.npy':
+                yield from self.decodeFiles(pnmPaths)
+                pnmPaths = []
+                yield from self.readNpy(filePath)
+            else:
+                pnmPaths.append(filePath)
+        yield from self.decodeFiles(pnmPaths)
+
+    def decodeFiles(self, filePaths):
+        """
+        Decodes PGM/PPM files in parallel, but returns the images in order.
+        Only a few files are decoded ahead and of every file at most
+        IMAGES_AHEAD images, so files with long streams of images aren't
+        loaded as a whole.
+
+        @param filePaths list of paths to the files
+        @return generator of tuples (width, height, channels, samples)
+        """
+        if len(filePaths) == 0:
+            return
+
+        stopped = threading.Event()
+        with ThreadPoolExecutor(self.workers) as executor:
+            pending = deque()
+            try:
+                for filePath in filePaths:
+                    images = queue.Queue(self.IMAGES_AHEAD)
+                    executor.submit(self.readPnmFile, filePath, images,
+                                    stopped)
+                    pending.append(images)
+                    if len(pending) >= 2 * self.workers:
+                        yield from self.takeImages(pending.popleft())
+                while pending:
+                    yield from self.takeImages(pending.popleft())
+            finally:
+                stopped.set()  # Ends the decoding, if the import was aborted
+
+    @staticmethod
+    def takeImages(images):
+        """
+        Takes the images of a file from its queue (see readPnmFile).
+
+        @param images the queue
+        @return generator of tuples (width, height, channels, samples)
+        @raise Exception the exception, which stopped the decoding
+        """
+        while True:
+            image = images.get()
+            if image is None:
+                return
+            if isinstance(image, Exception):
+                raise image
+            yield image
+
+    @classmethod
+    def readPnmFile(cls, filePath, images, stopped):
+        """
+        Reads the images of a PGM/PPM file into a queue; None ends them. An
+        exception is put into the queue instead, so it's raised in the
+        importing thread.
+
+        @param filePath path to the file
+        @param images queue.Queue, which receives tuples (width, height,
+            channels, samples)
+        @param stopped threading.Event, which aborts the reading
+        """
+        try:
+            fp = open(filePath, 'rb')
+            try:
+                for image in cls.readPnm(fp):
+                    if not cls.putImage(images, image, stopped):
+                        return
+            finally:
+                fp.close()
+        except Exception as e:
+            cls.putImage(images, e, stopped)
+            return
+        cls.putImage(images, None, stopped)
+
+    @staticmethod
+    def putImage(images, image, stopped):
+        """
+        Puts an image into a queue, as soon as it has room.
+
+        @param images the queue
+        @param image the image
+        @param stopped threading.Event, which aborts the waiting
+        @return False if the reading was aborted
+        """
+        while not stopped.is_set():
+            try:
+                images.put(image, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @classmethod
+    def readPnm(cls, fp):
+        """
+        Reads binary PGM (P5) and PPM (P6) images from a stream until its
+        end. 16 bit images are reduced to 8 bit.
+
+        @param fp binary stream
+        @return generator of tuples (width, height, channels, samples)
+        @raise UnsupportedFormatException the stream contains other data
+        """
+        while True:
+            magic = fp.read(2)
+            while magic[:1].isspace():  # Separators between the images
+                magic = magic[1:] + fp.read(1)
+            if magic == b'':
+                return
+            if magic not in (b'P5', b'P6'):
+                raise cls.UnsupportedFormatException(
+                    'no binary PGM/PPM ({0!r})'.format(magic))
+
+            width, height, maxValue = (cls.readPnmNumber(fp)
+                                       for _ in range(3))
+            channels = 1 if magic == b'P5' else 3
+            sampleSize = 1 if maxValue < 256 else 2
+            size = width * height * channels * sampleSize
+            samples = fp.read(size)
+            if len(samples) != size:
+                raise cls.UnsupportedFormatException('truncated image')
+
+            if sampleSize == 2:
+                samples = samples[::2]  # Most significant bytes
+                maxValue >>= 8
+            if maxValue != 255:
+                samples = bytes(min(255, sample * 255 // maxValue)
+                                for sample in samples)
+
+            yield width, height, channels, samples
+
+    @classmethod
+    def readPnmNumber(cls, fp):
+        """
+        Reads a number of a PGM/PPM header (skipping comments) and the single
+        whitespace after it.
+
+        @param fp binary stream
+        @return the number
+        """
+        digits = b''
+        while True:
+            char = fp.read(1)
+            if char == b'#':
+                fp.readline()
+            elif char.isdigit():
+                digits += char
+            elif digits != b'' or char == b'':
+                break
+
+        if digits == b'':
+            raise cls.UnsupportedFormatException('truncated header')
+        return int(digits)
+
+    @classmethod
+    def readNpy(cls, filePath):
+        """
+        Reads the frames of an .npy file one after another (uint8 or bool
+        arrays in C order).
+
+        @param filePath path to the file
+        @return generator of tuples (width, height, channels, samples)
+        @raise UnsupportedFormatException the array can't be imported
+        """
+        fp = open(filePath, 'rb')
+        try:
+            header = cls.readNpyHeader(fp)
+
+            if header['fortran_order'] or \
+                    header['descr'] not in ('|u1', '<u1', '>u1', '|b1'):
+                raise cls.UnsupportedFormatException(
+                    'array of {0} (only uint8 and bool in C order)'
+                    .format(header['descr']))
+
+            shape = header['shape']
+            if len(shape) == 2:
+                shape = (1,) + shape
+            if len(shape) == 3:
+                shape = shape + (1,)
+            if len(shape) != 4 or shape[3] not in (1, 3):
+                raise cls.UnsupportedFormatException(
+                    'array of the shape {0}'.format(header['shape']))
+
+            frameCount, height, width, channels = shape
+            size = height * width * channels
+            for i in range(frameCount):
+                samples = fp.read(size)
+                if len(samples) != size:
+                    raise cls.UnsupportedFormatException('truncated array')
+                if header['descr'] == '|b1':
+                    samples = samples.replace(b'\x01', b'\xff')
+                yield width, height, channels, samples
+        finally:
+            fp.close()
+
+    @classmethod
+    def readNpyHeader(cls, fp):
+        """
+        Reads the header of an .npy file.
+
+        @param fp binary stream at the start of the file
+        @return dictionary with descr, fortran_order and shape
+        @raise UnsupportedFormatException the stream is no .npy file or its
+            header is malformed
+        """
+        if fp.read(6) != b'\x93NUMPY':
+            raise cls.UnsupportedFormatException('no .npy file')
+        version = fp.read(2)
+        if len(version) != 2:
+            raise cls.UnsupportedFormatException('truncated header')
+        sizeBytes = 2 if version[0] == 1 else 4
+        headerSize = fp.read(sizeBytes)
+        if len(headerSize) != sizeBytes:
+            raise cls.UnsupportedFormatException('truncated header')
+
+        try:
+            header = ast.literal_eval(
+                fp.read(int.from_bytes(headerSize, 'little')).decode('latin1'))
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            raise cls.UnsupportedFormatException('malformed header')
+        if not isinstance(header, dict) or \
+                not isinstance(header.get('descr'), str) or \
+                not isinstance(header.get('fortran_order'), bool) or \
+                not isinstance(header.get('shape'), tuple) or \
+                not all(isinstance(length, int) and length >= 0
+                        for length in header['shape']):
+            raise cls.UnsupportedFormatException('malformed header')
+        return header
+
+    @classmethod
+    def countImages(cls, filePaths):
+        """
+        Estimates the amount of images within files without decoding them:
+        PGM/PPM files are assumed to contain images like their first one.
+
+        @param filePaths list of paths to the files
+        @return the amount of images
+        @raise UnsupportedFormatException a file can't be imported
+        """
+        count = 0
+        for filePath in filePaths:
+            fp = open(filePath, 'rb')
+            try:
+                if splitext(filePath)[1].lower() == '.npy':
+                    shape = cls.readNpyHeader(fp)['shape']
+                    count += shape[0] if len(shape) > 2 else 1
+                    continue
+
+                magic = fp.read(2)
+                width, height, maxValue = (cls.readPnmNumber(fp)
+                                           for _ in range(3))
+                size = width * height * (1 if magic == b'P5' else 3) * \
+                    (1 if maxValue < 256 else 2)
+                count += max(1, getsize(filePath) // (fp.tell() + size))
+            finally:
+                fp.close()
+
+        return count
+
+    # === Conversion ===
+    def sampler(self, width, height, channels):
+        """
+        Returns a function, which picks the samples of all stars out of an
+        image of the given size.
+
+        @param width width of the image in pixels
+        @param height height of the image in pixels
+        @param channels samples per pixel (1 or 3)
+        @return itemgetter, which returns the samples of all stars
+        """
+        key = (width, height, channels)
+        if key not in self.samplers:
+            offsets = []
+            for x, y in self.positions:
+                pixel = min(height - 1, int(y * height)) * width + \
+                    min(width - 1, int(x * width))
+                offsets.extend(range(pixel * channels,
+                                     (pixel + 1) * channels))
+            self.samplers[key] = itemgetter(*offsets)
+        return self.samplers[key]
+
+    def toSetup(self, image):
+        """
+        Converts an image into a setup.
+
+        @param image tuple (width, height, channels, samples)
+        @return the setup as integer (see Frame.export)
+        """
+        width, height, channels, samples = image
+        picked = self.sampler(width, height, channels)(samples)
+        if not isinstance(picked, tuple):
+            picked = (picked,)  # itemgetter of a single item
+
+        setup = 0
+        for starId, limit in enumerate(self.limits):
+            if channels == 1:
+                brightness = picked[starId]
+            else:
+                r, g, b = picked[starId * 3:starId * 3 + 3]
+                brightness = (r * 299 + g * 587 + b * 114) // 1000
+            setup = (setup << 1) | (1 if brightness >= limit else 0)
+
+        return setup
+
+    def setups(self, filePaths):
+        """
+        Converts the images of several files into setups.
+
+        @param filePaths list of paths to the files
+        @return generator of setups as integers
+        """
+        for image in self.images(filePaths):
+            yield self.toSetup(image)
+
+    def toClip(self, filePaths, duration=1):
+        """
+        Creates a clip with a frame per image.
+
+        @param filePaths list of paths to the files
+        @param duration duration of every frame in animation steps
+        @return the new clip
+        """
+        clip = Clip(width=self.width, height=self.height)
+        for setup in self.setups(filePaths):
+            clip.frames.append(clip.useFrame(setup, duration))
+        if clip.size != 0:
+            clip.curFrame = 0
+        clip.revision += 1  # Importing is no edit, like loading a file
+        return clip
+
+    def records(self, filePaths, duration=1):
+        """
+        Converts the images directly into compressed frames (see
+        Clip.export) without keeping a clip in memory.
+
+        @param filePaths list of paths to the files
+        @param duration duration of every image in animation steps
+        @return generator of compressed frames as bytes
+        """
+        packer = Clip(width=self.width, height=self.height)
+        runSetup = None
+        runDuration = 0
+        for setup in self.setups(filePaths):
+            if setup == runSetup:
+                runDuration += duration
+                continue
+            if runSetup is not None:
+                run = []
+                packer.packRun(run, runDuration, runSetup)
+                yield from run
+            runSetup = setup
+            runDuration = duration
+
+        if runSetup is not None:
+            run = []
+            packer.packRun(run, runDuration, runSetup)
+            yield from run
@@ -0,0 +1,410 @@
+"""
+Recording and replay of the serial communication with devices
+"""
+
+import argparse
+import json
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from Communicator import Communicator
+from Telemetry import TransmissionTelemetry
+from model import Clip
+
+
+class SerialTrace:
+    """
+    Format of a trace file: the magic "NSTR", a version byte and a sequence
+    of events. An event is its type (o = open, w = write, r = read,
+    f = flush, c = close), the id of the port session, the time since the
+    previous event and the duration of the call (both in microseconds), the
+    length of the payload and the payload (port name, written or read
+    bytes).
+    """
+
+    MAGIC = b'NSTR'
+    VERSION = 1
+    EVENT = struct.Struct('<cHIII')
+    MAX_TIME = 2 ** 32 - 1  # Maximum time of an event in microseconds
+
+    class InvalidTraceException(Exception):
+        """
+        Exception for malformed trace files
+        """
+
+        def __init__(self, reason):
+            """
+            constructor
+
+            @param reason description of the problem
+            """
+            super().__init__(self, 'Invalid serial trace: {0}'.format(reason))
+
+    class ReplayMismatchException(Exception):
+        """
+        Exception for communication, which differs from the recording
+        """
+
+        def __init__(self, expected, got):
+            """
+            constructor
+
+            @param expected the recorded call
+            @param got the actual call
+            """
+            super().__init__(self, 'Recorded: {0!r} | Replayed: {1!r}'
+                             .format(expected, got))
+
+    @classmethod
+    def readEvents(cls, filePath):
+        """
+        Reads all events of a trace file.
+
+        @param filePath path to the file
+        @return list of tuples (type, session, delta, duration, payload) with
+            the type as character and the times in seconds
+        @raise InvalidTraceException the file is malformed
+        """
+        fp = open(filePath, 'rb')
+        data = fp.read()
+        fp.close()
+
+        if data[:4] != cls.MAGIC or data[4:5] != bytes([cls.VERSION]):
+            raise cls.InvalidTraceException('unknown format')
+
+        events = []
+        pos = 5
+        while pos < len(data):
+            if pos + cls.EVENT.size > len(data):
+                raise cls.InvalidTraceException('truncated event')
+            eventType, session, delta, duration, length = \
+                cls.EVENT.unpack_from(data, pos)
+            pos += cls.EVENT.size
+            events.append((eventType.decode('ascii'), session, delta / 1e6,
+                           duration / 1e6, data[pos:pos + length]))
+            pos += length
+
+        return events
+
+
+class TraceRecorder:
+    """
+    Port factory for Communicator.portFactory, which opens real serial ports
+    and records all their calls into one trace file.
+    """
+
+    def __init__(self, filePath):
+        """
+        constructor
+
+        @param filePath path to the trace file, which is overwritten
+        """
+        self.fp = open(filePath, 'wb')
+        self.fp.write(SerialTrace.MAGIC + bytes([SerialTrace.VERSION]))
+        self.lock = threading.Lock()
+        self.lastTime = time.perf_counter()
+        self.sessions = 0
+
+    def __call__(self, port, *args, **kwargs):
+        """
+        Opens and records a port.
+
+        @param port name of the port
+        @param args further arguments of serial.Serial
+        @param kwargs further keyword arguments of serial.Serial
+        @return the recording port
+        """
+        startTime = time.perf_counter()
+        serialPort = Communicator.openSerial(port, *args, **kwargs)
+        with self.lock:
+            session = self.sessions
+            self.sessions += 1
+        self.record(b'o', session, startTime, port.encode('utf-8'))
+        return RecordingPort(self, session, serialPort)
+
+    def record(self, eventType, session, startTime, payload=b''):
+        """
+        Appends an event to the trace file.
+
+        @param eventType type of the event as byte
+        @param session id of the port session
+        @param startTime time (perf_counter) at the start of the call
+        @param payload data of the event
+        """
+        endTime = time.perf_counter()
+        with self.lock:
+            delta = max(0, startTime - self.lastTime)
+            self.lastTime = max(self.lastTime, startTime)
+            self.fp.write(SerialTrace.EVENT.pack(
+                eventType, session,
+                min(SerialTrace.MAX_TIME, int(delta * 1e6)),
+                min(SerialTrace.MAX_TIME, int((endTime - startTime) * 1e6)),
+                len(payload)) + payload)
+            self.fp.flush()
+
+    def close(self):
+        """
+        Closes the trace file.
+        """
+        with self.lock:
+            self.fp.close()
+
+
+class RecordingPort:
+    """
+    Serial port, which records its calls; all other attributes are read from
+    and written to the real port (e.g. timeout or dtr).
+    """
+
+    # Attributes of the recording port itself
+    LOCAL_ATTRIBUTES = ('recorder', 'session', 'serialPort')
+
+    def __init__(self, recorder, session, serialPort):
+        """
+        constructor
+
+        @param recorder the TraceRecorder
+        @param session id of the port session
+        @param serialPort the real serial port
+        """
+        self.recorder = recorder
+        self.session = session
+        self.serialPort = serialPort
+
+    def __getattr__(self, name):
+        """
+        Passes unrecorded attributes to the real port.
+        """
+        return getattr(self.serialPort, name)
+
+    def __setattr__(self, name, value):
+        """
+        Passes unrecorded attributes to the real port.
+        """
+        if name in self.LOCAL_ATTRIBUTES:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.serialPort, name, value)
+
+    def write(self, data):
+        """
+        Writes and records data.
+        """
+        startTime = time.perf_counter()
+        result = self.serialPort.write(data)
+        self.recorder.record(b'w', self.session, startTime, bytes(data))
+        return result
+
+    def read(self, size=1):
+        """
+        Reads and records data.
+        """
+        startTime = time.perf_counter()
+        data = self.serialPort.read(size)
+        self.recorder.record(b'r', self.session, startTime, data)
+        return data
+
+    def flush(self):
+        """
+        Flushes the port.
+        """
+        startTime = time.perf_counter()
+        self.serialPort.flush()
+        self.recorder.record(b'f', self.session, startTime)
+
+    def close(self):
+        """
+        Closes the port.
+        """
+        startTime = time.perf_counter()
+        self.serialPort.close()
+        self.recorder.record(b'c', self.session, startTime)
+
+
+class TraceReplayer:
+    """
+    Port factory for Communicator.portFactory, which replays a trace file
+    instead of opening serial ports. The ports are handed out in the order
+    they were opened in the recording.
+    """
+
+    def __init__(self, filePath, speed=1.0, strict=True):
+        """
+        constructor
+
+        @param filePath path to the trace file
+        @param speed factor, by which the recorded durations are shortened;
+            0 replays without any delay
+        @param strict True to check that the written bytes equal the
+            recording
+        """
+        self.speed = speed
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.sessions = deque()  # Events of every session in opening order
+        sessionEvents = {}
+        for event in SerialTrace.readEvents(filePath):
+            if event[0] == 'o':
+                sessionEvents[event[1]] = deque()
+                self.sessions.append((event[4].decode('utf-8'),
+                                      sessionEvents[event[1]]))
+            elif event[1] in sessionEvents:
+                sessionEvents[event[1]].append(event)
+
+    def __call__(self, port, *args, **kwargs):
+        """
+        Returns the next recorded port.
+
+        @param port name of the port
+        @return the replaying port
+        @raise ReplayMismatchException no further port was recorded
+        """
+        with self.lock:
+            if len(self.sessions) == 0:
+                raise SerialTrace.ReplayMismatchException(None, ('open', port))
+            recordedPort, events = self.sessions.popleft()
+        if self.strict and recordedPort != port:
+            raise SerialTrace.ReplayMismatchException(('open', recordedPort),
+                                                      ('open', port))
+        return ReplayPort(self, port, events)
+
+
+class ReplayPort:
+    """
+    Serial port, which answers with the recorded data. The settings of
+    serial ports (e.g. timeout or dtr) can be set, but have no effect.
+    """
+
+    def __init__(self, replayer, port, events):
+        """
+        constructor
+
+        @param replayer the TraceReplayer
+        @param port name of the port
+        @param events deque of the recorded events of the port
+        """
+        self.replayer = replayer
+        self.port = port
+        self.events = events
+        self.is_open = True
+        self.timeout = None
+        self.write_timeout = None
+        self.baudrate = Communicator.BAUD_RATE
+        self.dtr = False
+        self.rts = False
+
+    def nextEvent(self, eventType, payload=None):
+        """
+        Takes the next recorded event and waits as long as the recorded call.
+
+        @param eventType the expected type of the event
+        @param payload the expected payload (only checked if strict)
+        @return the payload of the recorded event
+        @raise ReplayMismatchException the call differs from the recording
+        """
+        if len(self.events) == 0 or self.events[0][0] != eventType:
+            recorded = self.events[0][0] if len(self.events) != 0 else None
+            raise SerialTrace.ReplayMismatchException(recorded, eventType)
+
+        recordedType, session, delta, duration, recordedPayload = \
+            self.events.popleft()
+        if self.replayer.strict and payload is not None and \
+                payload != recordedPayload:
+            raise SerialTrace.ReplayMismatchException(
+                (recordedType, recordedPayload), (eventType, payload))
+
+        if self.replayer.speed > 0:
+            time.sleep(duration / self.replayer.speed)
+        return recordedPayload
+
+    def write(self, data):
+        """
+        Replays a write.
+        """
+        self.nextEvent('w', bytes(data))
+        return len(data)
+
+    def read(self, size=1):
+        """
+        Replays a read.
+        """
+        return self.nextEvent('r')[:size]
+
+    def flush(self):
+        """
+        Replays a flush.
+        """
+        self.nextEvent('f')
+
+    def close(self):
+        """
+        Replays the closing of the port.
+        """
+        self.is_open = False
+        self.nextEvent('c')
+
+
+def main(argv):
+    """
+    Command line interface:
+        SerialTrace.py dump TRACE
+        SerialTrace.py replay TRACE CLIP [--slot SLOT] [--speed SPEED]
+    replay uploads the clip against the recording like the GUI does and
+    prints the telemetry report as JSON.
+
+    @param argv the arguments without the program name
+    @return the exit code
+    """
+    parser = argparse.ArgumentParser(prog='SerialTrace.py')
+    commands = parser.add_subparsers(dest='command')
+    dumpParser = commands.add_parser('dump', help='print the events')
+    dumpParser.add_argument('trace')
+    replayParser = commands.add_parser('replay',
+                                       help='replay an upload of a clip')
+    replayParser.add_argument('trace')
+    replayParser.add_argument('clip')
+    replayParser.add_argument('--slot', type=int)
+    replayParser.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        for eventType, session, delta, duration, payload in \
+                SerialTrace.readEvents(args.trace):
+            print('{0} #{1:d} +{2:.6f}s {3:.6f}s {4}'.format(
+                eventType, session, delta, duration, payload.hex()
+                if eventType != 'o' else payload.decode('utf-8')))
+        return 0
+
+    if args.command == 'replay':
+        replayer = TraceReplayer(args.trace, args.speed)
+        if len(replayer.sessions) == 0:
+            print('The trace contains no port.', file=sys.stderr)
+            return 1
+        port = replayer.sessions[0][0]
+        clip = Clip(args.clip)
+
+        Communicator.portFactory = replayer
+        Communicator.telemetry = TransmissionTelemetry(port)
+        try:
+            Communicator.start(port, args.slot)
+            for frame in clip.export():
+                Communicator.transmitFrame(frame)
+            Communicator.end()
+            with Communicator.measure('verification'):
+                verified = Communicator.verify(port, clip, args.slot)
+        finally:
+            report = Communicator.telemetry.report()
+            Communicator.telemetry = None
+            Communicator.portFactory = None
+        report['verified'] = verified
+        print(json.dumps(report, indent=2))
+        return 0 if verified else 1
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
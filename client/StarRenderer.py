@@ -1,8 +1,103 @@
 """
 Renders the stars onto the canvas
 """
-from PyQt5.QtGui import QBrush, QColor
-from PyQt5.QtWidgets import QGraphicsEllipseItem
+from PyQt5.QtCore import QRectF, Qt
+from PyQt5.QtGui import QBrush, QColor, QImage, QPainter
+from PyQt5.QtWidgets import QGraphicsEllipseItem, QGraphicsItem
+from Profiler import Profiler
+
+
+def changedStars(oldSetup, newSetup, starCount):
+    """
+    Returns the stars, which differ between two setups. Only the differing
+    bits are visited, so small changes of large matrices are cheap.
+
+    @param oldSetup the shown setup as integer
+    @param newSetup the new setup as integer
+    @param starCount amount of stars within a frame
+    @return generator of tuples of the star id and its new state
+    """
+    diff = oldSetup ^ newSetup
+    while diff != 0:
+        lowestBit = diff & -diff
+        bit = lowestBit.bit_length() - 1
+        yield starCount - bit - 1, (newSetup & lowestBit) != 0
+        diff ^= lowestBit
+
+
+class Stroke:
+    """
+    Stars painted by dragging the mouse across the canvas. The first star
+    decides whether the stroke paints (it was off) or erases (it was on).
+    The stars are only collected while dragging; the clip is changed once,
+    when the stroke ends (see Clip.paintStars).
+    """
+
+    STEP = 2  # Distance of the sampled positions between two events (px)
+
+    def __init__(self, renderer, setup, starId, position, frameIds):
+        """
+        constructor
+
+        @param renderer the renderer of the canvas (for starAt)
+        @param setup the setup of the shown frame
+        @param starId id of the first star
+        @param position the position of the first star within the scene
+        @param frameIds tuple of the first and the last frame id, which get
+            the stroke
+        """
+        self.renderer = renderer
+        self.setup = setup
+        self.starCount = renderer.clip.starCount
+        self.state = ((setup >> (self.starCount - starId - 1)) & 1) == 0
+        self.stars = 0  # Mask of the painted stars
+        self.frameIds = frameIds
+        self.position = position
+        self.addStar(starId)
+
+    def addStar(self, starId):
+        """
+        Adds a star to the stroke.
+
+        @param starId id of the star
+        @return True if the star is new
+        """
+        bit = 1 << (self.starCount - starId - 1)
+        if self.stars & bit:
+            return False
+        self.stars |= bit
+        return True
+
+    def moveTo(self, position, transform):
+        """
+        Adds the stars between the previous and a new position of the mouse,
+        so fast movements don't skip stars.
+
+        @param position the new position within the scene
+        @param transform the transformation of the view
+        @return True if stars were added
+        """
+        start = self.position
+        delta = position - start
+        steps = max(1, int(max(abs(delta.x()), abs(delta.y())) // self.STEP))
+        added = False
+        for step in range(1, steps + 1):
+            starId = self.renderer.starAt(start + delta * (step / steps),
+                                          transform)
+            if starId is not None and self.addStar(starId):
+                added = True
+        self.position = position
+        return added
+
+    def preview(self):
+        """
+        Returns the shown frame with the stroke applied.
+
+        @return the setup as integer
+        """
+        if self.state:
+            return self.setup | self.stars
+        return self.setup & ~self.stars
 
 
 class StarRenderer:
@@ -24,6 +119,7 @@ class StarRenderer:
         self.offBrush = QBrush(QColor(100, 100, 100))
         self.onBrush = QBrush(QColor(200, 200, 200))
 
+        self.scene = scene
         self.clip = clip
 
         self.stars = []
@@ -33,6 +129,7 @@ class StarRenderer:
             scene.addItem(star)
             self.stars.append(star)
             starId += 1
+        self.shownSetup = 0  # All stars are off
 
         self.update()
 
@@ -45,17 +142,44 @@ class StarRenderer:
         self.clip = clip
         self.update()
 
+    @Profiler.timed('StarRenderer.update')
     def update(self):
         """
-        Updates the canvas.
+        Updates the canvas; only the changed stars get a new brush.
+        """
+        self.show(self.clip.frames[self.clip.activeFrame].export())
+
+    def show(self, setup):
         """
+        Shows a setup, e.g. the preview of a stroke, which isn't part of the
+        clip yet.
 
-        setup = self.clip.getSetup()
-        for star in self.stars:
-            if setup[star.starId]:
-                star.setBrush(self.onBrush)
-            else:
-                star.setBrush(self.offBrush)
+        @param setup the setup as integer (see Frame.export)
+        """
+        for starId, state in changedStars(self.shownSetup, setup,
+                                          len(self.stars)):
+            self.stars[starId].setBrush(self.onBrush if state
+                                        else self.offBrush)
+        self.shownSetup = setup
+
+    def starAt(self, pos, transform):
+        """
+        Returns the star at a position of the scene.
+
+        @param pos the position within the scene
+        @param transform the transformation of the view
+        @return id of the star or None
+        """
+        item = self.scene.itemAt(pos, transform)
+        return item.starId if isinstance(item, StarEllipse) else None
+
+    def imageBytes(self):
+        """
+        Returns the memory of the images of the renderer.
+
+        @return the size in bytes (the stars are items without images)
+        """
+        return 0
 
 
 class StarEllipse(QGraphicsEllipseItem):
@@ -74,3 +198,147 @@ class StarEllipse(QGraphicsEllipseItem):
         super().__init__(position[0], position[1], 13, 13)
         self.setBrush(brush)
         self.starId = id
+
+
+class MatrixRenderer:
+    """
+    Renders a matrix of any size as a single image. The stars are laid out
+    line by line; only the stars, which changed since the last update, are
+    painted and repainted on the canvas.
+    """
+
+    SCENE_SIZE = 720  # Maximum width and height of the matrix in pixels
+    MAX_CELL_SIZE = 24  # Maximum size of a single star in pixels
+
+    def __init__(self, scene, clip):
+        """
+        constructor
+
+        @param scene the scene the matrix is put on
+        @param clip the clip object
+        """
+
+        # Color of the stars in on and off mode
+        self.offColor = QColor(100, 100, 100)
+        self.onColor = QColor(200, 200, 200)
+
+        self.item = MatrixItem()
+        scene.addItem(self.item)
+        self.setClip(clip)
+
+    def setClip(self, clip):
+        """
+        Sets the current clip and paints the whole matrix.
+
+        @param clip the new clip
+        """
+        self.clip = clip
+        self.cellSize = max(1, min(self.MAX_CELL_SIZE, self.SCENE_SIZE //
+                                   max(clip.width, clip.height)))
+        self.item.resize(clip.width * self.cellSize,
+                         clip.height * self.cellSize)
+
+        painter = QPainter(self.item.image)
+        for starId in range(clip.starCount):
+            painter.fillRect(self.cellRect(starId), self.offColor)
+        painter.end()
+        self.shownSetup = 0  # All stars are off
+        self.item.update()
+
+        self.update()
+
+    @Profiler.timed('MatrixRenderer.update')
+    def update(self):
+        """
+        Updates the canvas; only the changed stars are painted.
+        """
+        self.show(self.clip.frames[self.clip.activeFrame].export())
+
+    def show(self, setup):
+        """
+        Shows a setup, e.g. the preview of a stroke, which isn't part of the
+        clip yet.
+
+        @param setup the setup as integer (see Frame.export)
+        """
+        painter = QPainter(self.item.image)
+        for starId, state in changedStars(self.shownSetup, setup,
+                                          self.clip.starCount):
+            rect = self.cellRect(starId)
+            painter.fillRect(rect, self.onColor if state else self.offColor)
+            self.item.update(rect)
+        painter.end()
+        self.shownSetup = setup
+
+    def cellRect(self, starId):
+        """
+        Returns the area of a star within the image.
+
+        @param starId id of the star
+        @return the area as QRectF
+        """
+        gap = 1 if self.cellSize > 3 else 0  # Keep the stars apart
+        y, x = divmod(starId, self.clip.width)
+        return QRectF(x * self.cellSize + gap, y * self.cellSize + gap,
+                      self.cellSize - 2 * gap, self.cellSize - 2 * gap)
+
+    def starAt(self, pos, transform):
+        """
+        Returns the star at a position of the scene.
+
+        @param pos the position within the scene
+        @param transform the transformation of the view (unused)
+        @return id of the star or None
+        """
+        x = int(pos.x() // self.cellSize)
+        y = int(pos.y() // self.cellSize)
+        if 0 <= x < self.clip.width and 0 <= y < self.clip.height:
+            return y * self.clip.width + x
+        return None
+
+    def imageBytes(self):
+        """
+        Returns the memory of the images of the renderer.
+
+        @return the size in bytes
+        """
+        image = self.item.image
+        return image.bytesPerLine() * image.height()
+
+
+class MatrixItem(QGraphicsItem):
+    """
+    Shows an image and repaints only its exposed parts.
+    """
+
+    def __init__(self):
+        """
+        constructor
+        """
+        super().__init__()
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.image = QImage(1, 1, QImage.Format_ARGB32)
+
+    def resize(self, width, height):
+        """
+        Replaces the image by a transparent one.
+
+        @param width width of the image in pixels
+        @param height height of the image in pixels
+        """
+        self.prepareGeometryChange()
+        self.image = QImage(width, height, QImage.Format_ARGB32)
+        self.image.fill(Qt.transparent)
+
+    def boundingRect(self):
+        """
+        Returns the area of the image.
+        """
+        return QRectF(0, 0, self.image.width(), self.image.height())
+
+    def paint(self, painter, option, widget=None):
+        """
+        Paints the exposed part of the image.
+        """
+        rect = option.exposedRect
+        painter.drawImage(rect, self.image, rect)
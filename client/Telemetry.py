@@ -0,0 +1,159 @@
+"""
+Telemetry of clip transmissions
+"""
+
+import json
+import time
+from contextlib import contextmanager
+
+
+class TransmissionTelemetry:
+    """
+    Collects the timings of a single transmission to a device.
+    All durations are measured in seconds.
+    """
+
+    PERCENTILES = (50, 90, 99)  # Reported percentiles of the round trip time
+
+    def __init__(self, port=None):
+        """
+        constructor
+
+        @param port port of the Nightsky device
+        """
+        self.port = port
+        self.startTime = time.time()
+        self.phases = {}  # Phase name -> accumulated duration
+        self.frameWriteTimes = []  # Time to write each frame
+        self.frameAckTimes = []  # Time to receive the ack of each frame
+        self.frameBytes = 0  # Bytes sent as part of frames
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.errors = {}  # Error type -> amount
+        self.listeners = []  # Callbacks, which get (event, data)
+
+    def addListener(self, listener):
+        """
+        Adds a callback, which is called for every recorded event.
+
+        @param listener callable with the parameters event name and a dict
+            with the event data
+        """
+        self.listeners.append(listener)
+
+    def notify(self, event, data):
+        """
+        Calls all listeners.
+
+        @param event name of the event
+        @param data dict with the event data
+        """
+        for listener in self.listeners:
+            listener(event, data)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measures the duration of a phase (e.g. port open or handshake).
+        Phases with the same name are accumulated.
+
+        @param name name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+            self.notify('phase', {'name': name, 'duration': duration})
+
+    def recordFrame(self, writeTime, ackTime, sent, received):
+        """
+        Records the transmission of a single frame.
+
+        @param writeTime time to write the frame
+        @param ackTime time until the ack was received
+        @param sent amount of sent bytes
+        @param received amount of received bytes
+        """
+        self.frameWriteTimes.append(writeTime)
+        self.frameAckTimes.append(ackTime)
+        self.frameBytes += sent
+        self.addTraffic(sent, received)
+        self.notify('frame', {'frame': len(self.frameAckTimes) - 1,
+                              'write': writeTime, 'ack': ackTime})
+
+    def addTraffic(self, sent, received):
+        """
+        Adds transferred bytes outside of frames (e.g. handshakes).
+
+        @param sent amount of sent bytes
+        @param received amount of received bytes
+        """
+        self.bytesSent += sent
+        self.bytesReceived += received
+
+    def recordError(self, errorType):
+        """
+        Records an error.
+
+        @param errorType name of the error
+        """
+        self.errors[errorType] = self.errors.get(errorType, 0) + 1
+        self.notify('error', {'type': errorType})
+
+    @staticmethod
+    def percentile(values, p):
+        """
+        Returns the p-th percentile (nearest rank) of the values.
+
+        @param values list of numbers
+        @param p the percentile between 0 and 100
+        @return the percentile or None, if there are no values
+        """
+        if len(values) == 0:
+            return None
+
+        ordered = sorted(values)
+        rank = max(0, -(-p * len(ordered) // 100) - 1)  # ceil(p * n) - 1
+        return ordered[rank]
+
+    def report(self):
+        """
+        Summarizes the transmission.
+
+        @return dict with the phases, throughput, round trip times and errors
+        """
+        rtts = [write + ack for write, ack in zip(self.frameWriteTimes,
+                                                  self.frameAckTimes)]
+        frameTime = sum(rtts)
+        totalTime = sum(self.phases.values()) + frameTime
+
+        rtt = {'p{0:d}'.format(p): self.percentile(rtts, p)
+               for p in self.PERCENTILES}
+        rtt['max'] = max(rtts) if len(rtts) != 0 else None
+
+        return {
+            'port': self.port,
+            'startTime': self.startTime,
+            'phases': dict(self.phases),
+            'frames': len(rtts),
+            'bytesSent': self.bytesSent,
+            'bytesReceived': self.bytesReceived,
+            'bytesPerSecond': (self.bytesSent + self.bytesReceived) / totalTime
+            if totalTime > 0 else None,
+            'frameBytesPerSecond': self.frameBytes / frameTime
+            if frameTime > 0 else None,
+            'rtt': rtt,
+            'errors': dict(self.errors),
+        }
+
+    def writeJsonLine(self, filePath):
+        """
+        Appends the report as a single JSON line to a file.
+
+        @param filePath path to the log file
+        """
+        fp = open(filePath, 'a')
+        fp.write(json.dumps(self.report()) + '\n')
+        fp.close()
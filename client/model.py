@@ -3,7 +3,8 @@ Models to represent the clip
 """
 
 import json
-from array import array
+import os
+from FrameSequence import FrameSequence
 
 
 class Clip:
@@ -36,15 +37,35 @@ class Clip:
             """
             super().__init__(self, 'Missing file path.')
 
-    def __init__(self, filePath=None):
+    WIDTH = 6  # Stars per line of the Nightsky device
+    HEIGHT = 5  # Lines of the Nightsky device
+    DURATION_BITS = 10  # Bits of the duration of a packed frame
+    MAX_RECORD_DURATION = 2 ** DURATION_BITS - 1  # Maximum packed duration
+
+    def __init__(self, filePath=None, width=WIDTH, height=HEIGHT):
         """
         constructor
 
         @param filePath name of file, where a clip could be saved
+        @param width stars per line of the matrix
+        @param height lines of the matrix
         """
         self.filePath = filePath
+        self.width = width
+        self.height = height
         self.curFrame = -1
-        self.frames = []
+        self.frames = FrameSequence()
+        # Content index: setup -> [shared frame, amount of uses in frames]
+        self.frameIndex = {}
+        # Incremented by every change of the frames (for derived indices)
+        self.revision = 0
+        # Callbacks, which get every edit of the frames (see applyEdit)
+        self.listeners = []
+        # Revision and frames of the last snapshot (shared by snapshots)
+        self.snapshotFrames = (None, None)
+        # Sequence number of the last journaled edit, which the clip contains
+        # (see Journal); saved with the clip
+        self.journalSequence = 0
         if filePath is not None:
             self.load(filePath)
 
@@ -57,6 +78,32 @@ class Clip:
         """
         return len(self.frames)
 
+    @property
+    def starCount(self):
+        """
+        returns the number of stars within a frame
+
+        @return the amount of stars
+        """
+        return self.width * self.height
+
+    @property
+    def recordSize(self):
+        """
+        returns the size of a packed frame (5 byte on the Nightsky device)
+
+        @return the size in byte
+        """
+        return -(-(self.starCount + self.DURATION_BITS) // 8)
+
+    def fitsDevice(self):
+        """
+        Checks whether the clip has the geometry of the Nightsky device.
+
+        @return True if the clip can be played by the device
+        """
+        return self.width == self.WIDTH and self.height == self.HEIGHT
+
     @property
     def activeFrame(self):
         """
@@ -64,6 +111,139 @@ class Clip:
         """
         return self.curFrame
 
+    # ==== Edits ====
+    def changed(self, *edit):
+        """
+        Announces an edit of the frames to the listeners.
+
+        @param edit the edit as tuple (see applyEdit)
+        """
+        self.revision += 1
+        for listener in self.listeners:
+            listener(edit)
+
+    def applyEdit(self, edit):
+        """
+        Applies an edit as announced by changed (e.g. from a journal).
+        Edits are tuples of the form:
+            ('insert', frameId, setup, duration)
+            ('set', frameId, setup, duration)
+            ('remove', frameId)
+            ('move', frameId, newFrameId)
+            ('paint', firstFrameId, lastFrameId, stars, state)
+        The duration is optional and defaults to 1. A paint edit turns the
+        stars (a setup mask) on or off in a range of frames (see
+        paintStars).
+
+        @param edit the edit as tuple
+        """
+        op = edit[0]
+        if op == 'insert':
+            self.frames.insert(edit[1], self.useFrame(*edit[2:4]))
+        elif op == 'set':
+            self.releaseFrame(self.frames[edit[1]])
+            self.frames[edit[1]] = self.useFrame(*edit[2:4])
+        elif op == 'remove':
+            self.releaseFrame(self.frames[edit[1]])
+            del self.frames[edit[1]]
+        elif op == 'move':
+            frame = self.frames[edit[1]]
+            del self.frames[edit[1]]
+            self.frames.insert(edit[2], frame)
+        elif op == 'paint':
+            self.paintFrames(*edit[1:5])
+
+        # Keep the active frame within the clip
+        self.curFrame = min(max(self.curFrame, 0), self.size - 1)
+        self.changed(*edit)
+
+    def snapshot(self):
+        """
+        Returns a read-only copy of the current state of the clip for
+        background jobs (uploads, exports, saves), which may run while the
+        clip is edited. The frames are immutable and shared with the clip;
+        the snapshot shares the chunks of the frame sequence as well, so only
+        the list of chunks is copied, once per revision.
+
+        @return the ClipSnapshot
+        """
+        if self.snapshotFrames[0] != self.revision:
+            self.snapshotFrames = (self.revision, self.frames.freeze())
+        return ClipSnapshot(self, self.snapshotFrames[1])
+
+    # ==== Frame interning ====
+    def internFrame(self, setup, duration=1):
+        """
+        Returns the shared, immutable frame with the given setup and
+        duration. Every frame within the clip is interned, so identical
+        frames are one instance. The frame has to be registered with
+        useFrame, when it's put into the clip.
+
+        @param setup the setup as integer (see Frame.export)
+        @param duration duration of the frame in animation steps
+        @return the shared frame
+        """
+        entry = self.frameIndex.get((setup, duration))
+        if entry is None:
+            frame = Frame.fromExport(setup, self.starCount, duration)
+            frame.frozen = True
+            entry = [frame, 0]
+            self.frameIndex[(setup, duration)] = entry
+        return entry[0]
+
+    def useFrame(self, setup, duration=1):
+        """
+        Interns a frame and counts the new use of it.
+
+        @param setup the setup as integer
+        @param duration duration of the frame in animation steps
+        @return the shared frame
+        """
+        frame = self.internFrame(setup, duration)
+        self.frameIndex[(setup, duration)][1] += 1
+        return frame
+
+    def releaseFrame(self, frame):
+        """
+        Counts a removed use of a frame and drops unused frames from the
+        index.
+
+        @param frame the shared frame
+        """
+        key = (frame.export(), frame.duration)
+        entry = self.frameIndex[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.frameIndex[key]
+
+    def countFrame(self, frame):
+        """
+        Returns how often a frame with the same setup and duration is used in
+        the clip.
+
+        @param frame a frame
+        @return the amount of identical frames
+        """
+        entry = self.frameIndex.get((frame.export(), frame.duration))
+        return 0 if entry is None else entry[1]
+
+    @property
+    def uniqueFrameCount(self):
+        """
+        returns the number of distinct frames within the clip
+
+        @return the amount of distinct frames
+        """
+        return len(self.frameIndex)
+
+    def hasDuplicates(self):
+        """
+        Checks whether the clip contains identical frames.
+
+        @return True if at least one frame is used more than once
+        """
+        return len(self.frameIndex) < len(self.frames)
+
     # ==== Frame management ====
     def setActiveFrame(self, frameId):
         """
@@ -104,17 +284,15 @@ class Clip:
         """
 
         # Move the frame
-        frame = self.frames[self.curFrame]
-        del self.frames[self.curFrame]
+        oldPos = self.curFrame
+        frame = self.frames[oldPos]
+        del self.frames[oldPos]
+        newPos = max(0, min(newPos, len(self.frames)))
         self.frames.insert(newPos, frame)
 
         # Set current frame to the new position
-        if newPos < 0:
-            self.curFrame = 0
-        elif newPos > len(self.frames) - 1:
-            self.curFrame = len(self.frames) - 1
-        else:
-            self.curFrame = newPos
+        self.curFrame = newPos
+        self.changed('move', oldPos, newPos)
 
     def moveFrameUp(self):
         """
@@ -134,8 +312,8 @@ class Clip:
         """
         adds a new frame
         """
-        setup = [False for i in range(30)]
-        self.frames.append(Frame(setup))
+        self.frames.append(self.useFrame(0))
+        self.changed('insert', self.size - 1, 0)
 
     def insertFrame(self, pos):
         """
@@ -143,19 +321,23 @@ class Clip:
 
         @param pos position of the new frame as index
         """
-        setup = [False for i in range(30)]
-        self.frames.insert(pos, Frame(setup))
+        pos = max(0, min(pos, self.size))
+        self.frames.insert(pos, self.useFrame(0))
+        self.changed('insert', pos, 0)
 
     def copyFrame(self):
         """
         Copies the current frame and add the copy directly after the current
-        frame.
+        frame. Both share the same frame until one of them is edited.
         Has no effect if the clip is empty.
         """
 
         if self.size != 0:
-            frame = self.frames[self.curFrame].copy()
-            self.frames.insert(self.curFrame+1, frame)
+            frame = self.frames[self.curFrame]
+            self.frames.insert(self.curFrame+1,
+                               self.useFrame(frame.export(), frame.duration))
+            self.changed('insert', self.curFrame+1, frame.export(),
+                         frame.duration)
 
     def removeFrame(self, frameId):
         """
@@ -165,7 +347,7 @@ class Clip:
         """
 
         if frameId < 0 or frameId >= self.size:
-            raise self.__class__.FrameIdOutOfBoundException
+            raise self.__class__.FrameIdOutOfBoundException(frameId)
 
         if frameId <= self.curFrame:
             self.curFrame -= 1
@@ -174,7 +356,9 @@ class Clip:
         if self.curFrame == -1 and self.size != 0:
             self.curFrame = 0
 
+        self.releaseFrame(self.frames[frameId])
         del self.frames[frameId]
+        self.changed('remove', frameId)
 
     def getSetup(self):
         """
@@ -183,18 +367,111 @@ class Clip:
         @param the setup as list of boolean values (True means on and False
             means off)
         """
-        return [self.frames[self.activeFrame].getStarState(i)
-                for i in range(30)]
+        return self.frames[self.activeFrame].getSetup()
 
     def setStarState(self, starId, state):
         """
         sets the state of the star with starId in the current frame
+        (copy-on-write: the shared frame is replaced by the edited one)
 
         @param starId id of the star
         @param state True for star is on and False for star is off
         @raise StarOutOfBoundException starId doesn't exist
         """
-        self.frames[self.curFrame].setStarState(starId, state)
+        frame = self.frames[self.curFrame]
+        setup = frame.withStarState(starId, state)
+        if setup != frame.export():
+            self.releaseFrame(frame)
+            self.frames[self.curFrame] = self.useFrame(setup, frame.duration)
+            self.changed('set', self.curFrame, setup, frame.duration)
+
+    def setActiveSetup(self, setup):
+        """
+        Replaces all stars of the current frame in a single edit.
+
+        @param setup the setup as integer (see Frame.export)
+        """
+        setup &= (1 << self.starCount) - 1
+        frame = self.frames[self.curFrame]
+        if setup != frame.export():
+            self.releaseFrame(frame)
+            self.frames[self.curFrame] = self.useFrame(setup, frame.duration)
+            self.changed('set', self.curFrame, setup, frame.duration)
+
+    def paintStars(self, firstFrameId, lastFrameId, stars, state):
+        """
+        Turns stars on or off in a range of frames in a single edit (e.g. a
+        stroke across the canvas). Frames, which don't change, keep their
+        shared frame.
+
+        @param firstFrameId id of the first frame
+        @param lastFrameId id of the last frame (inclusive)
+        @param stars the stars as setup mask (see Frame.export)
+        @param state True to turn the stars on, False to turn them off
+        @return the amount of changed frames
+        """
+        changedCount = self.paintFrames(firstFrameId, lastFrameId, stars,
+                                        state)
+        if changedCount != 0:
+            self.changed('paint', firstFrameId, lastFrameId, stars, state)
+        return changedCount
+
+    def paintFrames(self, firstFrameId, lastFrameId, stars, state):
+        """
+        Applies a paint edit to the frames without announcing it (see
+        paintStars).
+
+        @param firstFrameId id of the first frame
+        @param lastFrameId id of the last frame (inclusive)
+        @param stars the stars as setup mask
+        @param state True to turn the stars on, False to turn them off
+        @return the amount of changed frames
+        """
+        stars &= (1 << self.starCount) - 1
+        changedCount = 0
+        for frameId in range(max(0, firstFrameId),
+                             min(lastFrameId, self.size - 1) + 1):
+            frame = self.frames[frameId]
+            if state:
+                setup = frame.export() | stars
+            else:
+                setup = frame.export() & ~stars
+            if setup != frame.export():
+                self.releaseFrame(frame)
+                self.frames[frameId] = self.useFrame(setup, frame.duration)
+                changedCount += 1
+        return changedCount
+
+    def getDuration(self):
+        """
+        Returns the duration of the currently active frame.
+
+        @return the duration in animation steps (100 ms)
+        """
+        return self.frames[self.curFrame].duration
+
+    def setDuration(self, duration):
+        """
+        Sets the duration of the currently active frame.
+
+        @param duration the duration in animation steps (100 ms); at least 1
+        """
+        duration = max(1, int(duration))
+        frame = self.frames[self.curFrame]
+        if duration != frame.duration:
+            self.releaseFrame(frame)
+            self.frames[self.curFrame] = self.useFrame(frame.export(),
+                                                       duration)
+            self.changed('set', self.curFrame, frame.export(), duration)
+
+    @property
+    def totalDuration(self):
+        """
+        returns the duration of the whole clip
+
+        @return the duration in animation steps (100 ms)
+        """
+        return sum(frame.duration for frame in self.frames)
 
     def toggleStar(self, starId):
         """
@@ -222,19 +499,41 @@ class Clip:
         if filePath is not None:
             self.filePath = filePath
 
-        # Generate data dump for serialization
-        frameDump = []
-        for frame in self.frames:
-            starDump = []
-            for star in frame.stars:
-                starDump.append(star.isOn)
-
-            frameDump.append(starDump)
-
-        # Dump data into file
-        fp = open(self.filePath, 'w')
-        json.dump({'currentFrame': self.curFrame, 'frames': frameDump}, fp)
+        self.writeFile(self.filePath, self.frames, self.curFrame,
+                       self.width, self.height, self.journalSequence)
+
+    @staticmethod
+    def writeFile(filePath, frames, curFrame, width=WIDTH, height=HEIGHT,
+                  journalSequence=0):
+        """
+        writes frames into a json file; the file is replaced atomically, so
+        it's never left half written
+
+        @param filePath path to the file
+        @param frames list of frames
+        @param curFrame id of the active frame
+        @param width stars per line of the matrix
+        @param height lines of the matrix
+        @param journalSequence sequence number of the last journaled edit,
+            which the frames contain (see Journal)
+        """
+
+        # Generate data dump for serialization (setups as hex numbers)
+        setupDump = ['{0:x}'.format(frame.export()) for frame in frames]
+        durationDump = [frame.duration for frame in frames]
+
+        # Dump data into a temporary file and replace the old one with it
+        tmpFilePath = filePath + '.tmp'
+        dump = {'currentFrame': curFrame, 'width': width, 'height': height,
+                'setups': setupDump, 'durations': durationDump}
+        if journalSequence != 0:
+            dump['journal'] = journalSequence
+        fp = open(tmpFilePath, 'w')
+        json.dump(dump, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
         fp.close()
+        os.replace(tmpFilePath, filePath)
 
     def load(self, filePath):
         """
@@ -251,40 +550,83 @@ class Clip:
 
         # Put into Clip object
         self.curFrame = dump['currentFrame']
+        self.width = dump.get('width', self.WIDTH)
+        self.height = dump.get('height', self.HEIGHT)
+        self.journalSequence = dump.get('journal', 0)
+
+        # Older files store the setups as lists of star states
+        if 'setups' in dump:
+            setups = [int(setup, 16) for setup in dump['setups']]
+        else:
+            setups = [Frame(states).export() for states in dump['frames']]
+
+        # Files without durations show every frame for one step
+        durations = dump.get('durations', [1] * len(setups))
+        for setup, duration in zip(setups, durations):
+            self.frames.append(self.useFrame(setup, duration))
+        self.revision += 1  # Loading is no edit, the file already has it
+
+    def importRecords(self, records):
+        """
+        imports compressed frames (counterpart of export); every record
+        becomes a frame with the duration of the record
+
+        @param records list of compressed frames as bytes of the length
+            recordSize
+        """
+        for record in records:
+            duration, setup = self.unpackFrame(record)
+            self.frames.append(self.useFrame(setup, duration))
+            self.changed('insert', self.size - 1, setup, duration)
 
-        for frameSetup in dump['frames']:
-            self.frames.append(Frame(frameSetup))
+        if self.curFrame == -1 and self.size != 0:
+            self.curFrame = 0
 
     def export(self):
         """
         exports the clip to a compressed animation for running on the arduino
 
-        @return a list of compressed frames as bytes of the length 5
+        @return a list of compressed frames as bytes of the length recordSize
         """
 
         # List of bytes, which represents the frames
         exportedFrames = []
-        # Setup of the previous frame
-        curFrameSetup = self.frames[0].export()
-        # Duration of the current frame
-        curFrameDuration = 1
+        # Setup and duration of the current run of identical frames
+        curFrameSetup = None
+        curFrameDuration = 0
 
-        for frame in self.frames[1:]:
+        for frame in self.frames:
             setup = frame.export()
-            if curFrameSetup == setup and curFrameDuration < 2 ** 10:
-                curFrameDuration += 1
+            if setup == curFrameSetup:
+                curFrameDuration += frame.duration
             else:
-                exportedFrames.append(self.packFrame(curFrameDuration,
-                                                     curFrameSetup))
+                if curFrameSetup is not None:
+                    self.packRun(exportedFrames, curFrameDuration,
+                                 curFrameSetup)
                 curFrameSetup = setup
-                curFrameDuration = 1
+                curFrameDuration = frame.duration
 
         # Add last frame
-        exportedFrames.append(self.packFrame(curFrameDuration,
-                                             curFrameSetup))
+        if curFrameSetup is not None:
+            self.packRun(exportedFrames, curFrameDuration, curFrameSetup)
 
         return exportedFrames
 
+    def packRun(self, exportedFrames, duration, setup):
+        """
+        packs a run of identical frames; runs longer than the maximum
+        duration of a packed frame are split
+
+        @param exportedFrames list, which the packed frames are appended to
+        @param duration duration of the run
+        @param setup setup of the frames
+        """
+        while duration > self.MAX_RECORD_DURATION:
+            exportedFrames.append(self.packFrame(self.MAX_RECORD_DURATION,
+                                                 setup))
+            duration -= self.MAX_RECORD_DURATION
+        exportedFrames.append(self.packFrame(duration, setup))
+
     def packFrame(self, duration, setup):
         """
         packs a frame
@@ -292,17 +634,94 @@ class Clip:
         @param duration duration of the frame
         @param setup setup of the frame
         """
-        packedFrame = setup + (duration << 30)
-        # Convert to bytes
-        byteArr = array('B')  # Create array with unsigned chars
-        for i in range(5):
-            byteArr.append((packedFrame >> ((4 - i) * 8)) & 0b11111111)
-        return bytes(byteArr)
+        packedFrame = setup + (duration << self.starCount)
+        return packedFrame.to_bytes(self.recordSize, 'big')
+
+    def unpackFrame(self, packedFrame):
+        """
+        unpacks a frame like the firmware does while loading it
+
+        @param packedFrame compressed frame as bytes of the length
+            recordSize
+        @return tuple of the duration and the setup of the frame
+        """
+        packed = int.from_bytes(packedFrame, 'big')
+        return (packed >> self.starCount,
+                packed & ((1 << self.starCount) - 1))
+
+
+class ClipSnapshot(Clip):
+    """
+    Read-only state of a clip (see Clip.snapshot). It can be read, exported
+    and saved like a clip from any thread; its active frame is its own, so
+    e.g. a playback can step through it. The frame sequence is frozen, so
+    edits fail.
+    """
+
+    def __init__(self, clip, frames):
+        """
+        constructor; the content index of the clip isn't copied, it's only
+        rebuilt if a snapshot needs it
+
+        @param clip the clip
+        @param frames frozen FrameSequence of the current frames of the clip
+        """
+        self.filePath = clip.filePath
+        self.width = clip.width
+        self.height = clip.height
+        self.curFrame = clip.curFrame
+        self.frames = frames
+        self.revision = clip.revision
+        self.journalSequence = clip.journalSequence
+        self.listeners = ()
+        self.snapshotFrames = (self.revision, frames)
+        self.contentIndex = None
+
+    @property
+    def frameIndex(self):
+        """
+        returns the content index of the frames (built on first use)
+
+        @return dictionary setup, duration -> [shared frame, amount of uses]
+        """
+        if self.contentIndex is None:
+            index = {}
+            for frame in self.frames:
+                key = (frame.export(), frame.duration)
+                if key in index:
+                    index[key][1] += 1
+                else:
+                    index[key] = [frame, 1]
+            self.contentIndex = index
+        return self.contentIndex
+
+    def useFrame(self, setup, duration=1):
+        """
+        Fails, because the frames of a snapshot can't be changed; every edit
+        uses or releases a frame before it changes the frames, so it fails
+        before the content index is changed.
+
+        @param setup the setup as integer
+        @param duration duration of the frame in animation steps
+        @raise FrozenSequenceException always
+        """
+        raise FrameSequence.FrozenSequenceException()
+
+    def releaseFrame(self, frame):
+        """
+        Fails like useFrame.
+
+        @param frame the shared frame
+        @raise FrozenSequenceException always
+        """
+        raise FrameSequence.FrozenSequenceException()
 
 
 class Frame:
     """
     Represents a frame (single image) within a clip (animation).
+    The stars are stored as bits of an integer (see export). Frames, which
+    are part of a clip, are shared and therefore frozen.
     """
 
     class StarOutOfBoundException(Exception):
@@ -318,15 +737,66 @@ class Frame:
             """
             super().__init__(self, 'Star {0:d} is out of bound'.format(starId))
 
-    def __init__(self, setup=[]):
+    class FrozenFrameException(Exception):
+        """
+        Exception for modifications of shared frames.
+        """
+
+        def __init__(self):
+            """
+            constructor
+            """
+            super().__init__(self, 'Frame is shared and can\'t be modified.')
+
+    def __init__(self, setup=[], duration=1):
         """
         constructor
 
         @param setup list of stars which are on or off (setup[1] = true means
         star with Id 1 is on)
+        @param duration duration of the frame in animation steps (100 ms)
+        """
+
+        self.starCount = len(setup)
+        self.setup = 0
+        for state in setup:
+            self.setup = (self.setup << 1) | (1 if state else 0)
+        self.duration = duration
+        self.frozen = False
+
+    @classmethod
+    def fromExport(cls, setup, starCount=30, duration=1):
+        """
+        Creates a frame from an exported setup (counterpart of export).
+
+        @param setup the setup as integer
+        @param starCount amount of stars within the frame
+        @param duration duration of the frame in animation steps
+        @return the new frame
         """
+        frame = cls(duration=duration)
+        frame.starCount = starCount
+        frame.setup = setup
+        return frame
 
-        self.stars = [Star(state) for state in setup]
+    def __eq__(self, other):
+        """
+        Frames are equal, if they have the same stars turned on for the same
+        duration.
+        """
+        if self is other:
+            return True
+        if not isinstance(other, Frame):
+            return NotImplemented
+        return (self.setup == other.setup and
+                self.duration == other.duration and
+                self.starCount == other.starCount)
+
+    def __hash__(self):
+        """
+        Hashes the content of the frame.
+        """
+        return hash((self.setup, self.duration, self.starCount))
 
     def getStarState(self, starId):
         """
@@ -337,10 +807,36 @@ class Frame:
         @raise StarOutOfBoundException starId doesn't exist
         """
 
-        if starId < 0 or starId >= len(self.stars):
-            raise self.__class__.StarOutOfBoundException()
+        if starId < 0 or starId >= self.starCount:
+            raise self.__class__.StarOutOfBoundException(starId)
+
+        return (self.setup >> (self.starCount - starId - 1)) & 1 == 1
+
+    def getSetup(self):
+        """
+        Returns the states of all stars.
+
+        @return list of boolean values (True means on and False means off)
+        """
+        return [(self.setup >> (self.starCount - i - 1)) & 1 == 1
+                for i in range(self.starCount)]
+
+    def withStarState(self, starId, state):
+        """
+        Returns the setup of this frame with a changed star, without
+        modifying the frame.
+
+        @param starId id of the star
+        @param state the desired state (True means on and False means off)
+        @return the changed setup as integer
+        @raise StarOutOfBoundException starId doesn't exist
+        """
+
+        if starId < 0 or starId >= self.starCount:
+            raise self.__class__.StarOutOfBoundException(starId)
 
-        return self.stars[starId].isOn
+        bit = 1 << (self.starCount - starId - 1)
+        return (self.setup | bit) if state else (self.setup & ~bit)
 
     def setStarState(self, starId, state):
         """
@@ -348,12 +844,13 @@ class Frame:
 
         @param starId id of the star
         @param state the desired state (True means on and False means off)
+        @raise FrozenFrameException the frame is shared
         """
 
-        if starId < 0 or starId >= len(self.stars):
-            raise self.__class__.StarOutOfBoundException()
+        if self.frozen:
+            raise self.__class__.FrozenFrameException()
 
-        self.stars[starId].isOn = state
+        self.setup = self.withStarState(starId, state)
 
     def export(self):
         """
@@ -362,32 +859,10 @@ class Frame:
 
         @return the setup as integer
         """
-
-        i = 1
-        setup = 0
-        # Generate number
-        for star in self.stars:
-            if star.isOn:
-                setup += 1 << (len(self.stars) - i)
-            i += 1
-
-        return setup
+        return self.setup
 
     def copy(self):
         """
-        Returns a hard copy of this frame.
-        """
-        setup = [star.isOn for star in self.stars]
-        return Frame(setup)
-
-
-class Star:
-    """
-    Represents a star.
-    """
-
-    def __init__(self, isOn=False):
-        """
-        constructor
+        Returns a modifiable copy of this frame.
         """
-        self.isOn = isOn
+        return self.fromExport(self.setup, self.starCount, self.duration)
@@ -0,0 +1,37 @@
+"""
+Tests of the star by star merge of ClipDiff
+"""
+
+import unittest
+from ClipDiff import ClipDiff
+
+
+class MergeFramesTest(unittest.TestCase):
+    """
+    Frames modified on both sides
+    """
+
+    def testStarsChangedOnBothSides(self):
+        """
+        A star switched the same way on both sides keeps its new state.
+        """
+        merged = ClipDiff.mergeFrames([(0, 1)], [(3, 1)], [(1, 2)])
+        self.assertEqual(merged, [(3, 2)])
+
+    def testStarsChangedOnOneSide(self):
+        """
+        Stars changed on different sides are combined.
+        """
+        merged = ClipDiff.mergeFrames([(0b0110, 1)], [(0b0111, 1)],
+                                      [(0b1100, 1)])
+        self.assertEqual(merged, [(0b1101, 1)])
+
+    def testConflictingDurations(self):
+        """
+        Different durations on both sides are a conflict.
+        """
+        self.assertIsNone(ClipDiff.mergeFrames([(0, 1)], [(0, 2)], [(0, 3)]))
+
+
+if __name__ == '__main__':
+    unittest.main()